@@ -0,0 +1,181 @@
+"""
+Per-topic acceptance rates for deck prompts, used to size requests.
+
+The builders drop items that fail their layout checks (body_font,
+MAX_CARD_CHARS, a correct answer that is not among the options) and ask
+again for the rest. Recording how many of the items each prompt type
+returned were kept lets the next request for that topic ask for
+remaining / rate items up front, so most decks fill in one round-trip.
+
+Counts live in a small SQLite file next to the response cache and are
+halved once a row passes DECAY_AFTER offered items, so the rates follow
+prompt or model changes. The request size is part of the prompt, and so of
+its response-cache key, so sizes must not drift between runs: the first
+job to size a (topic, kind) under a generator's PROMPT_VERSION freezes the
+rate it used, rounded down to RATE_STEP, and every later job with that
+version sizes its requests from the frozen rate. A rerun of the same
+workbook therefore sends the same prompts and is answered from the cache.
+New topics still start from what earlier runs learned about their kind,
+and bumping PROMPT_VERSION re-freezes every rate from the current counts.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+
+ACCEPTANCE_PATH = os.environ.get(
+    "ACCEPTANCE_STATS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "acceptance.sqlite3"))
+ADAPTIVE_SIZING = os.environ.get("ADAPTIVE_SIZING", "on").lower() not in ("0", "off", "false")
+
+# At most this many items above `remaining` in one request.
+MAX_OVER_REQUEST = int(os.environ.get("MAX_OVER_REQUEST", "15"))
+MIN_RATE = 0.25
+RATE_STEP = 0.05
+# Weight of the prior (the kind's rate across all topics) in items.
+PRIOR_WEIGHT = 10
+# Below this many offered items a kind's overall rate is not used as a prior.
+MIN_PRIOR_SAMPLES = 20
+DECAY_AFTER = 200
+
+_UPSERT = """
+INSERT INTO acceptance (topic, kind, offered, accepted, updated) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(topic, kind) DO UPDATE SET
+    offered  = CASE WHEN offered + excluded.offered > ? THEN (offered + excluded.offered) / 2.0
+                    ELSE offered + excluded.offered END,
+    accepted = CASE WHEN offered + excluded.offered > ? THEN (accepted + excluded.accepted) / 2.0
+                    ELSE accepted + excluded.accepted END,
+    updated  = excluded.updated
+"""
+
+
+class AcceptanceStore:
+    def __init__(self, path: str = ACCEPTANCE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS acceptance ("
+            " topic TEXT NOT NULL, kind TEXT NOT NULL, offered REAL NOT NULL,"
+            " accepted REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (topic, kind))")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sizing ("
+            " version TEXT NOT NULL, topic TEXT NOT NULL, kind TEXT NOT NULL,"
+            " rate REAL NOT NULL, created REAL NOT NULL, PRIMARY KEY (version, topic, kind))")
+
+    def load(self) -> dict:
+        """{(topic, kind): (offered, accepted)} for every row."""
+        with self._lock:
+            rows = self._db.execute("SELECT topic, kind, offered, accepted FROM acceptance")
+            return {(t, k): (o, a) for t, k, o, a in rows}
+
+    def add(self, topic: str, kind: str, offered: int, accepted: int):
+        with self._lock:
+            self._db.execute(_UPSERT, (topic, kind, offered, accepted, time.time(),
+                                       DECAY_AFTER, DECAY_AFTER))
+
+    def frozen(self, version: str) -> dict:
+        """{(topic, kind): rate} frozen under `version`."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT topic, kind, rate FROM sizing WHERE version = ?", (version,))
+            return {(t, k): r for t, k, r in rows}
+
+    def freeze(self, version: str, topic: str, kind: str, rate: float) -> float:
+        """Freeze `rate` unless another job got there first; the rate that stands."""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO sizing (version, topic, kind, rate, created)"
+                " VALUES (?, ?, ?, ?, ?)", (version, topic, kind, rate, time.time()))
+            return self._db.execute(
+                "SELECT rate FROM sizing WHERE version = ? AND topic = ? AND kind = ?",
+                (version, topic, kind)).fetchone()[0]
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_store(path: str = ACCEPTANCE_PATH) -> AcceptanceStore:
+    key = (os.getpid(), os.path.abspath(path))
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = AcceptanceStore(path)
+        return _shared[key]
+
+
+class AcceptanceRates:
+    """
+    One job's view of the acceptance stats. `version` is the generator's
+    PROMPT_VERSION; sizing rates are frozen per version.
+    """
+
+    def __init__(self, store: AcceptanceStore = None, enabled: bool = ADAPTIVE_SIZING,
+                 version: str = ""):
+        self.enabled = enabled
+        self.version = version
+        self.store = None
+        self._rows = {}
+        self._frozen = {}
+        if enabled:
+            try:
+                self.store = store or shared_store()
+                self._rows = self.store.load()
+                self._frozen = self.store.frozen(version)
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️  Acceptance stats unavailable, sizing requests without them: {e}")
+        self._priors = {}
+        for (_, kind), (offered, accepted) in self._rows.items():
+            o, a = self._priors.get(kind, (0.0, 0.0))
+            self._priors[kind] = (o + offered, a + accepted)
+        self._lock = threading.Lock()
+
+    def rate(self, topic: str, kind: str) -> float:
+        """Acceptance rate from the counts as they were when the job started."""
+        prior = 1.0
+        o, a = self._priors.get(kind, (0.0, 0.0))
+        if o >= MIN_PRIOR_SAMPLES:
+            prior = a / o
+        offered, accepted = self._rows.get((topic, kind), (0.0, 0.0))
+        return (accepted + PRIOR_WEIGHT * prior) / (offered + PRIOR_WEIGHT)
+
+    def sizing_rate(self, topic: str, kind: str) -> float:
+        """The rate requests are sized with, frozen on first use."""
+        with self._lock:
+            rate = self._frozen.get((topic, kind))
+            if rate is not None:
+                return rate
+            rate = math.floor(self.rate(topic, kind) / RATE_STEP + 1e-9) * RATE_STEP
+            rate = min(1.0, max(MIN_RATE, rate))
+            if self.store is not None:
+                try:
+                    rate = self.store.freeze(self.version, topic, kind, rate)
+                except sqlite3.Error as e:
+                    print(f"⚠️  Could not freeze request size: {e}")
+            self._frozen[(topic, kind)] = rate
+            return rate
+
+    def request_size(self, topic: str, kind: str, remaining: int) -> int:
+        """How many items to ask for when `remaining` are still needed."""
+        if not self.enabled or remaining <= 0:
+            return remaining
+        rate = self.sizing_rate(topic, kind)
+        return min(math.ceil(round(remaining / rate, 6)), remaining + MAX_OVER_REQUEST)
+
+    def record(self, topic: str, kind: str, offered: int, accepted: int):
+        """Add to the stored counts; sizes in this job are not affected."""
+        if not self.enabled or offered <= 0 or self.store is None:
+            return
+        try:
+            self.store.add(topic, kind, offered, accepted)
+        except sqlite3.Error as e:
+            print(f"⚠️  Could not save acceptance stats: {e}")
+
+
+# Sizes every request at exactly `remaining`, as before adaptive sizing.
+STATIC_RATES = AcceptanceRates(enabled=False)
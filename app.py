@@ -2,11 +2,13 @@ from flask import Flask, render_template, request, send_file, jsonify, Response,
 import os
 import shutil
 import tempfile
-import zipfile
 import json
 from werkzeug.utils import secure_filename
 from worksheet_generator import generate_worksheets
 from caterpillar_generator import generate_caterpillar_worksheets
+from llm_batch import GENERATION_MODES
+from llm_cache import CACHE_MODE, CACHE_MODES
+from archive import TopicArchive, topic_view
 import traceback
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
@@ -21,6 +23,9 @@ DOWNLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'downloads')
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = DOWNLOAD_FOLDER
+
+# Requests raced per deck retry on the interactive /generate-academy stream.
+INTERACTIVE_SPECULATION = int(os.environ.get('INTERACTIVE_SPECULATION', '2'))
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db').replace('postgres://', 'postgresql://', 1)
@@ -37,14 +42,6 @@ celery = make_celery(app)
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-def zip_directory(folder_path, zip_path):
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder_path)
-                zipf.write(file_path, arcname)
-
 # --- Auth Routes ---
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -124,7 +121,7 @@ def academy_ready():
 def dreaming_caterpillar():
     return render_template('caterpillar.html')
 
-def handle_generation(generator_func, request):
+def handle_generation(generator_func, request, **generator_options):
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -148,6 +145,11 @@ def handle_generation(generator_func, request):
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
+    # 'refresh' re-asks every prompt, 'bypass' skips the response cache entirely
+    cache_mode = request.form.get('cache_mode', CACHE_MODE)
+    if cache_mode not in CACHE_MODES:
+        return jsonify({'error': f'Invalid cache_mode. Use one of: {", ".join(CACHE_MODES)}'}), 400
+
     if file and file.filename.endswith('.xlsx'):
         # Create a temporary directory for this generation session
         session_dir = tempfile.mkdtemp()
@@ -158,44 +160,50 @@ def handle_generation(generator_func, request):
         os.makedirs(output_dir, exist_ok=True)
 
         def generate_stream():
+            # The PDFs arrive in memory with each 'result' and are appended to
+            # the full archive; topic downloads are served as views into it.
+            all_filename = f"worksheets_{os.path.basename(session_dir)}.zip"
+            all_zip = None
+            topic_count = 0
             try:
+                all_zip = TopicArchive(os.path.join(app.config['UPLOAD_FOLDER'], all_filename))
                 print(f"[DEBUG] Starting generation for file: {upload_path}")
                 # Run generation
-                for update in generator_func(upload_path, output_dir, api_key):
+                for update in generator_func(upload_path, output_dir, api_key, cache_mode=cache_mode,
+                                             **generator_options):
                     print(f"[DEBUG] Update: {update.get('type')} - {update.get('message', update.get('topic', ''))}")
                     if update['type'] == 'progress':
                         yield f"data: {json.dumps(update)}\n\n"
                     
                     elif update['type'] == 'result':
-                        # Zip the individual topic folder
-                        topic_path = update['path']
+                        # Add the topic to the full archive
+                        files = update.pop('files')
                         topic_name = update['topic']
                         safe_topic_name = secure_filename(topic_name)
-                        zip_filename = f"{safe_topic_name}.zip"
-                        zip_path = os.path.join(app.config['UPLOAD_FOLDER'], zip_filename)
-                        zip_directory(topic_path, zip_path)
+                        # Numbered, so subtopics with the same title in
+                        # different units do not share a download.
+                        topic_count += 1
+                        zip_filename = f"{topic_count:03d}_{safe_topic_name}.zip"
+                        all_zip.add_topic(zip_filename, files, update['arcdir'])
                         
-                        update['download_url'] = f'/download/{zip_filename}'
+                        update['download_url'] = f'/download/{all_filename}/{zip_filename}'
                         yield f"data: {json.dumps(update)}\n\n"
                     
                     elif update['type'] == 'complete':
-                        # Zip the full output
-                        full_output_path = update['path']
-                        zip_filename = f"worksheets_{os.path.basename(session_dir)}.zip"
-                        zip_path = os.path.join(app.config['UPLOAD_FOLDER'], zip_filename)
-                        zip_directory(full_output_path, zip_path)
-                        
-                        update['download_url'] = f'/download/{zip_filename}'
+                        all_zip.close()
+                        update['download_url'] = f'/download/{all_filename}'
                         yield f"data: {json.dumps(update)}\n\n"
 
-                # Cleanup session dir
-                shutil.rmtree(session_dir)
-
             except Exception as e:
                 print(f"[ERROR] Generation failed: {str(e)}")
                 traceback.print_exc()
                 error_msg = {'type': 'error', 'message': f"Generation failed: {str(e)}"}
                 yield f"data: {json.dumps(error_msg)}\n\n"
+            finally:
+                if all_zip is not None:
+                    all_zip.close()
+                # Cleanup session dir
+                shutil.rmtree(session_dir, ignore_errors=True)
 
         return Response(stream_with_context(generate_stream()), mimetype='text/event-stream')
 
@@ -204,7 +212,13 @@ def handle_generation(generator_func, request):
 
 @app.route('/generate-academy', methods=['POST'])
 def generate_academy():
-    return handle_generation(generate_worksheets, request)
+    # A teacher is watching this one, so deck retries race a full and a
+    # simple prompt by default; send speculation=1 to save tokens instead.
+    try:
+        speculation = int(request.form.get('speculation', INTERACTIVE_SPECULATION))
+    except ValueError:
+        return jsonify({'error': 'speculation must be an integer'}), 400
+    return handle_generation(generate_worksheets, request, speculation=speculation)
 
 @app.route('/generate-caterpillar', methods=['POST'])
 def generate_caterpillar():
@@ -231,12 +245,21 @@ def generate_academy_async():
     if file.filename == '' or not file.filename.endswith('.xlsx'):
         return jsonify({'error': 'Invalid file'}), 400
     
+    cache_mode = request.form.get('cache_mode', CACHE_MODE)
+    if cache_mode not in CACHE_MODES:
+        return jsonify({'error': 'Invalid cache_mode'}), 400
+    
+    # 'batch' trades latency for cost on large overnight runs
+    mode = request.form.get('mode', 'online')
+    if mode not in GENERATION_MODES:
+        return jsonify({'error': 'Invalid mode'}), 400
+    
     # Save uploaded file temporarily
     temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"upload_{secure_filename(file.filename)}")
     file.save(temp_path)
     
     # Start background task
-    task = generate_worksheets_task.apply_async(args=[temp_path, 'academy', api_key])
+    task = generate_worksheets_task.apply_async(args=[temp_path, 'academy', api_key, cache_mode, mode])
     
     return jsonify({
         'task_id': task.id,
@@ -264,12 +287,21 @@ def generate_caterpillar_async():
     if file.filename == '' or not file.filename.endswith('.xlsx'):
         return jsonify({'error': 'Invalid file'}), 400
     
+    cache_mode = request.form.get('cache_mode', CACHE_MODE)
+    if cache_mode not in CACHE_MODES:
+        return jsonify({'error': 'Invalid cache_mode'}), 400
+    
+    # 'batch' trades latency for cost on large overnight runs
+    mode = request.form.get('mode', 'online')
+    if mode not in GENERATION_MODES:
+        return jsonify({'error': 'Invalid mode'}), 400
+    
     # Save uploaded file temporarily
     temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"upload_{secure_filename(file.filename)}")
     file.save(temp_path)
     
     # Start background task
-    task = generate_worksheets_task.apply_async(args=[temp_path, 'caterpillar', api_key])
+    task = generate_worksheets_task.apply_async(args=[temp_path, 'caterpillar', api_key, cache_mode, mode])
     
     return jsonify({
         'task_id': task.id,
@@ -331,6 +363,36 @@ def download_file(filename):
         print(f"[ERROR] Download failed: {str(e)}")
         return jsonify({'error': 'Download failed'}), 500
 
+@app.route('/download/<archive_name>/<topic_name>')
+def download_topic(archive_name, topic_name):
+    """One topic's zip, streamed from its entries in a run's full archive. Supports Range."""
+    archive_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(archive_name))
+    view = topic_view(archive_path, topic_name)
+    if view is None:
+        return jsonify({'error': 'File not found. It may have been cleaned up.'}), 404
+
+    etag = f'"{view.etag}"'
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Content-Disposition': f'attachment; filename="{secure_filename(topic_name)}"',
+    }
+    start, stop, status = 0, view.size, 200
+    if_range = request.headers.get('If-Range')
+    ranges = request.range
+    # Multi-range requests are answered with the whole body, as RFC 9110
+    # allows; only an unsatisfiable single range gets a 416.
+    if (ranges is not None and ranges.units == 'bytes' and len(ranges.ranges) == 1
+            and (if_range is None or if_range == etag)):
+        span = ranges.range_for_length(view.size)
+        if span is None:
+            return Response(status=416, headers={'Content-Range': f'bytes */{view.size}'})
+        start, stop = span
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{view.size}'
+    headers['Content-Length'] = str(stop - start)
+    return Response(view.chunks(start, stop), status=status, mimetype='application/zip', headers=headers)
+
 @app.route('/health')
 def health_check():
     """Health check endpoint to verify API key and system status"""
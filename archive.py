@@ -0,0 +1,199 @@
+"""
+Incremental zip archive of a generation run, with per-topic sub-views.
+
+The full archive is opened when a run starts and each subtopic's PDFs are
+appended (and flushed) when its 'result' event arrives, so every PDF is
+compressed exactly once and the archive only needs its central directory
+written when the last topic finishes.
+
+Per-topic downloads are not separate zip files. add_topic() records where
+each entry's compressed data sits in the full archive in a small JSON
+index next to it (<archive>.index.json), and topic_view() builds the
+topic's zip on request: fresh local headers with names relative to the
+topic folder, the compressed bytes copied from the full archive as-is,
+and a central directory. This works while the archive is still being
+written, and from any process that can see the download folder.
+
+A view's layout is fixed once the topic is indexed, so any byte range of
+it can be produced without building the rest: downloads are streamed in
+CHUNK_SIZE blocks with a Content-Length, and interrupted ones resume with
+a Range request.
+
+ARCHIVE_COMPRESSION picks how entries are compressed: 'stored',
+'deflate' or 'deflate:<level>' (1-9), or 'adaptive' (the default), which
+deflates a few samples of each file at level 1 and stores the file unless
+that saved at least ADAPTIVE_MIN_SAVING. ReportLab PDFs already carry
+compressed page streams, so most of them are stored. bench_archive.py
+compares the policies on a real output.
+"""
+
+import hashlib
+import json
+import os
+import posixpath
+import struct
+import zipfile
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+ARCHIVE_COMPRESSION = os.environ.get("ARCHIVE_COMPRESSION", "adaptive")
+ADAPTIVE_MIN_SAVING = float(os.environ.get("ADAPTIVE_MIN_SAVING", "0.10"))
+ADAPTIVE_SAMPLES = 4
+ADAPTIVE_SAMPLE_SIZE = 16 * 1024
+# Level used by 'adaptive' for the files it does deflate.
+ADAPTIVE_LEVEL = 6
+_UTF8_FLAG = 0x800
+_FILE_ATTRS = 0o600 << 16
+
+
+def index_path(path) -> str:
+    return f"{path}.index.json"
+
+
+def _sample(data: bytes) -> bytes:
+    """ADAPTIVE_SAMPLES evenly spaced windows of `data` (all of it if small)."""
+    if len(data) <= ADAPTIVE_SAMPLES * ADAPTIVE_SAMPLE_SIZE:
+        return data
+    step = (len(data) - ADAPTIVE_SAMPLE_SIZE) // (ADAPTIVE_SAMPLES - 1)
+    return b''.join(data[i * step:i * step + ADAPTIVE_SAMPLE_SIZE] for i in range(ADAPTIVE_SAMPLES))
+
+
+def compression_policy(spec: str = ARCHIVE_COMPRESSION):
+    """
+    fn(data) -> (compress_type, compresslevel) for a policy spec, see the
+    module docstring. Raises ValueError for an unknown spec.
+    """
+    name, _, level = spec.partition(':')
+    if name == 'stored' and not level:
+        return lambda data: (zipfile.ZIP_STORED, None)
+    if name == 'deflate':
+        level = int(level) if level else None
+        if level is not None and not 1 <= level <= 9:
+            raise ValueError(f"deflate level must be 1-9, got {level}")
+        return lambda data: (zipfile.ZIP_DEFLATED, level)
+    if name == 'adaptive' and not level:
+        def adaptive(data):
+            sample = _sample(data)
+            if sample and 1 - len(zlib.compress(sample, 1)) / len(sample) >= ADAPTIVE_MIN_SAVING:
+                return zipfile.ZIP_DEFLATED, ADAPTIVE_LEVEL
+            return zipfile.ZIP_STORED, None
+        return adaptive
+    raise ValueError(f"Unknown archive compression {spec!r}; use stored, deflate[:1-9] or adaptive")
+
+
+class TopicArchive:
+    """The full archive of one run, written a topic at a time."""
+
+    def __init__(self, path, compression: str = ARCHIVE_COMPRESSION):
+        self.path = str(path)
+        self.policy = compression_policy(compression)
+        self.zip = zipfile.ZipFile(self.path, 'w')
+        self.index = {}
+        self._write_index()
+
+    def add_topic(self, key: str, files, base: str):
+        """Append `files` and index them under `key`, relative to `base`."""
+        first = len(self.zip.infolist())
+        for arcname, data in files:
+            compress_type, level = self.policy(data)
+            self.zip.writestr(arcname, data, compress_type=compress_type, compresslevel=level)
+        self.zip.fp.flush()
+        self.index[key] = [{
+            'name': posixpath.relpath(info.filename, base),
+            'offset': info.header_offset,
+            'crc': info.CRC,
+            'csize': info.compress_size,
+            'size': info.file_size,
+            'method': info.compress_type,
+            'date_time': info.date_time,
+        } for info in self.zip.infolist()[first:]]
+        self._write_index()
+
+    def _write_index(self):
+        tmp = index_path(self.path) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp, index_path(self.path))
+
+    def close(self):
+        self.zip.close()
+
+
+def _dos_time(date_time):
+    y, mo, d, h, mi, s = date_time
+    return (h << 11) | (mi << 5) | (s // 2), ((y - 1980) << 9) | (mo << 5) | d
+
+
+def _length(part) -> int:
+    return part[1] if isinstance(part, tuple) else len(part)
+
+
+class ZipView:
+    """A zip assembled from header bytes and byte ranges of another file."""
+
+    def __init__(self, path, parts, etag):
+        self.path = path
+        self.parts = parts      # bytes, or (offset, length) in `path`
+        self.size = sum(_length(p) for p in parts)
+        self.etag = etag
+
+    def chunks(self, start: int = 0, stop: int = None):
+        """The bytes in [start, stop), in blocks of at most CHUNK_SIZE."""
+        stop = self.size if stop is None else stop
+        pos = 0
+        with open(self.path, 'rb') as src:
+            for part in self.parts:
+                begin, pos = pos, pos + _length(part)
+                lo, hi = max(start, begin), min(stop, pos)
+                if lo >= hi:
+                    continue
+                if isinstance(part, bytes):
+                    yield part[lo - begin:hi - begin]
+                    continue
+                src.seek(part[0] + lo - begin)
+                remaining = hi - lo
+                while remaining > 0:
+                    block = src.read(min(CHUNK_SIZE, remaining))
+                    if not block:
+                        raise IOError(f"{self.path} is shorter than its index")
+                    remaining -= len(block)
+                    yield block
+
+
+def topic_view(path, key: str):
+    """The zip of topic `key` in the archive at `path`, or None if it has no such topic."""
+    try:
+        with open(index_path(path), encoding='utf-8') as f:
+            entries = json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+    if entries is None:
+        return None
+
+    parts = []
+    central = []
+    offset = 0
+    with open(path, 'rb') as src:
+        for e in entries:
+            src.seek(e['offset'] + 26)
+            name_len, extra_len = struct.unpack('<2H', src.read(4))
+            data_offset = e['offset'] + zipfile.sizeFileHeader + name_len + extra_len
+            name = e['name'].encode('utf-8')
+            flags = 0 if e['name'].isascii() else _UTF8_FLAG
+            dostime, dosdate = _dos_time(e['date_time'])
+            header = struct.pack(zipfile.structFileHeader, zipfile.stringFileHeader,
+                                 20, 0, flags, e['method'], dostime, dosdate,
+                                 e['crc'], e['csize'], e['size'], len(name), 0)
+            parts += [header + name, (data_offset, e['csize'])]
+            central.append(struct.pack(zipfile.structCentralDir, zipfile.stringCentralDir,
+                                       20, 3, 20, 0, flags, e['method'], dostime, dosdate,
+                                       e['crc'], e['csize'], e['size'], len(name),
+                                       0, 0, 0, 0, _FILE_ATTRS, offset) + name)
+            offset += len(header) + len(name) + e['csize']
+    central = b''.join(central)
+    end = struct.pack(zipfile.structEndArchive, zipfile.stringEndArchive, 0, 0,
+                      len(entries), len(entries), len(central), offset, 0)
+    parts.append(central + end)
+    # A topic's entries never change once indexed, so their CRCs identify the view.
+    etag = hashlib.sha1(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()
+    return ZipView(path, parts, etag)
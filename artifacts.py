@@ -0,0 +1,34 @@
+"""
+Rendered output as in-memory artifacts.
+
+The render stage builds every PDF of a subtopic into a BytesIO buffer and
+returns them to the generator as (arcname, bytes) pairs, arcnames relative
+to the output root ('Grade 7 - .../01. Unit/01. Topic/....pdf'). Generators
+attach them to the subtopic's 'result' event as 'files' (with the topic's
+own folder as 'arcdir'), and consumers write them straight into their zip
+archives instead of walking a folder tree that was written only to be read
+back, compressed and deleted.
+
+MATERIALIZE_OUTPUT=on (or materialize_output=True on a generator) also
+writes the files under its output_dir, for callers that want the folder
+tree.
+"""
+
+import os
+import pathlib
+
+MATERIALIZE_OUTPUT = os.environ.get("MATERIALIZE_OUTPUT", "off").lower() in ("1", "on", "true")
+
+
+def materialize(root, files):
+    """Write `files` under `root`, creating folders as needed."""
+    root = pathlib.Path(root)
+    for arcname, data in files:
+        path = root / arcname
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def pdf_target(path):
+    """ReportLab output target: a path, or a file-like buffer as-is."""
+    return path if hasattr(path, 'write') else str(path)
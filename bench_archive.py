@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Compare archive compression policies on a real generation output.
+
+    python bench_archive.py downloads/all_worksheets_<task id>.zip
+    python bench_archive.py path/to/output --policy stored --policy adaptive
+
+The input is a run's archive or a materialized output folder
+(MATERIALIZE_OUTPUT=on). Every file is re-archived in memory under each
+policy and the CPU time spent is reported against the bytes saved
+relative to storing everything.
+"""
+
+import argparse
+import io
+import os
+import time
+import zipfile
+
+from archive import compression_policy
+
+DEFAULT_POLICIES = ['stored', 'deflate:1', 'deflate:6', 'deflate:9', 'adaptive']
+
+
+def load_files(path):
+    """(arcname, bytes) for every file in a zip archive or folder tree."""
+    if os.path.isfile(path):
+        with zipfile.ZipFile(path) as z:
+            return [(i.filename, z.read(i)) for i in z.infolist() if not i.is_dir()]
+    files = []
+    for root, _, names in os.walk(path):
+        for name in sorted(names):
+            full = os.path.join(root, name)
+            with open(full, 'rb') as f:
+                files.append((os.path.relpath(full, path).replace(os.sep, '/'), f.read()))
+    return files
+
+
+def run(files, spec, repeat=1):
+    """(cpu seconds, wall seconds, archive bytes, deflated entries), best of `repeat`."""
+    policy = compression_policy(spec)
+    best = None
+    for _ in range(repeat):
+        buf = io.BytesIO()
+        deflated = 0
+        cpu, wall = time.process_time(), time.perf_counter()
+        with zipfile.ZipFile(buf, 'w') as z:
+            for arcname, data in files:
+                compress_type, level = policy(data)
+                deflated += compress_type == zipfile.ZIP_DEFLATED
+                z.writestr(arcname, data, compress_type=compress_type, compresslevel=level)
+        result = (time.process_time() - cpu, time.perf_counter() - wall, len(buf.getvalue()), deflated)
+        if best is None or result[0] < best[0]:
+            best = result
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help="a run's .zip archive or an output folder")
+    parser.add_argument('--policy', action='append', dest='policies',
+                        help=f"policy to measure (repeatable; default: {' '.join(DEFAULT_POLICIES)})")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per policy; the fastest is reported")
+    args = parser.parse_args()
+
+    files = load_files(args.path)
+    raw = sum(len(data) for _, data in files)
+    print(f"{len(files)} files, {raw / 1e6:.1f} MB\n")
+
+    results = [(spec, run(files, spec, args.repeat)) for spec in args.policies or DEFAULT_POLICIES]
+    stored_size = run(files, 'stored')[2]
+    print(f"{'policy':<12}{'cpu s':>8}{'wall s':>8}{'MB':>9}{'saved MB':>10}{'saved':>8}{'deflated':>10}{'KB saved/cpu ms':>17}")
+    for spec, (cpu, wall, size, deflated) in results:
+        saved = stored_size - size
+        per_ms = saved / 1024 / (cpu * 1000) if cpu > 0 else 0.0
+        print(f"{spec:<12}{cpu:>8.3f}{wall:>8.3f}{size / 1e6:>9.2f}{saved / 1e6:>10.2f}"
+              f"{saved / stored_size:>8.1%}{f'{deflated}/{len(files)}':>10}{per_ms:>17.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,51 @@
-import os, re, json, random, pathlib, sys, time
+import os, re, random, pathlib, sys, time
 from datetime import datetime
-from typing import List, Tuple, Dict
-import openai, backoff
-import pandas as pd
+from typing import List, Tuple, Dict, NamedTuple
 import io
-import shutil
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus import (SimpleDocTemplate, BaseDocTemplate, Paragraph, Spacer,
                                 KeepTogether, PageBreak, PageTemplate, Frame, NextPageTemplate,
                                 Table, TableStyle)
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from xml.sax.saxutils import escape as xml_escape
 from reportlab.lib.utils import ImageReader
-from reportlab.pdfgen import canvas as pdfcanvas
+
+from llm_cache import CACHE_MODE
+from llm_batch import GENERATION_MODES
+from llm_client import LLMClient, MAX_IN_FLIGHT
+from llm_json import response_format
+from acceptance import AcceptanceRates
+from pipeline import Stage, run_subtopic_jobs
+from render_model import QuestionModel
+from render_pool import pool_workers, render_pool, render_stage
+from artifacts import MATERIALIZE_OUTPUT, pdf_target
+from checkpoints import RESUME, JobCheckpoints, render_version
+from font_registry import register_ttf
+from preview_raster import rasterize
+from style_registry import style_sheet
+from curriculum_sheet import CurriculumSheet
+from generation_context import GenerationContext, on_page
 
 # Optional libraries
-try:
-    import fitz  # PyMuPDF
-    HAS_FITZ = True
-except Exception:
-    HAS_FITZ = False
+from pdf_compose import HAS_FITZ
 try:
     from pdf2image import convert_from_path
     HAS_PDF2IMG = True
 except Exception:
     HAS_PDF2IMG = False
 
-# Global variables for fonts and styles
-FONT_LATO_REG = 'Helvetica'
-FONT_LATO_LIGHT = 'Helvetica'
-FONT_RALEWAY_SB = 'Helvetica-Bold'
-FONT_DEJAVU = 'Helvetica'
-FONT = 'Helvetica'
-ST = None
+# Subtopics in the LLM stage at once, and how many finished items may queue
+# between the fetch and render stages.
+SUBTOPIC_CONCURRENCY = int(os.environ.get("SUBTOPIC_CONCURRENCY", "3"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "2"))
+
+# Items per deck for each subtopic.
+DECK_TARGETS = {'tf': 25, 'tf_expl': 25, 'sa': 20, 'open': 20, 'scenario': 10}
+
+# Part of every subtopic's checkpoint fingerprint (see checkpoints.py for
+# when to bump it) and the key request sizes are frozen under (acceptance.py).
+PROMPT_VERSION = "1"
 
 # Paths
 BASE_DIR = pathlib.Path(__file__).parent / "01_THE DREAMING CATERPILLAR"
@@ -47,41 +57,45 @@ PREVIEW_FIRST_IMG = TEMPLATES_DIR / "04. 1st Preview Page.jpg"
 PREVIEW_OTHER_IMG = TEMPLATES_DIR / "05. Other Preview Pages.jpg"
 
 # ───────────────────────  FONTS & STYLES  ────────────────────────────────
-def register_fonts():
-    global FONT_LATO_REG, FONT_LATO_LIGHT, FONT_RALEWAY_SB, FONT_DEJAVU, FONT
-    
+class Fonts(NamedTuple):
+    heading: str
+    regular: str
+    light: str
+    dejavu: str     # symbols wrap_special() sets apart from the text font
+
+def register_fonts() -> Fonts:
     def _register(name, filename):
         path = BASE_DIR / filename
-        if path.exists():
-            try:
-                pdfmetrics.registerFont(TTFont(name, str(path)))
-                return name
-            except Exception:
-                pass
+        if path.exists() and register_ttf(name, path):
+            return name
         return 'Helvetica'
 
-    FONT_LATO_REG = _register('Lato-Regular', 'Lato-Regular.ttf')
-    FONT_LATO_LIGHT = _register('Lato-Light', 'Lato-Light.ttf')
-    FONT_RALEWAY_SB = _register('Raleway-SemiBold', 'Raleway-SemiBold.ttf')
-    FONT_DEJAVU = _register('DejaVuSans', 'DejaVuSans.ttf')
-    FONT = FONT_LATO_REG
+    return Fonts(heading=_register('Raleway-SemiBold', 'Raleway-SemiBold.ttf'),
+                 regular=_register('Lato-Regular', 'Lato-Regular.ttf'),
+                 light=_register('Lato-Light', 'Lato-Light.ttf'),
+                 dejavu=_register('DejaVuSans', 'DejaVuSans.ttf'))
 
-def get_styles():
+def _build_styles(heading, regular, light, line):
     st = getSampleStyleSheet()
-    st.add(ParagraphStyle('Doc', fontName=FONT_RALEWAY_SB, fontSize=16, leading=20, alignment=1, spaceAfter=12, bold=True))
-    st.add(ParagraphStyle('AnsH', fontName=FONT_RALEWAY_SB, fontSize=15, leading=20, alignment=1, spaceAfter=20, bold=True))
-    st.add(ParagraphStyle('Q', fontName=FONT_LATO_REG, fontSize=12, leading=15, leftIndent=10, spaceAfter=6))
-    st.add(ParagraphStyle('Opt', fontName=FONT_LATO_REG, fontSize=12, leading=15, leftIndent=25, spaceAfter=2))
+    st.add(ParagraphStyle('Doc', fontName=heading, fontSize=16, leading=20, alignment=1, spaceAfter=12, bold=True))
+    st.add(ParagraphStyle('AnsH', fontName=heading, fontSize=15, leading=20, alignment=1, spaceAfter=20, bold=True))
+    st.add(ParagraphStyle('Q', fontName=regular, fontSize=12, leading=15, leftIndent=10, spaceAfter=6))
+    st.add(ParagraphStyle('Opt', fontName=regular, fontSize=12, leading=15, leftIndent=25, spaceAfter=2))
     st.add(ParagraphStyle('Blue', parent=st['Opt'], textColor=colors.blue))
     st.add(ParagraphStyle('Red', parent=st['Opt'], textColor=colors.red))
     st.add(ParagraphStyle('RedU', parent=st['Opt'], textColor=colors.red, underline=True))
-    st.add(ParagraphStyle('Expl', fontName=FONT_LATO_LIGHT, fontSize=10, leading=13, leftIndent=25, spaceAfter=10, textColor=colors.black))
-    st.add(ParagraphStyle('TF', fontName=FONT_LATO_REG, fontSize=12, leading=15, leftIndent=10, spaceAfter=4))
-    st.add(ParagraphStyle('Instr', fontName=FONT_LATO_REG, fontSize=11, leading=14, leftIndent=10, spaceAfter=8, textColor=colors.black))
-    st.add(ParagraphStyle('Line', fontName=FONT, fontSize=12, leading=14, leftIndent=20, textColor=colors.grey))
-    st.add(ParagraphStyle('Note', fontName=FONT_LATO_REG, fontSize=11, leading=14, textColor=colors.red, alignment=0, spaceAfter=10))
+    st.add(ParagraphStyle('Expl', fontName=light, fontSize=10, leading=13, leftIndent=25, spaceAfter=10, textColor=colors.black))
+    st.add(ParagraphStyle('TF', fontName=regular, fontSize=12, leading=15, leftIndent=10, spaceAfter=4))
+    st.add(ParagraphStyle('Instr', fontName=regular, fontSize=11, leading=14, leftIndent=10, spaceAfter=8, textColor=colors.black))
+    st.add(ParagraphStyle('Line', fontName=line, fontSize=12, leading=14, leftIndent=20, textColor=colors.grey))
+    st.add(ParagraphStyle('Note', fontName=regular, fontSize=11, leading=14, textColor=colors.red, alignment=0, spaceAfter=10))
     return st
 
+def get_styles(fonts: Fonts):
+    """The shared, read-only style sheet for `fonts` (built once per process)."""
+    return style_sheet('caterpillar', fonts,
+                       lambda: _build_styles(fonts.heading, fonts.regular, fonts.light, fonts.regular))
+
 # ───────────────────────  UTILITIES  ────────────────────────────────
 SPECIAL_CHARS = set([
     '→','←','↑','↓','↔','⇒','⇐','↕','⇔',
@@ -105,7 +119,7 @@ def clean(txt: str) -> str:
     txt = ION_CHARGE.sub(lambda m: m.group(1) + SUP_MAP[m.group(2)], txt)
     return txt
 
-def wrap_special(text: str, base_font: str) -> str:
+def wrap_special(text: str, base_font: str, symbol_font: str) -> str:
     if not isinstance(text, str): text = str(text)
     
     def _convert_sub_super(s: str) -> str:
@@ -132,7 +146,7 @@ def wrap_special(text: str, base_font: str) -> str:
     out = []
     for ch in text:
         if ch in SPECIAL_CHARS:
-            out.append(f"<font name='{FONT_DEJAVU}'>{xml_escape(ch)}</font>")
+            out.append(f"<font name='{symbol_font}'>{xml_escape(ch)}</font>")
         else:
             out.append(xml_escape(ch))
     inner = ''.join(out)
@@ -164,27 +178,22 @@ class CurriculumData:
         )
 
 def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
-    df_raw = pd.read_excel(excel_path, header=None)
+    sheet = CurriculumSheet(excel_path)
     all_curricula = []
-    curriculum_start_rows = []
-    
-    for idx in range(len(df_raw)):
-        first_col = str(df_raw.iloc[idx, 0]).strip() if pd.notna(df_raw.iloc[idx, 0]) else ''
-        if first_col.lower().startswith('subject name'):
-            curriculum_start_rows.append(idx)
+    curriculum_start_rows = sheet.markers
             
     for curr_idx, start_row in enumerate(curriculum_start_rows):
-        end_row = curriculum_start_rows[curr_idx + 1] if curr_idx + 1 < len(curriculum_start_rows) else len(df_raw)
+        end_row = curriculum_start_rows[curr_idx + 1] if curr_idx + 1 < len(curriculum_start_rows) else sheet.n_rows
         
-        first_cell = str(df_raw.iloc[start_row, 0]).strip() if pd.notna(df_raw.iloc[start_row, 0]) else ""
+        first_cell = sheet.text[0][start_row]
         if first_cell.lower().startswith('subject name'):
-            subject_name = str(df_raw.iloc[start_row, 1]).strip() if pd.notna(df_raw.iloc[start_row, 1]) else "Unknown"
-            grade_level = str(df_raw.iloc[start_row + 1, 1]).strip() if pd.notna(df_raw.iloc[start_row + 1, 1]) else "Unknown"
-            curriculum_name = str(df_raw.iloc[start_row + 2, 1]).strip() if pd.notna(df_raw.iloc[start_row + 2, 1]) else "Unknown"
+            subject_name = sheet.value(start_row, 1, "Unknown")
+            grade_level = sheet.value(start_row + 1, 1, "Unknown")
+            curriculum_name = sheet.value(start_row + 2, 1, "Unknown")
         else:
             subject_name = re.sub(r'^Subject Name\s*-\s*', '', first_cell, flags=re.IGNORECASE).strip()
-            grade_level = re.sub(r'^Grade level\s*-\s*', '', str(df_raw.iloc[start_row + 1, 0]), flags=re.IGNORECASE).strip()
-            curriculum_name = re.sub(r'^Curriculum\s*-\s*', '', str(df_raw.iloc[start_row + 2, 0]), flags=re.IGNORECASE).strip()
+            grade_level = re.sub(r'^Grade level\s*-\s*', '', sheet.value(start_row + 1, 0, 'nan'), flags=re.IGNORECASE).strip()
+            curriculum_name = re.sub(r'^Curriculum\s*-\s*', '', sheet.value(start_row + 2, 0, 'nan'), flags=re.IGNORECASE).strip()
             
         curriculum_data = CurriculumData(subject_name, grade_level, curriculum_name)
         
@@ -194,19 +203,11 @@ def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
         in_data_section = False
         
         for idx in range(start_row + 3, end_row):
-            row = df_raw.iloc[idx]
-            first_col = str(row[0]).strip() if pd.notna(row[0]) else ''
-            if first_col.lower().startswith('subject name'): break
-            
-            row_values = [str(val).strip().upper() for val in row.values if pd.notna(val)]
-            is_header = any(h in row_values for h in ['NO', 'TITLE', 'STANDARD', 'NOTE'])
-            
-            if is_header:
+            if sheet.header[idx]:
                 in_data_section = True
                 continue
                 
-            row_empty = all(pd.isna(val) or str(val).strip() == '' for val in row.values)
-            if row_empty and in_data_section:
+            if sheet.empty[idx] and in_data_section:
                 if current_unit_title and current_subtopics:
                     unit_index += 1
                     curriculum_data.units.append((unit_index, current_unit_title, current_subtopics))
@@ -215,33 +216,24 @@ def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
                 continue
                 
             if not in_data_section:
+                first_col = sheet.text[0][idx]
                 if first_col and len(first_col) > 3:
                     current_unit_title = first_col
-            else:
-                if len(row) >= 3:
-                    no_val = row[0]
-                    standard_val = row[1]
-                    title_val = row[2]
-                    note_val = row[3] if len(row) > 3 else ''
-                    
-                    try: sub_idx = int(float(no_val)) if pd.notna(no_val) else len(current_subtopics) + 1
-                    except: sub_idx = len(current_subtopics) + 1
-                    
-                    title = str(title_val).strip() if pd.notna(title_val) else ''
-                    if pd.notna(standard_val) and str(standard_val).strip():
-                        title = f"{str(standard_val).strip()} - {title}"
-                    note = str(note_val).strip() if pd.notna(note_val) else ''
+            elif sheet.n_cols >= 3:
+                sub_idx, title, note = sheet.subtopic(idx, " - ")
+                if sub_idx is None:
+                    sub_idx = len(current_subtopics) + 1
+                
+                if title and title != 'nan' and len(title) > 2:
+                    current_subtopics.append((sub_idx, title, note))
                     
-                    if title and title != 'nan' and len(title) > 2:
-                        current_subtopics.append((sub_idx, title, note))
-                        
-                    if in_data_section and 'mini bundle' in str(note).lower():
-                        if current_unit_title and current_subtopics:
-                            unit_index += 1
-                            curriculum_data.units.append((unit_index, current_unit_title, current_subtopics))
-                            current_subtopics = []
-                            current_unit_title = None
-                            in_data_section = False
+                if 'mini bundle' in note.lower():
+                    if current_unit_title and current_subtopics:
+                        unit_index += 1
+                        curriculum_data.units.append((unit_index, current_unit_title, current_subtopics))
+                        current_subtopics = []
+                        current_unit_title = None
+                        in_data_section = False
                             
         if current_unit_title and current_subtopics:
             unit_index += 1
@@ -253,57 +245,42 @@ def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
     return all_curricula
 
 # ───────────────────────  OPENAI & PROMPTS  ────────────────────────────────
-@backoff.on_exception(backoff.expo, openai.RateLimitError, max_time=180)
-def _ask(prompt: str) -> str:
-    return openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.7
-    ).choices[0].message.content
-
-def get_json(prompt: str) -> list:
+def stream_json(prompt: str, client: LLMClient, kind: str = None):
+    """Yield a deck's items as they stream in; breaking out of the loop stops the stream."""
     try:
-        response = _ask(prompt)
-        if '```' in response:
-            parts = response.split('```')
-            if len(parts) >= 3:
-                response = parts[1]
-                if response.strip().startswith(('json', 'JSON')):
-                    response = response[4:].strip()
-        match = re.search(r'\[.*\]', response, re.DOTALL)
-        if match:
-            return json.loads(match.group())
-        return []
+        yield from client.iter_items(prompt, response_format=response_format(kind))
     except Exception:
-        return []
+        return
 
 def p_mcq(topic, note, n, ctx):
-    return f"{ctx}\n\nWrite EXACTLY {n} higher-order MCQs for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"correct\":\"\",\"distractors\":[\"\",\"\",\"\"],\"explanation\":\"\"}}\n≤325 chars total per item. Randomise answer order."
+    return f"{ctx.prompt_context}\n\nWrite EXACTLY {n} higher-order MCQs for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"correct\":\"\",\"distractors\":[\"\",\"\",\"\"],\"explanation\":\"\"}}\n≤325 chars total per item. Randomise answer order."
 
 def p_tf(topic, note, n, ctx):
-    return f"{ctx}\n\nWrite EXACTLY {n} higher-order True/False statements for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"statement\":\"\",\"answer\":true/false,\"explanation\":\"\"}}\nIf answer is false, give ≤15-word explanation, else \"\". ≤325 chars item."
+    return f"{ctx.prompt_context}\n\nWrite EXACTLY {n} higher-order True/False statements for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"statement\":\"\",\"answer\":true/false,\"explanation\":\"\"}}\nIf answer is false, give ≤15-word explanation, else \"\". ≤325 chars item."
 
 def p_sa(topic, note, n, ctx):
-    return f"{ctx}\n\nWrite EXACTLY {n} higher-order short-answer Qs for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"answer\":\"\"}}\nQuestion ≤250 chars, answer ≤25 words."
+    return f"{ctx.prompt_context}\n\nWrite EXACTLY {n} higher-order short-answer Qs for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"answer\":\"\"}}\nQuestion ≤250 chars, answer ≤25 words."
 
 def p_tf_with_expl(topic, note, n, ctx):
-    return f"{ctx}\n\nWrite EXACTLY {n} True/False statements for: {topic}. After each, provide a concise explanation. Teacher note: {note}\nReturn JSON list: {{\"statement\":\"\",\"answer\":true/false,\"explanation\":\"\"}}\nEach explanation ≤25 words. ≤325 chars per item."
+    return f"{ctx.prompt_context}\n\nWrite EXACTLY {n} True/False statements for: {topic}. After each, provide a concise explanation. Teacher note: {note}\nReturn JSON list: {{\"statement\":\"\",\"answer\":true/false,\"explanation\":\"\"}}\nEach explanation ≤25 words. ≤325 chars per item."
 
 def p_open(topic, note, n, ctx):
-    return f"{ctx}\n\nWrite EXACTLY {n} open-ended science questions for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"answer\":\"\"}}\nQuestion ≤200 chars, sample answer ≤40 words."
+    return f"{ctx.prompt_context}\n\nWrite EXACTLY {n} open-ended science questions for: {topic}. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"answer\":\"\"}}\nQuestion ≤200 chars, sample answer ≤40 words."
 
 def p_scenario(topic, note, n, ctx):
-    return f"{ctx}\n\nWrite EXACTLY {n} short real-life scenarios for: {topic}. Ask ONE question. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"answer\":\"\"}}\nScenario+question ≤275 chars total, sample answer ≤40 words."
+    return f"{ctx.prompt_context}\n\nWrite EXACTLY {n} short real-life scenarios for: {topic}. Ask ONE question. Teacher note: {note}\nReturn JSON list: {{\"q\":\"\",\"answer\":\"\"}}\nScenario+question ≤275 chars total, sample answer ≤40 words."
 
 # ───────────────────────  BUILDERS  ────────────────────────────────
 def build_mcq(topic, note, ctx):
     deck = []
     attempts = 0
+    kind = 'caterpillar_mcq'
     while len(deck) < 30 and attempts < 15:
         attempts += 1
-        items = get_json(p_mcq(topic, note, 30-len(deck), ctx))
-        if not items: continue
-        for itm in items:
+        size = ctx.rates.request_size(topic, kind, 30-len(deck))
+        offered, before = 0, len(deck)
+        for itm in stream_json(p_mcq(topic, note, size, ctx), ctx.client, 'mcq'):
+            offered += 1
             try:
                 q = clean(itm["q"])
                 ok = clean(itm["correct"])
@@ -316,6 +293,7 @@ def build_mcq(topic, note, ctx):
                 deck.append((q, opts, "ABCD"[opts.index(ok)], exp))
                 if len(deck) == 30: break
             except: continue
+        ctx.rates.record(topic, kind, offered, len(deck) - before)
     return deck
 
 def bool_to_str(val):
@@ -326,11 +304,13 @@ def bool_to_str(val):
 def build_tf(topic, note, ctx, target=30):
     deck = []
     attempts = 0
+    kind = 'caterpillar_tf'
     while len(deck) < target and attempts < 15:
         attempts += 1
-        items = get_json(p_tf(topic, note, target-len(deck), ctx))
-        if not items: continue
-        for itm in items:
+        size = ctx.rates.request_size(topic, kind, target-len(deck))
+        offered, before = 0, len(deck)
+        for itm in stream_json(p_tf(topic, note, size, ctx), ctx.client, 'tf'):
+            offered += 1
             try:
                 stmt = clean(itm["statement"])
                 ans = bool_to_str(itm["answer"])
@@ -340,16 +320,19 @@ def build_tf(topic, note, ctx, target=30):
                 deck.append((stmt, ans, exp))
                 if len(deck) == target: break
             except: continue
+        ctx.rates.record(topic, kind, offered, len(deck) - before)
     return deck
 
 def build_sa(topic, note, ctx, target=30):
     deck = []
     attempts = 0
+    kind = 'caterpillar_sa'
     while len(deck) < target and attempts < 15:
         attempts += 1
-        items = get_json(p_sa(topic, note, target-len(deck), ctx))
-        if not items: continue
-        for itm in items:
+        size = ctx.rates.request_size(topic, kind, target-len(deck))
+        offered, before = 0, len(deck)
+        for itm in stream_json(p_sa(topic, note, size, ctx), ctx.client, 'sa'):
+            offered += 1
             try:
                 q = clean(itm["q"])
                 ans = clean(itm["answer"])
@@ -358,16 +341,19 @@ def build_sa(topic, note, ctx, target=30):
                 deck.append((q, ans))
                 if len(deck) == target: break
             except: continue
+        ctx.rates.record(topic, kind, offered, len(deck) - before)
     return deck
 
 def build_tf_expl(topic, note, ctx, target=20):
     deck = []
     attempts = 0
+    kind = 'caterpillar_tf_expl'
     while len(deck) < target and attempts < 15:
         attempts += 1
-        items = get_json(p_tf_with_expl(topic, note, target-len(deck), ctx))
-        if not items: continue
-        for itm in items:
+        size = ctx.rates.request_size(topic, kind, target-len(deck))
+        offered, before = 0, len(deck)
+        for itm in stream_json(p_tf_with_expl(topic, note, size, ctx), ctx.client, 'tf_expl'):
+            offered += 1
             try:
                 stmt = clean(itm["statement"])
                 ans = bool_to_str(itm["answer"])
@@ -377,16 +363,19 @@ def build_tf_expl(topic, note, ctx, target=20):
                 deck.append((stmt, ans, exp))
                 if len(deck) == target: break
             except: continue
+        ctx.rates.record(topic, kind, offered, len(deck) - before)
     return deck
 
 def build_open(topic, note, ctx, target=20):
     deck = []
     attempts = 0
+    kind = 'caterpillar_open'
     while len(deck) < target and attempts < 15:
         attempts += 1
-        items = get_json(p_open(topic, note, target-len(deck), ctx))
-        if not items: continue
-        for itm in items:
+        size = ctx.rates.request_size(topic, kind, target-len(deck))
+        offered, before = 0, len(deck)
+        for itm in stream_json(p_open(topic, note, size, ctx), ctx.client, 'open'):
+            offered += 1
             try:
                 q = clean(itm["q"])
                 ans = clean(itm["answer"])
@@ -394,16 +383,19 @@ def build_open(topic, note, ctx, target=20):
                 deck.append((q, ans))
                 if len(deck) == target: break
             except: continue
+        ctx.rates.record(topic, kind, offered, len(deck) - before)
     return deck
 
 def build_scenario(topic, note, ctx, target=10):
     deck = []
     attempts = 0
+    kind = 'caterpillar_scenario'
     while len(deck) < target and attempts < 15:
         attempts += 1
-        items = get_json(p_scenario(topic, note, target-len(deck), ctx))
-        if not items: continue
-        for itm in items:
+        size = ctx.rates.request_size(topic, kind, target-len(deck))
+        offered, before = 0, len(deck)
+        for itm in stream_json(p_scenario(topic, note, size, ctx), ctx.client, 'scenario'):
+            offered += 1
             try:
                 q = clean(itm["q"])
                 ans = clean(itm["answer"])
@@ -411,259 +403,346 @@ def build_scenario(topic, note, ctx, target=10):
                 deck.append((q, ans))
                 if len(deck) == target: break
             except: continue
+        ctx.rates.record(topic, kind, offered, len(deck) - before)
     return deck
 
 # ───────────────────────  PDF GENERATION  ────────────────────────────────
 def doc(path):
-    return SimpleDocTemplate(str(path), pagesize=letter, leftMargin=35, rightMargin=35, topMargin=50, bottomMargin=40)
+    return SimpleDocTemplate(pdf_target(path), pagesize=letter, leftMargin=35, rightMargin=35, topMargin=50, bottomMargin=40)
 
-def sa_lines():
+def sa_lines(m):
     line = "_" * 85
-    return [Paragraph(line, ST["Line"]) for _ in range(2)]
+    return [m.para(line, "Line") for _ in range(2)]
 
-def lines_n(n: int):
+def lines_n(m, n: int):
     line = "_" * 85
-    return [Paragraph(line, ST["Line"]) for _ in range(max(1, n))]
+    return [m.para(line, "Line") for _ in range(max(1, n))]
+
+# Page templates that can be drawn: path -> True, or False if missing or unreadable.
+_backgrounds = {}
+
+def _background(img_path) -> bool:
+    key = str(img_path)
+    if key not in _backgrounds:
+        try:
+            ImageReader(key).getSize()
+            _backgrounds[key] = True
+        except Exception:
+            _backgrounds[key] = False
+    return _backgrounds[key]
 
 def _draw_image_if_exists(c, img_path):
+    """
+    Draw a page template. It is passed to ReportLab by file name, so the
+    JPEG is embedded as-is once per PDF and every page refers to that one
+    image object, keyed by the name; an ImageReader here would decode and
+    hash the full RGB image on every page just to find the same object.
+    """
+    if not _background(img_path):
+        return
     try:
-        if img_path.exists():
-            img = ImageReader(str(img_path))
-            c.drawImage(img, 0, 0, width=letter[0], height=letter[1], mask='auto')
+        c.drawImage(str(img_path), 0, 0, width=letter[0], height=letter[1], mask='auto')
     except: pass
 
-def q_first(c, d): _draw_image_if_exists(c, QUESTION_FIRST_IMG); c.setFont(FONT, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
-def a_first(c, d): _draw_image_if_exists(c, ANSWER_FIRST_IMG); c.setFont(FONT, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
-def qa_other(c, d): _draw_image_if_exists(c, QA_OTHER_IMG); c.setFont(FONT, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
-def preview_first_onpage(c, d): _draw_image_if_exists(c, PREVIEW_FIRST_IMG); c.setFont(FONT, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
-def preview_other_onpage(c, d): _draw_image_if_exists(c, PREVIEW_OTHER_IMG); c.setFont(FONT, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
+def q_first(c, d, fonts): _draw_image_if_exists(c, QUESTION_FIRST_IMG); c.setFont(fonts.regular, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
+def a_first(c, d, fonts): _draw_image_if_exists(c, ANSWER_FIRST_IMG); c.setFont(fonts.regular, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
+def qa_other(c, d, fonts): _draw_image_if_exists(c, QA_OTHER_IMG); c.setFont(fonts.regular, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
+def preview_first_onpage(c, d, fonts): _draw_image_if_exists(c, PREVIEW_FIRST_IMG); c.setFont(fonts.regular, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
+def preview_other_onpage(c, d, fonts): _draw_image_if_exists(c, PREVIEW_OTHER_IMG); c.setFont(fonts.regular, 10); c.drawCentredString(letter[0]/2, 25, str(d.page))
 
-def make_mcq(ws_pdf, ans_pdf, main, sub, deck):
+def make_mcq(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    f = ctx.fonts
     sub_t = strip_title_prefix(sub)
-    story=[Paragraph(f"<b>{wrap_special(sub_t, FONT_RALEWAY_SB)}</b>", ST["Doc"]), Spacer(1,10)]
+    story=[m.para(f"<b>{wrap_special(sub_t, f.heading, f.dejavu)}</b>", "Doc"), Spacer(1,10)]
     for i,(q,opts,_,_) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"])] + \
-             [Paragraph(f"{l}. {wrap_special(t, FONT_LATO_REG)}", ST["Opt"]) for l,t in zip("ABCD",opts)] + \
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q")] + \
+             [m.para(f"{l}. {wrap_special(t, f.regular, f.dejavu)}", "Opt") for l,t in zip("ABCD",opts)] + \
              [Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=q_first, onLaterPages=qa_other)
+    doc(ws_pdf).build(story, onFirstPage=on_page(q_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
     hdr=f"{sub_t} - Answer Sheet"
-    story=[Paragraph(wrap_special(hdr, FONT_RALEWAY_SB), ST["AnsH"]), Spacer(1,10)]
+    story=[m.para(wrap_special(hdr, f.heading, f.dejavu), "AnsH"), Spacer(1,10)]
     for i,(q,opts,ans,exp) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"])]
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q")]
         for l,t in zip("ABCD",opts):
-            style = ST["Red"] if l==ans else ST["Opt"]
-            blk.append(Paragraph(f"{l}. {wrap_special(t, FONT_LATO_REG)}", style))
-        blk.append(Paragraph(wrap_special(f"Here’s Why : {exp}", FONT_LATO_LIGHT), ST["Expl"]))
+            style = "Red" if l==ans else "Opt"
+            blk.append(m.para(f"{l}. {wrap_special(t, f.regular, f.dejavu)}", style))
+        blk.append(m.para(wrap_special(f"Here’s Why : {exp}", f.light, f.dejavu), "Expl"))
         blk.append(Spacer(1,8))
         story.append(KeepTogether(blk))
-    doc(ans_pdf).build(story, onFirstPage=a_first, onLaterPages=qa_other)
+    doc(ans_pdf).build(story, onFirstPage=on_page(a_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
-def make_tf(ws_pdf, ans_pdf, main, sub, deck):
+def make_tf(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    f = ctx.fonts
     sub_t = strip_title_prefix(sub)
-    story=[Paragraph(f"<b>{wrap_special(sub_t + ' – True/False', FONT_RALEWAY_SB)}</b>", ST["Doc"]), Spacer(1,10)]
+    story=[m.para(f"<b>{wrap_special(sub_t + ' – True/False', f.heading, f.dejavu)}</b>", "Doc"), Spacer(1,10)]
     for i,(stmt,_,_) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(stmt, FONT_LATO_REG)}", ST["Q"]) ]
-        opt_row = Table([[Paragraph("a. True", ST["Opt"]), Paragraph("b. False", ST["Opt"]) ]], colWidths=None, hAlign='LEFT')
+        blk=[m.para(f"{i}. {wrap_special(stmt, f.regular, f.dejavu)}", "Q") ]
+        opt_row = Table([[m.para("a. True", "Opt"), m.para("b. False", "Opt") ]], colWidths=None, hAlign='LEFT')
         opt_row.setStyle(TableStyle([('LEFTPADDING', (0,0), (-1,-1), 25), ('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
         blk += [opt_row, Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=q_first, onLaterPages=qa_other)
+    doc(ws_pdf).build(story, onFirstPage=on_page(q_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
     hdr=f"{sub_t} - Answer Sheet"
-    story=[Paragraph(wrap_special(hdr, FONT_RALEWAY_SB), ST["AnsH"]), Spacer(1,10)]
+    story=[m.para(wrap_special(hdr, f.heading, f.dejavu), "AnsH"), Spacer(1,10)]
     for i,(stmt,ans,exp) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(stmt, FONT_LATO_REG)}", ST["Q"])]
-        styleA = ST["RedU"] if ans=="True" else ST["Opt"]
-        styleB = ST["RedU"] if ans=="False" else ST["Opt"]
-        opt_row = Table([[Paragraph("a. True", styleA), Paragraph("b. False", styleB)]], colWidths=None, hAlign='LEFT')
+        blk=[m.para(f"{i}. {wrap_special(stmt, f.regular, f.dejavu)}", "Q")]
+        styleA = "RedU" if ans=="True" else "Opt"
+        styleB = "RedU" if ans=="False" else "Opt"
+        opt_row = Table([[m.para("a. True", styleA), m.para("b. False", styleB)]], colWidths=None, hAlign='LEFT')
         opt_row.setStyle(TableStyle([('LEFTPADDING', (0,0), (-1,-1), 25), ('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
         blk.append(opt_row)
         if ans=="False" and exp:
-            blk.append(Paragraph(wrap_special(f"Here’s Why : {exp}", FONT_LATO_LIGHT), ST["Expl"]))
+            blk.append(m.para(wrap_special(f"Here’s Why : {exp}", f.light, f.dejavu), "Expl"))
         blk.append(Spacer(1,8))
         story.append(KeepTogether(blk))
-    doc(ans_pdf).build(story, onFirstPage=a_first, onLaterPages=qa_other)
+    doc(ans_pdf).build(story, onFirstPage=on_page(a_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
-def make_sa(ws_pdf, ans_pdf, main, sub, deck):
+def make_sa(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    f = ctx.fonts
     sub_t = strip_title_prefix(sub)
-    story=[Paragraph(f"<b>{wrap_special(sub_t + ' – Short Answer', FONT_RALEWAY_SB)}</b>", ST["Doc"]), Spacer(1,10)]
+    story=[m.para(f"<b>{wrap_special(sub_t + ' – Short Answer', f.heading, f.dejavu)}</b>", "Doc"), Spacer(1,10)]
     for i,(q,_) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"]) ] + sa_lines() + [Spacer(1,12)]
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q") ] + sa_lines(m) + [Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=q_first, onLaterPages=qa_other)
+    doc(ws_pdf).build(story, onFirstPage=on_page(q_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
     hdr=f"{sub_t} - Answer Sheet"
-    story=[Paragraph(wrap_special(hdr, FONT_RALEWAY_SB), ST["AnsH"]), Spacer(1,10)]
+    story=[m.para(wrap_special(hdr, f.heading, f.dejavu), "AnsH"), Spacer(1,10)]
     for i,(q,ans) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"]),
-             Paragraph(f"<font color='red'>{wrap_special(ans, FONT_LATO_REG)}</font>", ST["Opt"]),
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q"),
+             m.para(f"<font color='red'>{wrap_special(ans, f.regular, f.dejavu)}</font>", "Opt"),
              Spacer(1,8)]
         story.append(KeepTogether(blk))
-    doc(ans_pdf).build(story, onFirstPage=a_first, onLaterPages=qa_other)
+    doc(ans_pdf).build(story, onFirstPage=on_page(a_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
-def make_tf_with_expl(ws_pdf, ans_pdf, main, sub, deck):
+def make_tf_with_expl(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    f = ctx.fonts
     sub_t = strip_title_prefix(sub)
-    story=[Paragraph(f"<b>{wrap_special(sub_t + ' – True/False with Explanation', FONT_RALEWAY_SB)}</b>", ST["Doc"]), Spacer(1,10)]
-    story.append(Paragraph(wrap_special("Read each statement carefully. Mark it as True (a) or False (b), then explain your answer.", FONT_LATO_REG), ST["Instr"]))
+    story=[m.para(f"<b>{wrap_special(sub_t + ' – True/False with Explanation', f.heading, f.dejavu)}</b>", "Doc"), Spacer(1,10)]
+    story.append(m.para(wrap_special("Read each statement carefully. Mark it as True (a) or False (b), then explain your answer.", f.regular, f.dejavu), "Instr"))
     for i,(stmt,_,_) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(stmt, FONT_LATO_REG)}", ST["Q"]) ]
-        opt_row = Table([[Paragraph("a. True", ST["Opt"]), Paragraph("b. False", ST["Opt"]) ]], colWidths=None, hAlign='LEFT')
+        blk=[m.para(f"{i}. {wrap_special(stmt, f.regular, f.dejavu)}", "Q") ]
+        opt_row = Table([[m.para("a. True", "Opt"), m.para("b. False", "Opt") ]], colWidths=None, hAlign='LEFT')
         opt_row.setStyle(TableStyle([('LEFTPADDING', (0,0), (-1,-1), 25), ('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
         blk += [opt_row]
-        blk += lines_n(2) + [Spacer(1,12)]
+        blk += lines_n(m, 2) + [Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=q_first, onLaterPages=qa_other)
+    doc(ws_pdf).build(story, onFirstPage=on_page(q_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
     hdr=f"{sub_t} - Answer Sheet"
-    story=[Paragraph(wrap_special(hdr, FONT_RALEWAY_SB), ST["AnsH"]), Spacer(1,10)]
+    story=[m.para(wrap_special(hdr, f.heading, f.dejavu), "AnsH"), Spacer(1,10)]
     for i,(stmt,ans,exp) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(stmt, FONT_LATO_REG)}", ST["Q"]) ]
-        styleA = ST["RedU"] if ans=="True" else ST["Opt"]
-        styleB = ST["RedU"] if ans=="False" else ST["Opt"]
-        opt_row = Table([[Paragraph("a. True", styleA), Paragraph("b. False", styleB)]], colWidths=None, hAlign='LEFT')
+        blk=[m.para(f"{i}. {wrap_special(stmt, f.regular, f.dejavu)}", "Q") ]
+        styleA = "RedU" if ans=="True" else "Opt"
+        styleB = "RedU" if ans=="False" else "Opt"
+        opt_row = Table([[m.para("a. True", styleA), m.para("b. False", styleB)]], colWidths=None, hAlign='LEFT')
         opt_row.setStyle(TableStyle([('LEFTPADDING', (0,0), (-1,-1), 25), ('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
         blk.append(opt_row)
-        if exp: blk.append(Paragraph(wrap_special(f"Here’s Why : {exp}", FONT_LATO_LIGHT), ST["Expl"]))
+        if exp: blk.append(m.para(wrap_special(f"Here’s Why : {exp}", f.light, f.dejavu), "Expl"))
         blk.append(Spacer(1,8))
         story.append(KeepTogether(blk))
-    doc(ans_pdf).build(story, onFirstPage=a_first, onLaterPages=qa_other)
+    doc(ans_pdf).build(story, onFirstPage=on_page(a_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
-def make_open(ws_pdf, ans_pdf, main, sub, deck):
+def make_open(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    f = ctx.fonts
     sub_t = strip_title_prefix(sub)
-    story=[Paragraph(f"<b>{wrap_special(sub_t + ' – Open-Ended Questions', FONT_RALEWAY_SB)}</b>", ST["Doc"]), Spacer(1,10)]
+    story=[m.para(f"<b>{wrap_special(sub_t + ' – Open-Ended Questions', f.heading, f.dejavu)}</b>", "Doc"), Spacer(1,10)]
     for i,(q,_) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"])]+ lines_n(3) + [Spacer(1,12)]
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q")]+ lines_n(m, 3) + [Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=q_first, onLaterPages=qa_other)
+    doc(ws_pdf).build(story, onFirstPage=on_page(q_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
     hdr=f"{sub_t} - Sample Answers"
-    story=[Paragraph(wrap_special(hdr, FONT_RALEWAY_SB), ST["AnsH"]), Spacer(1,10)]
+    story=[m.para(wrap_special(hdr, f.heading, f.dejavu), "AnsH"), Spacer(1,10)]
     for i,(q,ans) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"]),
-             Paragraph(f"<font color='red'>{wrap_special(ans, FONT_LATO_REG)}</font>", ST["Opt"]),
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q"),
+             m.para(f"<font color='red'>{wrap_special(ans, f.regular, f.dejavu)}</font>", "Opt"),
              Spacer(1,8)]
         story.append(KeepTogether(blk))
-    doc(ans_pdf).build(story, onFirstPage=a_first, onLaterPages=qa_other)
+    doc(ans_pdf).build(story, onFirstPage=on_page(a_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
-def make_scenario(ws_pdf, ans_pdf, main, sub, deck):
+def make_scenario(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    f = ctx.fonts
     sub_t = strip_title_prefix(sub)
-    story=[Paragraph(f"<b>{wrap_special(sub_t + ' – Scenario-Based Questions', FONT_RALEWAY_SB)}</b>", ST["Doc"]), Spacer(1,10)]
+    story=[m.para(f"<b>{wrap_special(sub_t + ' – Scenario-Based Questions', f.heading, f.dejavu)}</b>", "Doc"), Spacer(1,10)]
     for i,(q,_) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"])]+ lines_n(4) + [Spacer(1,12)]
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q")]+ lines_n(m, 4) + [Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=q_first, onLaterPages=qa_other)
+    doc(ws_pdf).build(story, onFirstPage=on_page(q_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
     hdr=f"{sub_t} - Sample Answers"
-    story=[Paragraph(wrap_special(hdr, FONT_RALEWAY_SB), ST["AnsH"]), Spacer(1,10)]
+    story=[m.para(wrap_special(hdr, f.heading, f.dejavu), "AnsH"), Spacer(1,10)]
     for i,(q,ans) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {wrap_special(q, FONT_LATO_REG)}", ST["Q"]),
-             Paragraph(f"<font color='red'>{wrap_special(ans, FONT_LATO_REG)}</font>", ST["Opt"]),
+        blk=[m.para(f"{i}. {wrap_special(q, f.regular, f.dejavu)}", "Q"),
+             m.para(f"<font color='red'>{wrap_special(ans, f.regular, f.dejavu)}</font>", "Opt"),
              Spacer(1,8)]
         story.append(KeepTogether(blk))
-    doc(ans_pdf).build(story, onFirstPage=a_first, onLaterPages=qa_other)
+    doc(ans_pdf).build(story, onFirstPage=on_page(a_first, ctx), onLaterPages=on_page(qa_other, ctx))
 
-def make_preview(preview_pdf, main, tf_basic, tf_expl, sa, openq, scen):
-    temp_pdf = pathlib.Path(str(preview_pdf) + '.tmp')
+def make_preview(preview_pdf, main, tf_basic, tf_expl, sa, openq, scen, ctx):
+    temp_pdf = io.BytesIO()
     frame = Frame(35, 40, letter[0] - 70, letter[1] - 90, id='normal')
-    pdf = BaseDocTemplate(str(temp_pdf), pagesize=letter)
+    pdf = BaseDocTemplate(temp_pdf, pagesize=letter)
     pdf.addPageTemplates([
-        PageTemplate(id='PreviewFirst', frames=[frame], onPage=preview_first_onpage, autoNextPageTemplate='PreviewOther'),
-        PageTemplate(id='PreviewOther', frames=[frame], onPage=preview_other_onpage),
+        PageTemplate(id='PreviewFirst', frames=[frame], onPage=on_page(preview_first_onpage, ctx), autoNextPageTemplate='PreviewOther'),
+        PageTemplate(id='PreviewOther', frames=[frame], onPage=on_page(preview_other_onpage, ctx)),
     ])
     story = [PageBreak()]
     
     # Add content (simplified for brevity, similar to original script)
     # ... (skipping detailed implementation for brevity, assuming similar structure)
     # For now, just adding a placeholder to ensure it works
-    story.append(Paragraph("Preview Content", ST["Doc"]))
+    story.append(Paragraph("Preview Content", ctx.styles["Doc"]))
     pdf.build(story)
     
     # Rasterize
+    data = temp_pdf.getvalue()
     try:
         if HAS_FITZ:
-            doc = fitz.open(str(temp_pdf))
-            c = pdfcanvas.Canvas(str(preview_pdf), pagesize=letter)
-            for p in doc:
-                pix = p.get_pixmap(dpi=150)
-                img = ImageReader(io.BytesIO(pix.tobytes('png')))
-                c.drawImage(img, 0, 0, width=letter[0], height=letter[1], mask='auto')
-                c.showPage()
-            c.save()
-            doc.close()
-        else:
-            shutil.copyfile(str(temp_pdf), str(preview_pdf))
-    except:
-        shutil.copyfile(str(temp_pdf), str(preview_pdf))
-    try: temp_pdf.unlink()
-    except: pass
+            data = rasterize(data)
+    except Exception as e:
+        print(f"⚠️  Preview rasterization failed, keeping the vector preview: {e}")
+    if hasattr(preview_pdf, 'write'):
+        preview_pdf.write(data)
+    else:
+        pathlib.Path(preview_pdf).write_bytes(data)
+
+# ───────────────────────  PIPELINE STAGES  ────────────────────────────────
+def fetch_subtopic(job):
+    """Pipeline stage 1: LLM round-trips for every deck of a subtopic."""
+    s_t, note, ctx = job['topic'], job['note'], job['ctx']
+    job['decks'] = (
+        build_tf(s_t, note, ctx, target=DECK_TARGETS['tf']),
+        build_tf_expl(s_t, note, ctx, target=DECK_TARGETS['tf_expl']),
+        build_sa(s_t, note, ctx, target=DECK_TARGETS['sa']),
+        build_open(s_t, note, ctx, target=DECK_TARGETS['open']),
+        build_scenario(s_t, note, ctx, target=DECK_TARGETS['scenario']),
+    )
+    return job
+
+def first_attempt_prompts(topic, note, ctx):
+    """(prompt, response_format) each builder in fetch_subtopic sends on its first attempt."""
+    size = lambda kind: ctx.rates.request_size(topic, f'caterpillar_{kind}', DECK_TARGETS[kind])
+    return [
+        (p_tf(topic, note, size('tf'), ctx), response_format('tf')),
+        (p_tf_with_expl(topic, note, size('tf_expl'), ctx), response_format('tf_expl')),
+        (p_sa(topic, note, size('sa'), ctx), response_format('sa')),
+        (p_open(topic, note, size('open'), ctx), response_format('open')),
+        (p_scenario(topic, note, size('scenario'), ctx), response_format('scenario')),
+    ]
+
+def render_subtopic(job):
+    """Worksheet and answer-sheet PDFs, rendered into job['files']."""
+    tf_basic, tf_expl, sa, openq, scen = job['decks']
+    s_t, m_t, ctx = job['topic'], job['unit_title'], job['ctx']
+    sub_path = job['sub_path']
+    
+    tf_basic_dir = f"{sub_path}/1. True, False Type Questions"
+    tf_expl_dir = f"{sub_path}/2. True-False Type Questions with Explanation"
+    sa_dir = f"{sub_path}/3. Short Answer Type Questions"
+    open_dir = f"{sub_path}/4. Open-Ended Questions"
+    scen_dir = f"{sub_path}/5. Scenario-Based Questions"
+    prev_dir = f"{sub_path}/6. Preview PDFs"
+    
+    base = safe_name(strip_title_prefix(s_t))
+    model = QuestionModel(ctx.styles)
+    files = []
+    def pdfs(folder, worksheet, answers):
+        ws, ans = io.BytesIO(), io.BytesIO()
+        files.append((f"{folder}/{base} – {worksheet}.pdf", ws))
+        files.append((f"{folder}/{base} – {answers}.pdf", ans))
+        return ws, ans
+    make_tf(*pdfs(tf_basic_dir, "True-False Worksheet", "True-False Answer Sheet"), m_t, s_t, tf_basic, ctx, model=model)
+    make_tf_with_expl(*pdfs(tf_expl_dir, "True-False with Explanation Worksheet", "True-False with Explanation Answer Sheet"), m_t, s_t, tf_expl, ctx, model=model)
+    make_sa(*pdfs(sa_dir, "Short Answer Worksheet", "Short Answer Answer Sheet"), m_t, s_t, sa, ctx, model=model)
+    make_open(*pdfs(open_dir, "Open-Ended Worksheet", "Open-Ended Sample Answers"), m_t, s_t, openq, ctx, model=model)
+    make_scenario(*pdfs(scen_dir, "Scenario-Based Worksheet", "Scenario-Based Sample Answers"), m_t, s_t, scen, ctx, model=model)
+    
+    job['files'] = [(name, buf.getvalue()) for name, buf in files]
+    job['preview_pdf'] = f"{prev_dir}/{base} – Preview.pdf"
+    return job
+
+def preview_subtopic(job):
+    """Rasterized preview."""
+    tf_basic, tf_expl, sa, openq, scen = job['decks']
+    buf = io.BytesIO()
+    make_preview(buf, job['unit_title'], tf_basic, tf_expl, sa, openq, scen, job['ctx'])
+    job['files'].append((job['preview_pdf'], buf.getvalue()))
+    return job
+
+def render_files(job):
+    """Every PDF for one subtopic as (arcname, bytes); runs in a render worker process."""
+    job['ctx'] = GenerationContext(job['fonts'], get_styles(job['fonts']))
+    return preview_subtopic(render_subtopic(job))['files']
+
 
 # ───────────────────────  MAIN GENERATOR  ────────────────────────────────
-def generate_caterpillar_worksheets(excel_path: str, output_dir: str, api_key: str):
-    global openai, ST
-    openai.api_key = api_key
-    register_fonts()
-    ST = get_styles()
+def generate_caterpillar_worksheets(excel_path: str, output_dir: str, api_key: str,
+                                    subtopic_concurrency: int = SUBTOPIC_CONCURRENCY,
+                                    max_in_flight: int = MAX_IN_FLIGHT,
+                                    cache_mode: str = CACHE_MODE,
+                                    mode: str = 'online',
+                                    materialize_output: bool = MATERIALIZE_OUTPUT,
+                                    resume: bool = RESUME):
+    """
+    Caterpillar worksheets for every subtopic in the workbook. Yields the
+    same events as generate_worksheets, with each subtopic's PDFs as the
+    'result' event's 'files'; materialize_output also writes them under
+    output_dir. With resume, subtopics finished by an earlier run (see
+    checkpoints.py) are replayed first without LLM calls.
+    """
+    if mode not in GENERATION_MODES:
+        raise ValueError(f"mode must be one of {GENERATION_MODES}")
+    client = LLMClient(api_key, max_in_flight=max_in_flight,
+                       cache_mode=cache_mode)
+    rates = AcceptanceRates(version=PROMPT_VERSION)
+    pool = render_pool(register_fonts)
+    fonts = register_fonts()
+    templates = (QUESTION_FIRST_IMG, ANSWER_FIRST_IMG, QA_OTHER_IMG, PREVIEW_FIRST_IMG, PREVIEW_OTHER_IMG)
+    checkpoints = JobCheckpoints('caterpillar', PROMPT_VERSION, cache_mode, resume,
+                                 render_version=render_version(__file__, fonts, templates))
+    base_ctx = GenerationContext(fonts, get_styles(fonts), client, rates)
     
     yield {'type': 'progress', 'message': 'Loading curriculum...'}
     all_curricula = load_curriculum_from_excel(excel_path)
     
-    root_folder = pathlib.Path(output_dir)
-    root_folder.mkdir(parents=True, exist_ok=True)
-    
     total_subtopics = sum(len(subs) for c in all_curricula for _, _, subs in c.units)
     yield {'type': 'progress', 'message': f'Found {total_subtopics} subtopics.'}
     
-    processed_count = 0
-    
+    jobs = []
     for curriculum in all_curricula:
         main_folder_name = f"{safe_name(curriculum.grade_level)} - {safe_name(curriculum.curriculum_name)} - {safe_name(curriculum.subject_name)}"
-        main_dir = root_folder / main_folder_name
-        main_dir.mkdir(exist_ok=True)
+        main_dir = pathlib.PurePosixPath(main_folder_name)
         
-        ctx = curriculum.get_prompt_context()
+        ctx = base_ctx.for_curriculum(curriculum)
         
         for m_i, m_t, subs in curriculum.units:
             unit_folder_name = f"{m_i:02d}. {m_t}"
             unit_dir = main_dir / safe_name(unit_folder_name)
-            unit_dir.mkdir(exist_ok=True)
             
             for s_i, s_t, note in subs:
-                yield {'type': 'progress', 'message': f'Generating: {s_t}'}
-                
-                sub_dir = unit_dir / safe_name(f"{s_i:02d}. {s_t}")
-                sub_dir.mkdir(exist_ok=True)
-                
-                tf_basic_dir = sub_dir / "1. True, False Type Questions"; tf_basic_dir.mkdir(exist_ok=True)
-                tf_expl_dir = sub_dir / "2. True-False Type Questions with Explanation"; tf_expl_dir.mkdir(exist_ok=True)
-                sa_dir = sub_dir / "3. Short Answer Type Questions"; sa_dir.mkdir(exist_ok=True)
-                open_dir = sub_dir / "4. Open-Ended Questions"; open_dir.mkdir(exist_ok=True)
-                scen_dir = sub_dir / "5. Scenario-Based Questions"; scen_dir.mkdir(exist_ok=True)
-                prev_dir = sub_dir / "6. Preview PDFs"; prev_dir.mkdir(exist_ok=True)
-                
-                # Generate Content
-                tf_basic = build_tf(s_t, note, ctx, target=25)
-                tf_expl = build_tf_expl(s_t, note, ctx, target=25)
-                sa = build_sa(s_t, note, ctx, target=20)
-                openq = build_open(s_t, note, ctx, target=20)
-                scen = build_scenario(s_t, note, ctx, target=10)
-                
-                # Generate PDFs
-                base = safe_name(strip_title_prefix(s_t))
-                make_tf(tf_basic_dir / f"{base} – True-False Worksheet.pdf", tf_basic_dir / f"{base} – True-False Answer Sheet.pdf", m_t, s_t, tf_basic)
-                make_tf_with_expl(tf_expl_dir / f"{base} – True-False with Explanation Worksheet.pdf", tf_expl_dir / f"{base} – True-False with Explanation Answer Sheet.pdf", m_t, s_t, tf_expl)
-                make_sa(sa_dir / f"{base} – Short Answer Worksheet.pdf", sa_dir / f"{base} – Short Answer Answer Sheet.pdf", m_t, s_t, sa)
-                make_open(open_dir / f"{base} – Open-Ended Worksheet.pdf", open_dir / f"{base} – Open-Ended Sample Answers.pdf", m_t, s_t, openq)
-                make_scenario(scen_dir / f"{base} – Scenario-Based Worksheet.pdf", scen_dir / f"{base} – Scenario-Based Sample Answers.pdf", m_t, s_t, scen)
-                make_preview(prev_dir / f"{base} – Preview.pdf", m_t, tf_basic, tf_expl, sa, openq, scen)
-                
-                processed_count += 1
-                yield {
-                    'type': 'result',
+                jobs.append({
                     'topic': s_t,
-                    'path': str(sub_dir),
-                    'progress': f"{processed_count}/{total_subtopics}"
-                }
-                
-    yield {'type': 'complete', 'path': str(root_folder)}
+                    'note': note,
+                    'checkpoint': checkpoints.key(curriculum, m_t, s_t, note),
+                    'ctx': ctx,
+                    'unit_title': m_t,
+                    'sub_path': str(unit_dir / safe_name(f"{s_i:02d}. {s_t}")),
+                })
+    
+    stages = [
+        Stage('fetch', fetch_subtopic, workers=subtopic_concurrency),
+        Stage('render', render_stage(pool, render_files), workers=pool_workers(pool)),
+    ]
+    batch = (client, first_attempt_prompts) if mode == 'batch' else None
+    yield from run_subtopic_jobs(jobs, stages, checkpoints, output_dir, materialize_output,
+                                 batch=batch, queue_size=PIPELINE_QUEUE_SIZE)
@@ -0,0 +1,249 @@
+"""
+Checkpoints of finished subtopics, so re-running a workbook skips them.
+
+A generation job used to start from scratch every time: if a 200-topic
+Celery job died at topic 150, retrying it or uploading the workbook again
+paid for all 200 topics again. Each finished subtopic's PDFs are now stored
+under a fingerprint of everything that decides them: the generator and its
+PROMPT_VERSION, the curriculum (subject, grade level, name), the unit, the
+subtopic title and the teacher note. A job looks its subtopics up before
+it starts and replays the ones it finds as 'result' events without any LLM
+calls, so only new or edited rows of the workbook are generated. A row's
+position is not part of the fingerprint: files are stored relative to the
+subtopic's folder and placed under wherever the row is now.
+
+The store is a single SQLite file next to the response cache, shared by
+every process on the machine, with a TTL and size-based LRU eviction. It
+is capped at 256 MB by default so it fits next to the response cache on a
+small VM without a volume (fly.toml); raise CHECKPOINT_MAX_BYTES where
+there is disk to spare.
+
+How the PDFs are rendered is fingerprinted too, without anyone having to
+remember it: render_version() hashes the generator's source and that of
+the shared rendering modules (RENDER_MODULES), the font files it drew
+with, its page templates and the preview settings (PREVIEW_DPI,
+PREVIEW_FORMAT, PREVIEW_JPEG_QUALITY). Editing any of them, or deploying a
+different font, makes every subtopic new again instead of replaying ones
+rendered the old way. Bump a generator's PROMPT_VERSION for changes
+elsewhere that alter its output (llm_client, llm_json, ...).
+
+RESUME=off turns checkpoints off. Like the response cache, a job with
+cache_mode 'refresh' regenerates every subtopic and overwrites their
+checkpoints, and 'bypass' neither reads nor writes them.
+"""
+
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+
+from font_registry import font_file
+from preview_raster import PREVIEW_DPI, PREVIEW_FORMAT, PREVIEW_JPEG_QUALITY
+
+CHECKPOINT_PATH = os.environ.get(
+    "CHECKPOINT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "checkpoints.sqlite3"))
+RESUME = os.environ.get("RESUME", "on").lower() not in ("0", "off", "false")
+CHECKPOINT_TTL = float(os.environ.get("CHECKPOINT_TTL", str(14 * 24 * 3600)))
+CHECKPOINT_MAX_BYTES = int(os.environ.get("CHECKPOINT_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Eviction is checked every this many writes rather than on each one.
+_EVICT_EVERY = 20
+
+# Modules besides the generator itself whose code decides how its PDFs look.
+RENDER_MODULES = ('render_model', 'text_wrap', 'pdf_compose', 'preview_raster')
+
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _digest(path):
+    """Digest of the file at `path` (None if missing), read once per version of it."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _file_digest(os.path.abspath(str(path)), st.st_mtime_ns, st.st_size)
+
+
+def render_version(source: str, fonts=(), files=()) -> str:
+    """
+    Digest of how a generator renders: its `source` file, RENDER_MODULES,
+    the files registered under the names in `fonts`, other `files` it draws
+    (page templates) and the preview settings.
+    """
+    parts = [_digest(source)]
+    parts += [(name, _digest(importlib.util.find_spec(name).origin)) for name in RENDER_MODULES]
+    for name in fonts:
+        path = font_file(name)
+        parts.append((name, _digest(path) if path else None))
+    parts += [(os.path.basename(str(path)), _digest(path)) for path in files]
+    parts.append([PREVIEW_DPI, PREVIEW_FORMAT, PREVIEW_JPEG_QUALITY])
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def fingerprint(generator: str, prompt_version: str, render_version: str, curriculum,
+                unit: str, topic: str, note: str) -> str:
+    """Key of one subtopic's output; `curriculum` is a CurriculumData."""
+    parts = [generator, prompt_version, render_version, curriculum.subject_name, curriculum.grade_level,
+             curriculum.curriculum_name, unit, topic, note]
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CheckpointStore:
+    def __init__(self, path: str = CHECKPOINT_PATH, ttl: float = CHECKPOINT_TTL,
+                 max_bytes: int = CHECKPOINT_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # A subtopic is complete once its manifest row exists; it is written
+        # in the same transaction as its files.
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            " key TEXT PRIMARY KEY, names TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS manifest_accessed ON manifest(accessed)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " key TEXT NOT NULL, name TEXT NOT NULL, data BLOB NOT NULL,"
+            " PRIMARY KEY (key, name))")
+
+    def get(self, key: str):
+        """[(name, bytes)] stored under `key`, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT names, created FROM manifest WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            names, created = json.loads(row[0]), row[1]
+            if self.ttl and now - created > self.ttl:
+                self._delete([(key,)])
+                return None
+            data = dict(self._db.execute("SELECT name, data FROM files WHERE key = ?", (key,)))
+            self._db.execute("UPDATE manifest SET accessed = ? WHERE key = ?", (now, key))
+            return [(name, bytes(data[name])) for name in names]
+
+    def put(self, key: str, files):
+        now = time.time()
+        names = [name for name, _ in files]
+        size = sum(len(data) for _, data in files)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM files WHERE key = ?", (key,))
+                self._db.executemany("INSERT INTO files (key, name, data) VALUES (?, ?, ?)",
+                                     [(key, name, data) for name, data in files])
+                self._db.execute(
+                    "INSERT OR REPLACE INTO manifest (key, names, size, created, accessed)"
+                    " VALUES (?, ?, ?, ?, ?)", (key, json.dumps(names, ensure_ascii=False), size, now, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _delete(self, keys):
+        self._db.executemany("DELETE FROM manifest WHERE key = ?", keys)
+        self._db.executemany("DELETE FROM files WHERE key = ?", keys)
+
+    def _evict(self, now):
+        if self.ttl:
+            expired = self._db.execute(
+                "SELECT key FROM manifest WHERE created < ?", (now - self.ttl,)).fetchall()
+            self._delete(expired)
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM manifest").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so we are not evicting on every subsequent write.
+        excess = total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM manifest ORDER BY accessed"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._delete(doomed)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM manifest")
+            self._db.execute("DELETE FROM files")
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_store(path: str = CHECKPOINT_PATH) -> CheckpointStore:
+    """One CheckpointStore (and SQLite connection) per path per process."""
+    key = (os.getpid(), os.path.abspath(path))
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = CheckpointStore(path)
+        return _shared[key]
+
+
+class JobCheckpoints:
+    """A job's view of the checkpoint store, for one generator."""
+
+    def __init__(self, generator: str, prompt_version: str, cache_mode: str = 'use',
+                 enabled: bool = RESUME, store: CheckpointStore = None,
+                 render_version: str = ''):
+        self.generator = generator
+        self.prompt_version = prompt_version
+        self.render_version = render_version
+        self.read = enabled and cache_mode == 'use'
+        self.store = None
+        if enabled and cache_mode != 'bypass':
+            try:
+                self.store = store or shared_store()
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️  Checkpoints unavailable, generating every subtopic: {e}")
+                self.read = False
+
+    def key(self, curriculum, unit: str, topic: str, note: str) -> str:
+        return fingerprint(self.generator, self.prompt_version, self.render_version,
+                           curriculum, unit, topic, note)
+
+    def load(self, key: str, sub_path: str):
+        """The subtopic's stored files with arcnames under sub_path, or None."""
+        if not self.read:
+            return None
+        try:
+            files = self.store.get(key)
+        except sqlite3.Error as e:
+            print(f"⚠️  Checkpoint read failed: {e}")
+            return None
+        if files is None:
+            return None
+        return [(posixpath.join(sub_path, name), data) for name, data in files]
+
+    def save(self, key: str, sub_path: str, files):
+        """Store a finished subtopic's files (arcnames under sub_path)."""
+        if self.store is None:
+            return
+        try:
+            self.store.put(key, [(posixpath.relpath(name, sub_path), data) for name, data in files])
+        except sqlite3.Error as e:
+            print(f"⚠️  Checkpoint write failed: {e}")
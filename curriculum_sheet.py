@@ -0,0 +1,62 @@
+"""
+Column-wise scan of a curriculum workbook.
+
+The generators' load_curriculum_from_excel() used to walk the sheet row by
+row with df.iloc, turning every cell of a row into a stripped string again
+for each check (section marker, header row, blank separator, subtopic
+fields). That loop, not reading the file, was most of the time a workbook
+took to load. CurriculumSheet reads the first sheet once and works all of
+that out a column at a time; the loaders only step through the resulting
+lists to group subtopics into units, which depends on the rows before.
+"""
+
+import pandas as pd
+
+HEADER_CELLS = ('NO', 'TITLE', 'STANDARD', 'NOTE')
+
+
+def _number(value):
+    """int(float(value)), or None for blanks and cells that are not numbers."""
+    try:
+        return int(float(value))
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+class CurriculumSheet:
+    """
+    The first sheet of a curriculum workbook as per-column lists of stripped
+    cell text ('' for blank cells), plus which rows are section markers
+    ('Subject Name ...' in the first column), header rows (a NO, TITLE,
+    STANDARD or NOTE cell) and empty rows.
+    """
+
+    def __init__(self, excel_path):
+        df = pd.read_excel(excel_path, header=None).astype(object)
+        present = df.notna()
+        # Column by column: DataFrame.map needs pandas 2.1.
+        text = df.where(present, '').astype(str).apply(lambda col: col.str.strip())
+        first = text[0] if len(df.columns) else pd.Series('', index=df.index)
+
+        self.n_rows, self.n_cols = df.shape
+        self.present = [present[c].tolist() for c in df.columns]
+        self.text = [text[c].tolist() for c in df.columns]
+        self.header = text.apply(lambda col: col.str.upper()).isin(HEADER_CELLS).any(axis=1).tolist()
+        self.empty = (text == '').all(axis=1).tolist()
+        self.markers = [int(i) for i in first.index[first.str.lower().str.startswith('subject name')]]
+        self.numbers = [_number(v) for v in df[0]] if len(df.columns) else []
+
+    def value(self, row: int, col: int, default: str) -> str:
+        """Stripped text of a cell, or `default` if it is blank."""
+        return self.text[col][row] if self.present[col][row] else default
+
+    def subtopic(self, row: int, standard_sep: str):
+        """
+        (number or None, title, note) of a data row, the title prefixed with
+        the STANDARD cell and standard_sep when there is one.
+        """
+        title, standard = self.text[2][row], self.text[1][row]
+        if standard:
+            title = f"{standard}{standard_sep}{title}"
+        note = self.text[3][row] if self.n_cols > 3 else ''
+        return self.numbers[row], title, note
@@ -0,0 +1,52 @@
+"""
+Process-wide TrueType font registry.
+
+The generators call their register_fonts() at the start of every job, and
+each call used to parse the TTF files again with TTFont and replace the
+font objects in ReportLab's registry, under any other job in the same
+process that was still rendering with them. register_ttf() loads each
+(name, file) once per process and is a dictionary lookup after that;
+files that fail to load are remembered too. Forked render workers and
+Celery prefork children inherit the parent's registry. tasks.py also warms
+it in worker_process_init, so a worker's first job does not pay for the
+parsing either.
+"""
+
+import os
+import threading
+
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+_fonts = {}         # name -> absolute path first registered under it
+_failed = set()     # (name, absolute path) that could not be loaded
+_lock = threading.Lock()
+
+
+def register_ttf(name: str, path) -> bool:
+    """
+    Register the font file at `path` as `name`; False if it cannot be loaded.
+    The first file registered under a name keeps it (the generators ship
+    their own copies of e.g. DejaVuSans.ttf), so jobs never swap a face
+    out from under each other.
+    """
+    path = os.path.abspath(str(path))
+    key = (name, path)
+    with _lock:
+        if name in _fonts:
+            return True
+        if key in _failed:
+            return False
+        try:
+            pdfmetrics.registerFont(TTFont(name, path))
+        except Exception:
+            _failed.add(key)
+            return False
+        _fonts[name] = path
+        return True
+
+
+def font_file(name: str):
+    """Absolute path of the file registered as `name`, or None (built-in or unregistered)."""
+    with _lock:
+        return _fonts.get(name)
@@ -0,0 +1,48 @@
+"""
+Per-job state shared by a generator's prompt builders, deck builders and
+renderers.
+
+The generators used to keep the curriculum being written, the registered
+font names and the style sheet in module globals, set at the start of each
+job and again for each curriculum in the workbook, so two jobs in one
+process could send prompts for each other's curriculum. Each job now
+builds a GenerationContext and passes it down explicitly, which lets one
+process run any number of jobs on threads.
+
+A context is not modified once the job is running; for_curriculum() makes
+the copy for one curriculum of the workbook. Clients and style sheets
+cannot be pickled, so render workers in other processes are sent the
+fonts and build a client-less context of their own.
+"""
+
+import copy
+import functools
+
+from acceptance import STATIC_RATES
+
+
+class GenerationContext:
+    def __init__(self, fonts, styles, client=None, rates=STATIC_RATES,
+                 curriculum_name: str = "", grade_levels: str = "",
+                 prompt_context: str = "", **config):
+        self.fonts = fonts              # the generator's Fonts tuple
+        self.styles = styles            # read-only style sheet (style_registry)
+        self.client = client            # LLMClient, None in render workers
+        self.rates = rates
+        self.curriculum_name = curriculum_name
+        self.grade_levels = grade_levels
+        self.prompt_context = prompt_context
+        self.config = config            # generator settings, e.g. speculation
+
+    def for_curriculum(self, curriculum) -> 'GenerationContext':
+        """A copy of this context for one CurriculumData of the workbook."""
+        ctx = copy.copy(self)
+        ctx.curriculum_name = curriculum.curriculum_name
+        ctx.grade_levels = curriculum.grade_level
+        ctx.prompt_context = curriculum.get_prompt_context()
+        return ctx
+
+
+def on_page(fn, ctx):
+    """ReportLab page callback running fn(c, d, fonts) with the job's fonts."""
+    return functools.partial(fn, fonts=ctx.fonts)
@@ -0,0 +1,173 @@
+"""
+OpenAI Batch API support for bulk, non-interactive generation.
+
+In batch mode a generator collects the first-attempt prompt of every deck
+builder for every subtopic, sends them as one Batch request file, waits for
+the batch to finish and then primes the job's LLMClient with the replies.
+The builders then run unchanged: their first attempt is answered from the
+batch output, and only retries for decks that came back short go to the
+online API.
+
+Prompts that already have a cached first reply are left out of the batch.
+A batch that is still unfinished after BATCH_MAX_WAIT_SECONDS, or that
+cannot be polled BATCH_MAX_POLL_FAILURES times in a row, is cancelled and
+the job generates online instead. Point OPENAI_BASE_URL at a local stub
+that serves /files and /batches (tests/openai_stub.py is one) to exercise
+this without the real API.
+"""
+
+import json
+import os
+import time
+
+GENERATION_MODES = ('online', 'batch')
+
+BATCH_POLL_SECONDS = float(os.environ.get("LLM_BATCH_POLL_SECONDS", "30"))
+# Give up on a batch after this long (a little over its completion window).
+BATCH_MAX_WAIT_SECONDS = float(os.environ.get("LLM_BATCH_MAX_WAIT_SECONDS", str(25 * 3600)))
+BATCH_MAX_POLL_FAILURES = int(os.environ.get("LLM_BATCH_MAX_POLL_FAILURES", "10"))
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+_FINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchRun:
+    def __init__(self, client, requests):
+        """`requests` is a list of (prompt, response_format) pairs."""
+        self.client = client
+        # The same prompt can appear for two identical subtopics; ask it once.
+        self.formats = dict(requests)
+        self.prompts = list(self.formats)
+        self.batch = None
+
+    def request_file(self) -> bytes:
+        lines = []
+        for i, prompt in enumerate(self.prompts):
+            body = {
+                "model": self.client.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": self.client.temperature,
+            }
+            if self.client.structured_output and self.formats[prompt]:
+                body["response_format"] = self.formats[prompt]
+            lines.append(json.dumps({
+                "custom_id": f"p{i}",
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": body,
+            }, ensure_ascii=False))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def submit(self):
+        api = self.client.api
+        upload = self.client.run(api.files.create(
+            file=("requests.jsonl", self.request_file()), purpose="batch"))
+        self.batch = self.client.run(api.batches.create(
+            input_file_id=upload.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=BATCH_COMPLETION_WINDOW,
+        ))
+        return self.batch
+
+    def poll(self):
+        self.batch = self.client.run(self.client.api.batches.retrieve(self.batch.id))
+        return self.batch
+
+    def cancel(self):
+        self.batch = self.client.run(self.client.api.batches.cancel(self.batch.id))
+        return self.batch
+
+    @property
+    def done(self) -> bool:
+        return self.batch is not None and self.batch.status in _FINAL_STATES
+
+    def results(self) -> dict:
+        """prompt → reply text for every request that succeeded."""
+        file_id = getattr(self.batch, "output_file_id", None)
+        if not file_id:
+            return {}
+        content = self.client.run(self.client.api.files.content(file_id))
+        out = {}
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+                idx = int(rec["custom_id"][1:])
+                resp = rec.get("response") or {}
+                if resp.get("status_code") != 200:
+                    continue
+                out[self.prompts[idx]] = resp["body"]["choices"][0]["message"]["content"]
+            except (ValueError, KeyError, IndexError, TypeError):
+                continue
+        return out
+
+
+def run_batch(client, requests, poll_interval: float = BATCH_POLL_SECONDS,
+              max_wait: float = BATCH_MAX_WAIT_SECONDS,
+              max_poll_failures: int = BATCH_MAX_POLL_FAILURES):
+    """
+    Submit `requests` ((prompt, response_format) pairs) as one batch, yield
+    'progress' events while it runs and prime `client` with the replies.
+    Falls back to online calls (by priming nothing) if the batch cannot be
+    submitted or does not complete; one that runs past `max_wait` seconds or
+    fails `max_poll_failures` polls in a row is cancelled first.
+    """
+    pending = [(p, fmt) for p, fmt in requests if not client.is_cached(p, fmt)]
+    if not pending:
+        yield {'type': 'progress', 'message': 'Batch: every prompt is already cached.'}
+        return
+
+    run = BatchRun(client, pending)
+    try:
+        run.submit()
+    except Exception as e:
+        print(f"⚠️  Batch submission failed, falling back to online calls: {e}")
+        yield {'type': 'progress', 'message': 'Batch submission failed; generating online instead.'}
+        return
+    yield {'type': 'progress', 'message': f'Batch submitted: {len(run.prompts)} requests ({run.batch.id}).'}
+
+    last = None
+    failures = 0
+    deadline = time.monotonic() + max_wait
+    while not run.done:
+        if time.monotonic() >= deadline:
+            reason = f'still {run.batch.status} after {max_wait:.0f}s'
+            break
+        time.sleep(poll_interval)
+        try:
+            batch = run.poll()
+        except Exception as e:
+            failures += 1
+            print(f"⚠️  Batch poll failed ({failures}/{max_poll_failures}): {e}")
+            if failures >= max_poll_failures:
+                reason = f'{failures} polls failed in a row'
+                break
+            continue
+        failures = 0
+        counts = getattr(batch, "request_counts", None)
+        status = f"{batch.status} {counts.completed}/{counts.total}" if counts else batch.status
+        if status != last:
+            last = status
+            yield {'type': 'progress', 'message': f'Batch {status}'}
+
+    if not run.done:
+        print(f"⚠️  Giving up on batch {run.batch.id} ({reason}), falling back to online calls.")
+        try:
+            run.cancel()
+        except Exception as e:
+            print(f"⚠️  Could not cancel batch {run.batch.id}: {e}")
+        yield {'type': 'progress', 'message': f'Batch {reason}; generating online instead.'}
+        return
+
+    try:
+        replies = run.results() if run.batch.status == 'completed' else {}
+    except Exception as e:
+        print(f"⚠️  Could not download batch results: {e}")
+        replies = {}
+    client.prime(replies)
+    message = f'Batch {run.batch.status}: {len(replies)}/{len(run.prompts)} replies.'
+    if len(replies) < len(run.prompts):
+        message += ' The rest will be generated online.'
+    yield {'type': 'progress', 'message': message}
@@ -0,0 +1,213 @@
+"""
+Persistent, content-addressed cache of LLM responses.
+
+Entries are keyed by sha256(model, temperature, prompt) plus an occurrence
+number: the deck builders re-send an identical prompt when an attempt comes
+back short, so the n-th time a job asks a prompt it reads the n-th stored
+reply. An occurrence is only used up by a reply that is read from or
+written to the cache, so a request dropped before it was sent (a losing
+speculative request) does not shift the keys of the ones after it. A
+re-run of the same spreadsheet therefore replays the original responses
+in order and makes no API calls.
+
+The store is a single SQLite file shared by every process on the machine,
+with a TTL and size-based LRU eviction.
+
+Modes (per job):
+    'use'      read and write the cache (default)
+    'refresh'  ignore stored replies, overwrite them with fresh ones
+    'bypass'   neither read nor write
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+CACHE_MODES = ('use', 'refresh', 'bypass')
+
+CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "llm_responses.sqlite3"))
+CACHE_MODE = os.environ.get("LLM_CACHE_MODE", "use")
+CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Eviction is checked every this many writes rather than on each one.
+_EVICT_EVERY = 50
+
+
+def prompt_digest(model: str, temperature: float, prompt: str, variant: str = None) -> str:
+    # `variant` distinguishes requests whose prompt matches but whose options
+    # (e.g. a response_format) differ; left out when unset so older keys hold.
+    parts = [model, round(float(temperature), 4), prompt]
+    if variant:
+        parts.append(variant)
+    raw = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path: str = CACHE_PATH, ttl: float = CACHE_TTL,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            response, created = row
+            if self.ttl and now - created > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            return response
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?)", (key, response, size, now, now))
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        if self.ttl:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% so we are not evicting on every subsequent write.
+        excess = total - int(self.max_bytes * 0.9)
+        freed = 0
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_cache(path: str = CACHE_PATH) -> ResponseCache:
+    """One ResponseCache (and SQLite connection) per path per process."""
+    key = (os.getpid(), os.path.abspath(path))
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = ResponseCache(path)
+        return _shared[key]
+
+
+class JobCache:
+    """A job's view of the shared cache: its mode and occurrence counters."""
+
+    def __init__(self, mode: str = CACHE_MODE, cache: ResponseCache = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"cache mode must be one of {CACHE_MODES}, got {mode!r}")
+        self.mode = mode
+        self.cache = None
+        if mode != 'bypass':
+            try:
+                self.cache = cache or shared_cache()
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️  LLM cache unavailable, continuing without it: {e}")
+                self.mode = 'bypass'
+        self._seen = Counter()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def slot(self, model: str, temperature: float, prompt: str, variant: str = None) -> str:
+        """Key for the next occurrence of this prompt in the job."""
+        digest = prompt_digest(model, temperature, prompt, variant)
+        with self._lock:
+            n = self._seen[digest]
+            self._seen[digest] += 1
+        return f"{digest}:{n}"
+
+    def has_first(self, model: str, temperature: float, prompt: str, variant: str = None) -> bool:
+        """Whether the first occurrence of `prompt` would be a cache hit."""
+        if self.mode != 'use':
+            return False
+        try:
+            return self.cache.get(f"{prompt_digest(model, temperature, prompt, variant)}:0") is not None
+        except sqlite3.Error:
+            return False
+
+    def _get(self, key: str):
+        if self.mode != 'use':
+            return None
+        try:
+            return self.cache.get(key)
+        except sqlite3.Error as e:
+            print(f"⚠️  LLM cache read failed: {e}")
+            return None
+
+    def lookup(self, key: str):
+        response = self._get(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def store(self, key: str, response: str):
+        if self.cache is None or response is None:
+            return
+        try:
+            self.cache.put(key, response)
+        except sqlite3.Error as e:
+            print(f"⚠️  LLM cache write failed: {e}")
+
+    def take(self, model: str, temperature: float, prompt: str, variant: str = None):
+        """
+        The stored reply for the next occurrence of `prompt`, or None. The
+        occurrence is used up only on a hit; on a miss put() claims it.
+        """
+        digest = prompt_digest(model, temperature, prompt, variant)
+        # Held across the read so two identical asks cannot take the same reply.
+        with self._lock:
+            response = self._get(f"{digest}:{self._seen[digest]}")
+            if response is None:
+                self.misses += 1
+            else:
+                self._seen[digest] += 1
+                self.hits += 1
+        return response
+
+    def put(self, model: str, temperature: float, prompt: str, response: str,
+            variant: str = None):
+        """Store `response` as the next occurrence of `prompt`."""
+        self.store(self.slot(model, temperature, prompt, variant), response)
@@ -0,0 +1,312 @@
+"""
+Per-job OpenAI client.
+
+Each generation job builds its own LLMClient with its own API key, so two
+jobs in one worker process never share `openai.api_key`. All clients in a
+process share one background event loop and one keep-alive HTTP connection
+pool; each client caps its own outstanding completions with a semaphore.
+
+Before each request the client takes from the cross-process RPM/TPM buckets
+in rate_limiter, so concurrent workers on one key pace themselves instead of
+all hitting 429s together. Replies go through the persistent response cache
+in llm_cache; `cache_mode` picks whether a job reads it, refreshes it or
+bypasses it. Callers may pass a `response_format` (see llm_json) to get
+schema-constrained JSON back; if the API rejects it the client drops it for
+the rest of the job.
+
+The deck builders are plain synchronous functions running on worker threads,
+so `ask()` blocks the calling thread while the request runs on the shared
+loop. `iter_items()` streams the completion instead and yields each item of
+the reply's JSON array as soon as it is complete, so a builder can stop
+reading once its deck is full. Async callers can await `ask_async()`
+directly on `client.loop`.
+"""
+
+import asyncio
+import os
+import queue
+import threading
+
+import backoff
+import httpx
+import openai
+
+from llm_cache import CACHE_MODE, JobCache
+from llm_json import STRUCTURED_OUTPUT, JsonArrayParser
+from rate_limiter import estimate_tokens, shared_limiter
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Outstanding completions per job.
+MAX_IN_FLIGHT = int(os.environ.get("LLM_MAX_IN_FLIGHT", "16"))
+
+# Process-wide HTTP pool shared by every job's client.
+HTTP_MAX_CONNECTIONS = int(os.environ.get("LLM_HTTP_MAX_CONNECTIONS", "64"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_HTTP_KEEPALIVE_CONNECTIONS", "32"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.environ.get("LLM_HTTP_TIMEOUT", "120"))
+
+# Stream completions to iter_items() callers instead of waiting for the whole reply.
+STREAMING = os.environ.get("LLM_STREAM", "on").lower() not in ("0", "off", "false")
+
+_END = object()
+
+
+class _SharedLoop:
+    """Event loop thread + HTTP pool, created lazily once per process."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name="llm-loop", daemon=True)
+        self.thread.start()
+        self.http_client = self.run(self._make_http_client())
+
+    @staticmethod
+    async def _make_http_client():
+        return openai.DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+        )
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+
+_shared = None
+_shared_pid = None
+_shared_lock = threading.Lock()
+
+
+def format_variant(response_format) -> str:
+    """Cache-key variant for a response_format (None for plain text)."""
+    if not response_format:
+        return None
+    return response_format.get("json_schema", {}).get("name") or response_format.get("type")
+
+
+def shared_loop() -> _SharedLoop:
+    # Celery forks its pool children; a loop thread inherited across fork is
+    # dead, so each process builds its own.
+    global _shared, _shared_pid
+    with _shared_lock:
+        if _shared is None or _shared_pid != os.getpid():
+            _shared = _SharedLoop()
+            _shared_pid = os.getpid()
+        return _shared
+
+
+class LLMClient:
+    def __init__(self, api_key: str, model: str = DEFAULT_MODEL,
+                 temperature: float = 0.7, max_in_flight: int = MAX_IN_FLIGHT,
+                 cache_mode: str = CACHE_MODE):
+        if not api_key:
+            raise ValueError("OpenAI API Key is required")
+        self.model = model
+        self.temperature = temperature
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._shared = shared_loop()
+        self._client = openai.AsyncOpenAI(api_key=api_key,
+                                          http_client=self._shared.http_client)
+        self._sem = None
+        self.cache = JobCache(cache_mode)
+        self.limiter = shared_limiter(api_key)
+        # Replies fetched ahead of time (batch mode), consumed once each.
+        self._primed = {}
+        self.structured_output = STRUCTURED_OUTPUT
+        self.streaming = STREAMING
+
+    @property
+    def loop(self):
+        return self._shared.loop
+
+    @property
+    def api(self) -> openai.AsyncOpenAI:
+        return self._client
+
+    def run(self, coro):
+        """Run a coroutine on the shared loop and wait for its result."""
+        return self._shared.run(coro)
+
+    def prime(self, replies: dict):
+        """Answer the next ask() of each prompt with a reply fetched in advance."""
+        self._primed.update(replies)
+
+    def _semaphore(self):
+        # Created on first use so it binds to the shared loop.
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_in_flight)
+        return self._sem
+
+    @backoff.on_exception(backoff.expo, openai.RateLimitError, max_time=180)
+    async def _complete(self, prompt: str, temperature: float,
+                        response_format: dict = None) -> str:
+        estimated = estimate_tokens(prompt)
+        extra = {"response_format": response_format} if response_format else {}
+        async with self._semaphore():
+            await self.limiter.acquire_async(estimated)
+            resp = await self._client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                **extra,
+            )
+        usage = getattr(resp, "usage", None)
+        await asyncio.to_thread(self.limiter.settle, estimated,
+                                getattr(usage, "total_tokens", None))
+        return resp.choices[0].message.content
+
+    @backoff.on_exception(backoff.expo, openai.RateLimitError, max_time=180)
+    async def _open_stream(self, prompt, temperature, response_format, estimated):
+        extra = {"response_format": response_format} if response_format else {}
+        await self.limiter.acquire_async(estimated)
+        return await self._client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+            **extra,
+        )
+
+    async def _stream(self, prompt: str, temperature: float, response_format: dict,
+                      on_text, stop: threading.Event) -> str:
+        """Stream a completion, passing each text delta to on_text, until done or `stop` is set."""
+        estimated = estimate_tokens(prompt)
+        parts = []
+        used = None
+        async with self._semaphore():
+            if stop is not None and stop.is_set():
+                # Cancelled while queued (e.g. a speculative request that lost).
+                return None
+            stream = await self._open_stream(prompt, temperature, response_format, estimated)
+            try:
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        used = chunk.usage.total_tokens
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        on_text(delta)
+                    if stop is not None and stop.is_set():
+                        break
+            finally:
+                await stream.close()
+        text = "".join(parts)
+        if used is None:
+            # Stopped before the usage chunk: charge what was actually sent and read.
+            used = (len(prompt) + len(text)) // 4
+        await asyncio.to_thread(self.limiter.settle, estimated, used)
+        return text
+
+    async def _request(self, prompt, temperature, response_format, on_text, stop):
+        if on_text is not None and self.streaming:
+            return await self._stream(prompt, temperature, response_format, on_text, stop)
+        response = await self._complete(prompt, temperature, response_format)
+        if on_text is not None:
+            on_text(response)
+        return response
+
+    def _format(self, response_format):
+        return response_format if self.structured_output else None
+
+    async def ask_async(self, prompt: str, temperature: float = None,
+                        response_format: dict = None, on_text=None,
+                        stop: threading.Event = None) -> str:
+        """
+        The reply to `prompt`. With `on_text`, the reply is also handed over
+        piece by piece as it streams in (or whole, when it comes from the
+        cache), and setting `stop` ends the stream early; the cache then keeps
+        the part that was read.
+        """
+        temperature = self.temperature if temperature is None else temperature
+        response_format = self._format(response_format)
+        variant = format_variant(response_format)
+        response = self.cache.take(self.model, temperature, prompt, variant)
+        if response is not None:
+            if on_text is not None:
+                on_text(response)
+            return response
+        response = self._primed.pop(prompt, None)
+        if response is not None:
+            if on_text is not None:
+                on_text(response)
+        else:
+            try:
+                response = await self._request(prompt, temperature, response_format, on_text, stop)
+            except openai.BadRequestError as e:
+                if not response_format:
+                    raise
+                # Model or endpoint without Structured Outputs: stop asking
+                # for it in this job and rely on the tolerant parser.
+                if self.structured_output:
+                    self.structured_output = False
+                    print(f"⚠️  Structured output rejected, falling back to plain JSON prompts: {e}")
+                response = await self._request(prompt, temperature, None, on_text, stop)
+        # None: cancelled while queued. It was never sent, so it takes no
+        # occurrence and later cache keys stay as they were.
+        if response is not None:
+            self.cache.put(self.model, temperature, prompt, response, variant)
+        return response
+
+    def ask(self, prompt: str, temperature: float = None,
+            response_format: dict = None) -> str:
+        """Blocking wrapper around ask_async for worker threads."""
+        return self._shared.run(self.ask_async(prompt, temperature, response_format))
+
+    def iter_items(self, prompt: str, temperature: float = None,
+                   response_format: dict = None):
+        """
+        Yield the objects of the reply's JSON array as each one closes.
+
+        Closing the generator (e.g. breaking out of the loop once a deck is
+        full) stops the stream, so the rest of the completion is not paid for.
+        """
+        for _, item in self.iter_merged([(prompt, response_format)], temperature):
+            yield item
+
+    def iter_merged(self, requests, temperature: float = None):
+        """
+        Stream several (prompt, response_format) requests at once and yield
+        (index, item) pairs in the order the items complete.
+
+        Closing the generator stops every stream that is still running and
+        keeps queued requests from being sent. A request that fails is
+        reported and skipped; the error is raised only if all of them fail.
+        """
+        items = queue.Queue()
+        stop = threading.Event()
+        futures = []
+        for i, (prompt, response_format) in enumerate(requests):
+            parser = JsonArrayParser()
+
+            def on_text(text, i=i, parser=parser):
+                for item in parser.feed(text):
+                    items.put((i, item))
+
+            future = asyncio.run_coroutine_threadsafe(
+                self.ask_async(prompt, temperature, response_format, on_text, stop), self.loop)
+            future.add_done_callback(lambda _, i=i: items.put((i, _END)))
+            futures.append(future)
+        try:
+            pending = len(futures)
+            while pending:
+                i, item = items.get()
+                if item is _END:
+                    pending -= 1
+                    continue
+                yield i, item
+            errors = [f.exception() for f in futures if f.exception() is not None]
+            if len(errors) == len(futures):
+                raise errors[0]
+            for e in errors:
+                print(f"⚠️  Speculative request failed: {e}")
+        finally:
+            stop.set()
+
+    def is_cached(self, prompt: str, response_format: dict = None) -> bool:
+        """Whether the job's first ask() of this request would hit the cache."""
+        return self.cache.has_first(self.model, self.temperature, prompt,
+                                    format_variant(self._format(response_format)))
@@ -0,0 +1,142 @@
+"""
+JSON handling for deck-builder replies.
+
+response_format(kind) asks the API for Structured Outputs: a strict JSON
+schema per deck type, wrapped as {"items": [...]} because a schema's root
+must be an object. parse_items() accepts that shape, a bare array, or an
+array buried in markdown, and salvages every complete item from a reply
+that was cut off mid-array instead of discarding the whole attempt.
+"""
+
+import json
+import os
+
+STRUCTURED_OUTPUT = os.environ.get("LLM_STRUCTURED_OUTPUT", "on").lower() not in ("0", "off", "false")
+
+_STR = {"type": "string"}
+_BOOL = {"type": "boolean"}
+_STR_LIST = {"type": "array", "items": _STR}
+
+# Item fields per deck type, matching the "Return JSON list: {...}" line of
+# each prompt.
+DECK_SCHEMAS = {
+    "mcq":      {"q": _STR, "correct": _STR, "distractors": _STR_LIST, "explanation": _STR},
+    "tf":       {"statement": _STR, "answer": _BOOL, "explanation": _STR},
+    "sa":       {"q": _STR, "answer": _STR},
+    "fill":     {"q": _STR, "answer": _STR, "distractors": _STR_LIST, "explanation": _STR},
+    "scenario": {"q": _STR, "answer": _STR},
+}
+DECK_SCHEMAS["task_card"] = DECK_SCHEMAS["mcq"]
+DECK_SCHEMAS["tf_expl"] = DECK_SCHEMAS["tf"]
+DECK_SCHEMAS["open"] = DECK_SCHEMAS["sa"]
+
+
+def response_format(kind: str):
+    """OpenAI response_format for a deck type, or None to leave it unset."""
+    if not STRUCTURED_OUTPUT or kind not in DECK_SCHEMAS:
+        return None
+    item = {
+        "type": "object",
+        "properties": DECK_SCHEMAS[kind],
+        "required": list(DECK_SCHEMAS[kind]),
+        "additionalProperties": False,
+    }
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": f"{kind}_items",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {"items": {"type": "array", "items": item}},
+                "required": ["items"],
+                "additionalProperties": False,
+            },
+        },
+    }
+
+
+class JsonArrayParser:
+    """
+    Incremental parser for the first JSON array in a stream of text.
+
+    feed() takes the next chunk and returns the objects in the array that
+    were completed by it. Text before the array (prose, ``` fences, the
+    {"items": wrapper) is skipped; an element that fails to decode is
+    dropped without affecting the ones around it.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._in_array = False
+        self._depth = 0          # nesting depth inside the array
+        self._in_str = False
+        self._escape = False
+        self._start = None       # offset where the current element began
+        self.closed = False      # saw the array's closing ']'
+
+    def feed(self, chunk: str) -> list:
+        if self.closed or not chunk:
+            return []
+        self._text += chunk
+        out = []
+        text = self._text
+        i = self._pos
+        n = len(text)
+        while i < n and not self.closed:
+            ch = text[i]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                # Strings before the array (e.g. the "items" key) are skipped too.
+                self._in_str = True
+            elif not self._in_array:
+                if ch == "[":
+                    self._in_array = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    if ch == "]":
+                        self.closed = True
+                else:
+                    self._depth -= 1
+                    if self._depth == 0 and self._start is not None:
+                        try:
+                            item = json.loads(text[self._start:i + 1])
+                        except ValueError:
+                            item = None
+                        if isinstance(item, dict):
+                            out.append(item)
+                        self._start = None
+            i += 1
+        # Keep only the unfinished element so the buffer does not grow unbounded.
+        keep = self._start if self._start is not None else i
+        self._text = text[keep:]
+        if self._start is not None:
+            self._start = 0
+        self._pos = i - keep
+        return out
+
+
+def parse_items(text: str) -> list:
+    """Every complete item object in a reply; [] if there are none."""
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("items")
+        if isinstance(data, list):
+            return data
+    except ValueError:
+        pass
+    return JsonArrayParser().feed(text)
@@ -0,0 +1,76 @@
+"""
+Compose PDFs from pages that are already rendered.
+
+The subtopic preview used to lay every deck out a second time with the
+preview page templates, write four temp files and merge them. compose()
+instead copies the pages of the worksheets and answer sheets that were just
+built and puts a stamp page (the PREVIEW watermark) behind each one. The
+stamp is imported once per output document as a form XObject and every
+page references it, and the result is assembled in memory and written once.
+"""
+
+import io
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+try:
+    import fitz  # PyMuPDF
+    HAS_FITZ = True
+except Exception:
+    HAS_FITZ = False
+
+
+def render_page(draw, pagesize=letter) -> bytes:
+    """A one-page PDF with draw(canvas) on it, for use as a stamp."""
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=pagesize)
+    draw(c)
+    c.showPage()
+    c.save()
+    return buf.getvalue()
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=bytes(source), filetype="pdf")
+    return fitz.open(str(source))
+
+
+def compose(parts, out_path=None) -> bytes:
+    """
+    Concatenate `parts`, (source, stamp) pairs where source is a path or PDF
+    bytes and stamp is PDF bytes drawn beneath every page of that source (or
+    None). Writes the result to `out_path` if given and returns its bytes.
+    """
+    if not HAS_FITZ:
+        raise RuntimeError("PyMuPDF not available")
+    out = fitz.open()
+    stamps = {}
+    try:
+        for source, stamp in parts:
+            src = _open(source)
+            try:
+                first = out.page_count
+                out.insert_pdf(src)
+            finally:
+                src.close()
+            if stamp is None:
+                continue
+            if stamp not in stamps:
+                stamps[stamp] = _open(stamp)
+            for pno in range(first, out.page_count):
+                page = out[pno]
+                # Behind the content, as the preview page templates drew it.
+                page.show_pdf_page(page.rect, stamps[stamp], 0, overlay=False)
+        # garbage=4 also merges identical streams, i.e. the font files every
+        # source document embedded separately.
+        data = out.tobytes(garbage=4, deflate=True)
+    finally:
+        for s in stamps.values():
+            s.close()
+        out.close()
+    if out_path is not None:
+        with open(out_path, "wb") as f:
+            f.write(data)
+    return data
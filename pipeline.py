@@ -0,0 +1,174 @@
+"""
+Bounded multi-stage pipeline for subtopic generation.
+
+Each stage is a function run by its own small pool of threads; stages are
+joined by bounded queues so a slow stage (PDF rendering) applies back-pressure
+to a fast one (LLM fetching) instead of piling finished decks up in memory.
+The first stage's worker count is the number of subtopics in flight.
+
+run_subtopic_jobs() is the part of a generator's job that does not depend
+on what it generates: checkpoint replay, the batch prelude, the pipeline
+itself and the 'result' / 'complete' events.
+"""
+
+import pathlib
+import queue
+import threading
+
+from artifacts import materialize
+from llm_batch import run_batch
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+
+
+def run_pipeline(items, stages, queue_size=2):
+    """
+    Push every item through `stages` in order and yield events as they occur:
+
+        ('started', item, None)   – the first stage picked the item up
+        ('done',    item, value)  – the last stage returned `value`
+        ('error',   item, exc)    – a stage raised; the item is dropped
+
+    Events arrive in completion order, not input order. Each stage receives
+    the previous stage's return value (the item itself for the first stage).
+    Closing the generator early stops the workers after their current item.
+    """
+    stop = threading.Event()
+    events = queue.Queue()
+    inputs = [queue.Queue(maxsize=max(1, queue_size)) for _ in stages]
+    threads = []
+
+    def put(q, value):
+        while not stop.is_set():
+            try:
+                q.put(value, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def feed():
+        for item in items:
+            if not put(inputs[0], item):
+                return
+        for _ in range(stages[0].workers):
+            put(inputs[0], _DONE)
+
+    def work(idx, stage, remaining):
+        last = idx == len(stages) - 1
+        while not stop.is_set():
+            try:
+                entry = inputs[idx].get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if entry is _DONE:
+                break
+            item, value = (entry, entry) if idx == 0 else entry
+            if idx == 0:
+                events.put(('started', item, None))
+            try:
+                value = stage.fn(value)
+            except Exception as e:
+                events.put(('error', item, e))
+                continue
+            if last:
+                events.put(('done', item, value))
+            else:
+                put(inputs[idx + 1], (item, value))
+        # The last worker of a stage to finish closes the next stage.
+        with remaining['lock']:
+            remaining['n'] -= 1
+            closing = remaining['n'] == 0
+        if closing:
+            if last:
+                events.put((_DONE, None, None))
+            else:
+                for _ in range(stages[idx + 1].workers):
+                    put(inputs[idx + 1], _DONE)
+
+    threads.append(threading.Thread(target=feed, daemon=True))
+    for idx, stage in enumerate(stages):
+        remaining = {'n': stage.workers, 'lock': threading.Lock()}
+        for w in range(stage.workers):
+            threads.append(threading.Thread(target=work, args=(idx, stage, remaining),
+                                            name=f"{stage.name}-{w}", daemon=True))
+    for t in threads:
+        t.start()
+
+    try:
+        while True:
+            kind, item, value = events.get()
+            if kind is _DONE:
+                break
+            yield kind, item, value
+    finally:
+        stop.set()
+
+
+def run_subtopic_jobs(jobs, stages, checkpoints, root_folder, materialize_output: bool,
+                      batch=None, queue_size: int = 2):
+    """
+    Generate every subtopic in `jobs` and yield the job's events.
+
+    Each job is a dict with at least 'topic', 'note', 'ctx', 'sub_path'
+    (its folder, relative to root_folder) and 'checkpoint' (its key in
+    `checkpoints`, a JobCheckpoints); the last of `stages` leaves the subtopic's (arcname,
+    bytes) pairs in job['files']. Subtopics found in the checkpoints are
+    replayed first without running the stages. `batch`, if given, is
+    (client, prompts): prompts(topic, note, ctx) lists a job's first-attempt
+    (prompt, response_format) pairs, and those of every pending job go
+    through run_batch before the pipeline starts. materialize_output also
+    writes the files under root_folder.
+    """
+    root_folder = pathlib.Path(root_folder)
+    if materialize_output:
+        root_folder.mkdir(parents=True, exist_ok=True)
+    processed_count = 0
+
+    def result(job, files):
+        nonlocal processed_count
+        processed_count += 1
+        if materialize_output:
+            materialize(root_folder, files)
+        return {
+            'type': 'result',
+            'topic': job['topic'],
+            'path': str(root_folder / job['sub_path']),
+            'arcdir': job['sub_path'],
+            'files': files,
+            'progress': f"{processed_count}/{len(jobs)}"
+        }
+
+    pending = []
+    for job in jobs:
+        files = checkpoints.load(job['checkpoint'], job['sub_path'])
+        if files is None:
+            pending.append(job)
+        else:
+            yield result(job, files)
+    if processed_count:
+        yield {'type': 'progress', 'message': f'Reused {processed_count} subtopics finished by an earlier run.'}
+
+    if batch is not None:
+        client, prompts = batch
+        requests = [r for job in pending for r in prompts(job['topic'], job['note'], job['ctx'])]
+        yield from run_batch(client, requests)
+
+    for kind, job, value in run_pipeline(pending, stages, queue_size=queue_size):
+        if kind == 'started':
+            yield {'type': 'progress', 'message': f"Generating: {job['topic']}"}
+        elif kind == 'error':
+            raise value
+        else:
+            files = job.pop('files')
+            checkpoints.save(job['checkpoint'], job['sub_path'], files)
+            yield result(job, files)
+
+    yield {'type': 'complete', 'path': str(root_folder)}
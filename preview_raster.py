@@ -0,0 +1,165 @@
+"""
+Rasterized preview PDFs.
+
+rasterize() renders every page of a PDF with PyMuPDF and builds the output
+PDF with PyMuPDF too, so each page's pixels go straight into it: as a JPEG
+at PREVIEW_JPEG_QUALITY (PREVIEW_FORMAT=jpeg, the default) or as a
+flate-compressed raw pixmap (PREVIEW_FORMAT=raw, lossless). The caterpillar
+preview used to encode every page as a PNG and hand it to ReportLab, which
+decoded it again; that round trip was the slowest step of a run.
+
+Each page is keyed by a hash of what it draws (content stream, fonts with
+their glyph mapping, image data) and the raster settings. Rasters are kept
+in a per-process LRU of up to PREVIEW_CACHE_MB, so pages that repeat across
+previews, like the cover page every subtopic shares, are rendered once.
+The other pages are split across PREVIEW_PROCESSES worker processes when it
+is above 0 and the preview is not itself being built in a render worker
+(RENDER_PROCESSES=0), which already spreads subtopics across processes.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+
+from pdf_compose import HAS_FITZ
+from render_pool import discard_pool, pool_workers, render_pool
+
+if HAS_FITZ:
+    import fitz
+
+PREVIEW_DPI = int(os.environ.get("PREVIEW_DPI", "150"))
+PREVIEW_FORMAT = os.environ.get("PREVIEW_FORMAT", "jpeg").lower()
+PREVIEW_JPEG_QUALITY = int(os.environ.get("PREVIEW_JPEG_QUALITY", "85"))
+PREVIEW_PROCESSES = int(os.environ.get("PREVIEW_PROCESSES", "0"))
+PREVIEW_CACHE_MB = int(os.environ.get("PREVIEW_CACHE_MB", "64"))
+
+_cache = OrderedDict()      # page key -> raster, least recently used first
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def _settings(dpi, fmt, quality):
+    if fmt not in ('jpeg', 'raw'):
+        raise ValueError(f"Unknown preview format {fmt!r}; use jpeg or raw")
+    return (dpi, fmt, quality if fmt == 'jpeg' else None)
+
+
+def page_key(doc, page, settings) -> str:
+    """Hash of everything that decides how `page` rasterizes."""
+    h = hashlib.sha1(repr((settings, tuple(page.rect))).encode())
+    h.update(page.read_contents())
+    for xref, _, _, basefont, name, encoding in page.get_fonts(full=False):
+        h.update(f"{name}={basefont}/{encoding}".encode('utf-8'))
+        # ReportLab numbers subset glyphs in order of first use in the whole
+        # document, so the same bytes can show different text in another one.
+        kind, value = doc.xref_get_key(xref, 'ToUnicode')
+        if kind == 'xref':
+            h.update(doc.xref_stream(int(value.split()[0])))
+    for img in page.get_images(full=True):
+        h.update(img[7].encode('utf-8'))
+        h.update(doc.xref_stream_raw(img[0]))
+    return h.hexdigest()
+
+
+def _raster(page, settings):
+    """JPEG bytes, or (width, height, samples) for raw."""
+    dpi, fmt, quality = settings
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    if fmt == 'jpeg':
+        return pix.tobytes('jpeg', jpg_quality=quality)
+    return pix.width, pix.height, pix.samples
+
+
+def _raster_size(raster) -> int:
+    return len(raster) if isinstance(raster, bytes) else len(raster[2])
+
+
+def render_pages(task):
+    """Rasters of pages `numbers` of a PDF; runs in a preview worker process."""
+    data, numbers, settings = task
+    doc = fitz.open(stream=data, filetype='pdf')
+    try:
+        return [_raster(doc[n], settings) for n in numbers]
+    finally:
+        doc.close()
+
+
+def _init_preview_worker():
+    """Preview-process initializer: keep MuPDF's warnings out of the worker logs."""
+    fitz.TOOLS.mupdf_display_errors(False)
+
+
+def _render_missing(data, numbers, settings, processes):
+    """{page number: raster} for `numbers`, across the preview pool if there is one."""
+    pool = render_pool(_init_preview_worker, processes) if len(numbers) > 1 else None
+    if pool is not None:
+        n = pool_workers(pool)
+        chunks = [numbers[i::n] for i in range(n) if numbers[i::n]]
+        try:
+            futures = [pool.submit(render_pages, (data, chunk, settings)) for chunk in chunks]
+            return {p: r for chunk, f in zip(chunks, futures) for p, r in zip(chunk, f.result())}
+        except BrokenProcessPool as e:
+            print(f"⚠️  Preview process failed, rasterizing in-thread: {e}")
+            discard_pool(pool)
+    return dict(zip(numbers, render_pages((data, numbers, settings))))
+
+
+def _cached(key):
+    with _cache_lock:
+        raster = _cache.get(key)
+        if raster is not None:
+            _cache.move_to_end(key)
+        return raster
+
+
+def _remember(key, raster):
+    global _cache_bytes
+    size = _raster_size(raster)
+    limit = PREVIEW_CACHE_MB * 1024 * 1024
+    if size > limit:
+        return
+    with _cache_lock:
+        if key in _cache:
+            return
+        _cache[key] = raster
+        _cache_bytes += size
+        while _cache_bytes > limit:
+            _, old = _cache.popitem(last=False)
+            _cache_bytes -= _raster_size(old)
+
+
+def rasterize(data: bytes, dpi: int = PREVIEW_DPI, fmt: str = PREVIEW_FORMAT,
+              quality: int = PREVIEW_JPEG_QUALITY, processes: int = PREVIEW_PROCESSES) -> bytes:
+    """The PDF `data` with every page replaced by an image of it."""
+    settings = _settings(dpi, fmt, quality)
+    src = fitz.open(stream=data, filetype='pdf')
+    out = fitz.open()
+    try:
+        keys = [page_key(src, page, settings) for page in src]
+        rasters = {n: _cached(k) for n, k in enumerate(keys)}
+        missing = [n for n, r in rasters.items() if r is None]
+        if missing:
+            rendered = _render_missing(data, missing, settings, processes)
+            for n, raster in rendered.items():
+                _remember(keys[n], raster)
+            rasters.update(rendered)
+
+        xrefs = {}      # page key -> image xref, so repeated pages share one image
+        for n, page in enumerate(src):
+            target = out.new_page(width=page.rect.width, height=page.rect.height)
+            if keys[n] in xrefs:
+                target.insert_image(target.rect, xref=xrefs[keys[n]])
+                continue
+            raster = rasters[n]
+            if isinstance(raster, bytes):
+                xrefs[keys[n]] = target.insert_image(target.rect, stream=raster)
+            else:
+                w, h, samples = raster
+                pix = fitz.Pixmap(fitz.csRGB, w, h, samples, False)
+                xrefs[keys[n]] = target.insert_image(target.rect, pixmap=pix)
+        return out.tobytes(garbage=3, deflate=True)
+    finally:
+        out.close()
+        src.close()
@@ -0,0 +1,203 @@
+"""
+Requests-per-minute / tokens-per-minute limiter shared across processes.
+
+Every process that calls the API for a given key draws from the same pair of
+token buckets in Redis (the Celery broker at REDIS_URL), so four Celery
+children and the web workers pace themselves together instead of all running
+into 429s and backing off at once. The refill-and-take step is one Lua script,
+so it is atomic across processes and uses Redis' clock, not the callers'.
+
+Token cost is estimated before the call and corrected with the real usage
+afterwards via settle(). If Redis is unreachable the limiter falls back to an
+in-process bucket with the same limits.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+# Defaults match gpt-4o-mini's lowest paid tier; set to 0 to disable a bucket.
+RPM_LIMIT = int(os.environ.get("LLM_RPM_LIMIT", "500"))
+TPM_LIMIT = int(os.environ.get("LLM_TPM_LIMIT", "200000"))
+RATE_LIMIT_ENABLED = os.environ.get("LLM_RATE_LIMIT", "on").lower() not in ("0", "off", "false")
+
+# Completion tokens assumed before a reply's real usage is known.
+EXPECTED_COMPLETION_TOKENS = int(os.environ.get("LLM_EXPECTED_COMPLETION_TOKENS", "1500"))
+
+_TAKE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local function level(key, cap)
+    if cap <= 0 then return 0 end
+    local b = redis.call('HMGET', key, 'level', 'ts')
+    local lvl = tonumber(b[1]) or cap
+    local ts = tonumber(b[2]) or now
+    return math.min(cap, lvl + math.max(0, now - ts) * cap / 60.0)
+end
+local rcap, tcap = tonumber(ARGV[1]), tonumber(ARGV[2])
+local need = math.min(tonumber(ARGV[3]), tcap)
+local r = level(KEYS[1], rcap)
+local tk = level(KEYS[2], tcap)
+local wait = 0
+if rcap > 0 and r < 1 then wait = math.max(wait, (1 - r) * 60.0 / rcap) end
+if tcap > 0 and tk < need then wait = math.max(wait, (need - tk) * 60.0 / tcap) end
+if wait == 0 then
+    r = r - 1
+    tk = tk - need
+end
+if rcap > 0 then
+    redis.call('HSET', KEYS[1], 'level', r, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], 120)
+end
+if tcap > 0 then
+    redis.call('HSET', KEYS[2], 'level', tk, 'ts', now)
+    redis.call('EXPIRE', KEYS[2], 120)
+end
+return tostring(wait)
+"""
+
+_SETTLE = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local lvl = tonumber(redis.call('HGET', KEYS[1], 'level')) + tonumber(ARGV[1])
+    redis.call('HSET', KEYS[1], 'level', math.min(lvl, tonumber(ARGV[2])))
+end
+return 0
+"""
+
+
+def estimate_tokens(prompt: str) -> int:
+    # ~4 characters per token for English prompts.
+    return len(prompt) // 4 + EXPECTED_COMPLETION_TOKENS
+
+
+class _LocalBuckets:
+    """Same algorithm as _TAKE, for when Redis is not available."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm, self.tpm = rpm, tpm
+        self.r, self.t = float(rpm), float(tpm)
+        self.ts = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = max(0.0, now - self.ts)
+        self.ts = now
+        if self.rpm > 0:
+            self.r = min(self.rpm, self.r + elapsed * self.rpm / 60.0)
+        if self.tpm > 0:
+            self.t = min(self.tpm, self.t + elapsed * self.tpm / 60.0)
+
+    def take(self, tokens):
+        with self.lock:
+            self._refill()
+            need = min(tokens, self.tpm) if self.tpm > 0 else 0
+            wait = 0.0
+            if self.rpm > 0 and self.r < 1:
+                wait = max(wait, (1 - self.r) * 60.0 / self.rpm)
+            if self.tpm > 0 and self.t < need:
+                wait = max(wait, (need - self.t) * 60.0 / self.tpm)
+            if wait == 0:
+                self.r -= 1
+                self.t -= need
+            return wait
+
+    def adjust(self, tokens):
+        with self.lock:
+            if self.tpm > 0:
+                self.t = min(self.tpm, self.t + tokens)
+
+
+class RateLimiter:
+    # After a Redis error, stay on the local bucket this long before retrying.
+    REDIS_RETRY_AFTER = 30.0
+
+    def __init__(self, api_key: str, rpm: int = RPM_LIMIT, tpm: int = TPM_LIMIT,
+                 redis_url: str = REDIS_URL):
+        key_id = hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+        self.keys = [f"llm-rate:{key_id}:rpm", f"llm-rate:{key_id}:tpm"]
+        self.rpm, self.tpm = rpm, tpm
+        self._local = _LocalBuckets(rpm, tpm)
+        self._redis = None
+        self._down_until = 0.0
+        if redis is not None and redis_url:
+            self._redis = redis.Redis.from_url(redis_url, socket_timeout=2,
+                                               socket_connect_timeout=2)
+            self._take_script = self._redis.register_script(_TAKE)
+            self._settle_script = self._redis.register_script(_SETTLE)
+
+    def _use_redis(self):
+        return self._redis is not None and time.monotonic() >= self._down_until
+
+    def _redis_failed(self, err):
+        if self._down_until == 0.0:
+            print(f"⚠️  Rate limiter: Redis unavailable, limiting per process only: {err}")
+        self._down_until = time.monotonic() + self.REDIS_RETRY_AFTER
+
+    def _take(self, tokens: int) -> float:
+        """Try to take one request and `tokens` tokens; return seconds to wait (0 = taken)."""
+        if self._use_redis():
+            try:
+                return float(self._take_script(keys=self.keys, args=[self.rpm, self.tpm, tokens]))
+            except Exception as e:
+                self._redis_failed(e)
+        return self._local.take(tokens)
+
+    def acquire(self, tokens: int):
+        while True:
+            wait = self._take(tokens)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, 5.0))
+
+    async def acquire_async(self, tokens: int):
+        while True:
+            wait = await asyncio.to_thread(self._take, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, 5.0))
+
+    def settle(self, estimated: int, actual: int):
+        """Give back (or charge) the difference between estimated and real usage."""
+        if not self.tpm or actual is None:
+            return
+        delta = estimated - actual
+        if delta == 0:
+            return
+        if self._use_redis():
+            try:
+                self._settle_script(keys=self.keys[1:], args=[delta, self.tpm])
+                return
+            except Exception as e:
+                self._redis_failed(e)
+        self._local.adjust(delta)
+
+
+class _NoLimit:
+    def acquire(self, tokens): pass
+    async def acquire_async(self, tokens): pass
+    def settle(self, estimated, actual): pass
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def shared_limiter(api_key: str):
+    """One limiter per API key per process (the buckets themselves live in Redis)."""
+    if not RATE_LIMIT_ENABLED:
+        return _NoLimit()
+    key = (os.getpid(), api_key)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(api_key)
+        return _limiters[key]
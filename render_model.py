@@ -0,0 +1,57 @@
+"""
+Question render model shared by a subtopic's worksheet, answer sheet and
+preview.
+
+Each question is set in up to four documents (worksheet, answer sheet and
+both halves of the preview), and KeepTogether wraps every block two or three
+times per document. QuestionModel parses each (text, style) Paragraph once
+and CachedParagraph breaks its lines once per available width, so every
+document after the first reuses the layout instead of redoing it.
+"""
+
+from reportlab.platypus import Paragraph
+
+# Paragraph.wrap's own threshold (reportlab.platypus.paragraph._FUZZ): below
+# it wrap() reports that nothing fits, which is not worth caching.
+_MIN_WIDTH = 1e-6
+
+
+class CachedParagraph(Paragraph):
+    """Paragraph that remembers its line breaks for each width it was wrapped at."""
+
+    def __init__(self, text, style, *args, **kwargs):
+        super().__init__(text, style, *args, **kwargs)
+        self._wraps = {}
+
+    def wrap(self, availWidth, availHeight):
+        if availWidth < _MIN_WIDTH:
+            return super().wrap(availWidth, availHeight)
+        hit = self._wraps.get(availWidth)
+        if hit is None:
+            size = super().wrap(availWidth, availHeight)
+            self._wraps[availWidth] = (self.blPara, self._wrapWidths, self.width, self.height)
+            return size
+        self.blPara, self._wrapWidths, self.width, self.height = hit
+        return self.width, self.height
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        # One instance can appear many times (e.g. "A. True"). The doc
+        # template marks a flowable that did not fit as postponed and never
+        # clears it, which would make the next miss a LayoutError.
+        self.__dict__.pop('_postponed', None)
+        super().drawOn(canvas, x, y, _sW)
+
+
+class QuestionModel:
+    """One subtopic's paragraphs, keyed by text and style name."""
+
+    def __init__(self, styles):
+        self.styles = styles
+        self._paras = {}
+
+    def para(self, text: str, style: str) -> CachedParagraph:
+        key = (text, style)
+        p = self._paras.get(key)
+        if p is None:
+            p = self._paras[key] = CachedParagraph(text, self.styles[style])
+        return p
@@ -0,0 +1,119 @@
+"""
+Process pool for the CPU-bound PDF stages.
+
+ReportLab layout and the caterpillar preview rasterizer hold the GIL, so
+rendering one subtopic on a pipeline thread stalls the threads fetching the
+next subtopic's decks. The render stage instead hands a picklable payload
+(deck tuples + output paths) to a worker process. Pools are kept for the
+life of the parent process, one per generator, and each worker registers
+the generator's fonts once, in its initializer (the generator's
+register_fonts), instead of per job; style sheets are built on first use
+and kept (style_registry). render_stage() is the pipeline stage both
+generators use to hand a subtopic's decks to their pool.
+
+RENDER_PROCESSES=0 renders on the pipeline thread as before. Celery prefork
+children are daemonic and cannot start processes, so there the stage also
+renders in-thread. Pool workers never start pools of their own: a nested
+pool keeps its parent worker from exiting when the outer pool shuts down.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+RENDER_PROCESSES = int(os.environ.get("RENDER_PROCESSES", str(min(2, os.cpu_count() or 1))))
+# Workers are started lazily, after the job's threads, the LLM event loop and
+# SQLite connections exist; forking the process then can leave a worker
+# holding a lock no thread will release. 'forkserver' forks them from a
+# clean single-threaded server instead. Platforms without it use their
+# default method.
+RENDER_START_METHOD = os.environ.get("RENDER_START_METHOD", "forkserver")
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class _RenderPool(ProcessPoolExecutor):
+    """ProcessPoolExecutor that remembers how many workers it was made with."""
+
+    def __init__(self, max_workers: int, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self.workers = max_workers
+
+
+def _context():
+    if RENDER_START_METHOD in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context(RENDER_START_METHOD)
+    return multiprocessing.get_context()
+
+
+def render_pool(initializer, processes: int = RENDER_PROCESSES):
+    """
+    Shared pool whose workers have run `initializer`, or None when rendering
+    should stay in the calling thread.
+    """
+    if processes < 1 or multiprocessing.current_process().daemon:
+        return None
+    if multiprocessing.parent_process() is not None:
+        return None
+    key = (os.getpid(), initializer.__module__, initializer.__qualname__, processes)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            try:
+                pool = _RenderPool(processes, mp_context=_context(), initializer=initializer)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Render processes unavailable, rendering in-thread: {e}")
+                return None
+            _pools[key] = pool
+        return pool
+
+
+def pool_workers(pool) -> int:
+    """Pipeline threads needed to keep `pool` busy (1 when rendering in-thread)."""
+    return pool.workers if pool is not None else 1
+
+
+def discard_pool(pool):
+    """
+    Shut down a pool whose worker died and forget it, so the next
+    render_pool() call starts a fresh one.
+    """
+    with _pools_lock:
+        for key, value in list(_pools.items()):
+            if value is pool:
+                del _pools[key]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_in_pool(pool, fn, payload):
+    """fn(payload) in a worker process, or in this thread without a pool."""
+    if pool is not None:
+        try:
+            return pool.submit(fn, payload).result()
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM-killed); finish this one in-thread and
+            # let the next job start a fresh pool.
+            print(f"⚠️  Render process failed, rendering in-thread: {e}")
+            discard_pool(pool)
+    return fn(payload)
+
+
+# What a render worker gets from a job: the decks and where they go.
+RENDER_KEYS = ('topic', 'unit_title', 'sub_path', 'decks')
+
+
+def render_stage(pool, render_files):
+    """
+    Pipeline stage that hands a job's decks (and its context's fonts) to
+    render_files in `pool` and keeps the returned PDFs in job['files'].
+    """
+    def stage(job):
+        payload = {k: job[k] for k in RENDER_KEYS}
+        payload['fonts'] = job['ctx'].fonts
+        job['files'] = run_in_pool(pool, render_files, payload)
+        job.pop('decks', None)
+        return job
+    return stage
@@ -0,0 +1,31 @@
+"""
+Process-wide paragraph style sheets.
+
+The generators used to call get_styles() at the start of every job, which
+built a fresh getSampleStyleSheet() plus their own ParagraphStyles and
+swapped it into the module's ST global under any job still rendering with
+the old one. style_sheet() builds each (generator, font set) sheet once
+per process and hands every job the same read-only mapping of style name
+(or alias) to ParagraphStyle. The styles are shared, so nothing may modify
+them; derive a new ParagraphStyle with parent= instead.
+"""
+
+import threading
+from types import MappingProxyType
+
+_sheets = {}    # (generator, fonts) -> read-only {name: ParagraphStyle}
+_lock = threading.Lock()
+
+
+def style_sheet(generator: str, fonts: tuple, build):
+    """
+    The style sheet for `generator` with `fonts`, from build() -> StyleSheet1
+    the first time it is asked for.
+    """
+    key = (generator, tuple(fonts))
+    with _lock:
+        sheet = _sheets.get(key)
+        if sheet is None:
+            st = build()
+            sheet = _sheets[key] = MappingProxyType({**st.byAlias, **st.byName})
+        return sheet
@@ -1,27 +1,28 @@
 import os
 import tempfile
 import shutil
-import zipfile
 from werkzeug.utils import secure_filename
+from celery.signals import worker_process_init
+import worksheet_generator
+import caterpillar_generator
 from worksheet_generator import generate_worksheets
 from caterpillar_generator import generate_caterpillar_worksheets
 from celery_app import celery_app
+from llm_cache import CACHE_MODE
+from archive import TopicArchive
 
 # Download folder configuration
 DOWNLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'downloads')
 os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
 
-def zip_directory(folder_path, zip_path):
-    """Helper to zip a directory"""
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder_path)
-                zipf.write(file_path, arcname)
+@worker_process_init.connect
+def warm_fonts(**kwargs):
+    """Load both generators' fonts when a worker process starts, not on its first job."""
+    worksheet_generator.register_fonts(font_dir=os.path.dirname(os.path.abspath(worksheet_generator.__file__)))
+    caterpillar_generator.register_fonts()
 
 @celery_app.task(bind=True)
-def generate_worksheets_task(self, file_path, generator_type, api_key):
+def generate_worksheets_task(self, file_path, generator_type, api_key, cache_mode=CACHE_MODE, mode='online'):
     """
     Background task to generate worksheets
     
@@ -30,6 +31,8 @@ def generate_worksheets_task(self, file_path, generator_type, api_key):
         file_path: Path to uploaded Excel file
         generator_type: 'academy' or 'caterpillar'
         api_key: OpenAI API key
+        cache_mode: LLM response cache mode ('use', 'refresh' or 'bypass')
+        mode: 'online', or 'batch' to send first attempts through the Batch API
         
     Returns:
         dict with download URLs and generated files
@@ -43,10 +46,16 @@ def generate_worksheets_task(self, file_path, generator_type, api_key):
         # Select appropriate generator
         generator_func = generate_worksheets if generator_type == 'academy' else generate_caterpillar_worksheets
         
+        # Each 'result' carries its PDFs in memory; they are appended to the
+        # full archive as they arrive and topic downloads are views into it.
+        all_filename = f"all_worksheets_{self.request.id}.zip"
+        all_zip = TopicArchive(os.path.join(DOWNLOAD_FOLDER, all_filename))
+        
         # Track progress
         individual_files = []
         total_topics = 0
         completed_topics = 0
+        topic_count = 0
         
         # Update initial state
         self.update_state(
@@ -60,7 +69,7 @@ def generate_worksheets_task(self, file_path, generator_type, api_key):
         )
         
         # Run generator and collect results
-        for update in generator_func(file_path, output_dir, api_key):
+        for update in generator_func(file_path, output_dir, api_key, cache_mode=cache_mode, mode=mode):
             if update['type'] == 'progress':
                 # Update progress state
                 self.update_state(
@@ -74,19 +83,20 @@ def generate_worksheets_task(self, file_path, generator_type, api_key):
                 )
                 
             elif update['type'] == 'result':
-                # Zip individual topic
-                topic_path = update['path']
+                # Add the topic to the full archive
                 topic_name = update['topic']
                 safe_topic_name = secure_filename(topic_name)
-                zip_filename = f"{safe_topic_name}_{self.request.id}.zip"
-                zip_path = os.path.join(DOWNLOAD_FOLDER, zip_filename)
-                zip_directory(topic_path, zip_path)
+                # Numbered, so subtopics with the same title in different
+                # units do not share a download.
+                topic_count += 1
+                zip_filename = f"{topic_count:03d}_{safe_topic_name}_{self.request.id}.zip"
+                all_zip.add_topic(zip_filename, update['files'], update['arcdir'])
                 
                 completed_topics += 1
                 individual_files.append({
                     'topic': topic_name,
                     'filename': zip_filename,
-                    'download_url': f'/download/{zip_filename}'
+                    'download_url': f'/download/{all_filename}/{zip_filename}'
                 })
                 
                 # Update progress
@@ -106,11 +116,7 @@ def generate_worksheets_task(self, file_path, generator_type, api_key):
                 )
                 
             elif update['type'] == 'complete':
-                # Zip full output
-                full_output_path = update['path']
-                zip_filename = f"all_worksheets_{self.request.id}.zip"
-                zip_path = os.path.join(DOWNLOAD_FOLDER, zip_filename)
-                zip_directory(full_output_path, zip_path)
+                all_zip.close()
                 
                 # Clean up session directory
                 shutil.rmtree(session_dir)
@@ -118,13 +124,14 @@ def generate_worksheets_task(self, file_path, generator_type, api_key):
                 # Return final result
                 return {
                     'status': 'complete',
-                    'download_url': f'/download/{zip_filename}',
-                    'filename': zip_filename,
+                    'download_url': f'/download/{all_filename}',
+                    'filename': all_filename,
                     'individual_files': individual_files,
                     'total_generated': len(individual_files)
                 }
         
         # If no complete signal received, still return what we have
+        all_zip.close()
         return {
             'status': 'complete',
             'individual_files': individual_files,
@@ -133,6 +140,8 @@ def generate_worksheets_task(self, file_path, generator_type, api_key):
         
     except Exception as e:
         # Clean up on error
+        if 'all_zip' in locals():
+            all_zip.close()
         if 'session_dir' in locals():
             shutil.rmtree(session_dir, ignore_errors=True)
         
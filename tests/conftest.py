@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+
+# Keep the suite off Redis and out of the shared caches under cache/.
+_scratch = tempfile.mkdtemp(prefix="tad-tests-")
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(_scratch, "llm_responses.sqlite3"))
+os.environ.setdefault("ACCEPTANCE_STATS_PATH", os.path.join(_scratch, "acceptance.sqlite3"))
+os.environ.setdefault("CHECKPOINT_PATH", os.path.join(_scratch, "checkpoints.sqlite3"))
+os.environ.setdefault("LLM_RATE_LIMIT", "off")
+os.environ.setdefault("LLM_CACHE_MODE", "bypass")
+os.environ.setdefault("ADAPTIVE_SIZING", "off")
+os.environ.setdefault("RESUME", "off")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from llm_client import LLMClient  # noqa: E402
+from openai_stub import OpenAIStub  # noqa: E402
+
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    """Start an OpenAIStub and point new LLMClients at it."""
+    stubs = []
+
+    def start(**kwargs):
+        stub = OpenAIStub(**kwargs).__enter__()
+        stubs.append(stub)
+        monkeypatch.setenv("OPENAI_BASE_URL", stub.url)
+        return stub
+
+    yield start
+    for stub in stubs:
+        stub.__exit__(None, None, None)
+
+
+@pytest.fixture
+def make_client():
+    def make(**kwargs):
+        kwargs.setdefault("cache_mode", "bypass")
+        return LLMClient("sk-test", **kwargs)
+    return make
@@ -0,0 +1,209 @@
+"""
+A local stand-in for the parts of the OpenAI API the generators use:
+/v1/chat/completions (plain and streamed), /v1/files and /v1/batches.
+
+Point an LLMClient at it with OPENAI_BASE_URL=<stub.url>. `reply(prompt)`
+decides every answer, and the stub counts what it was asked so tests can
+check how many calls reached the API.
+"""
+
+import email.parser
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class OpenAIStub:
+    """
+    `batch_polls` is how many retrieves a batch stays in_progress before it
+    completes (None: it never does); while `fail_polls` is set every
+    retrieve answers 503.
+    """
+
+    def __init__(self, reply=lambda prompt: "[]", batch_polls: int = 1,
+                 fail_polls: bool = False):
+        self.reply = reply
+        self.batch_polls = batch_polls
+        self.fail_polls = fail_polls
+        self.chat_calls = 0
+        self.batch_requests = []
+        self.cancelled = []
+        self._files = {}
+        self._batches = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Endpoints: each returns (status, JSON-able body or raw bytes).
+
+    def chat(self, body):
+        with self._lock:
+            self.chat_calls += 1
+        return self.reply(body["messages"][-1]["content"])
+
+    def upload(self, data: bytes):
+        with self._lock:
+            file_id = f"file-{len(self._files)}"
+            self._files[file_id] = data
+        return 200, _file(file_id, len(data))
+
+    def create_batch(self, body):
+        lines = self._files[body["input_file_id"]].decode("utf-8").splitlines()
+        requests = [json.loads(line) for line in lines if line.strip()]
+        with self._lock:
+            batch_id = f"batch-{len(self._batches)}"
+            self.batch_requests.extend(requests)
+            self._batches[batch_id] = {"requests": requests, "polls": 0, "status": "in_progress",
+                                       "output_file_id": None}
+        return 200, self._batch(batch_id)
+
+    def retrieve_batch(self, batch_id):
+        if self.fail_polls:
+            return 503, {"error": {"message": "stub: unavailable", "type": "server_error"}}
+        with self._lock:
+            state = self._batches[batch_id]
+            state["polls"] += 1
+            if (state["status"] == "in_progress" and self.batch_polls is not None
+                    and state["polls"] >= self.batch_polls):
+                self._finish(batch_id, state)
+        return 200, self._batch(batch_id)
+
+    def cancel_batch(self, batch_id):
+        with self._lock:
+            self.cancelled.append(batch_id)
+            self._batches[batch_id]["status"] = "cancelled"
+        return 200, self._batch(batch_id)
+
+    def file_content(self, file_id):
+        return 200, self._files[file_id]
+
+    def _finish(self, batch_id, state):
+        out = []
+        for req in state["requests"]:
+            content = self.reply(req["body"]["messages"][-1]["content"])
+            out.append(json.dumps({
+                "id": f"{batch_id}-{req['custom_id']}",
+                "custom_id": req["custom_id"],
+                "response": {"status_code": 200, "body": _completion(content)},
+                "error": None,
+            }))
+        file_id = f"file-{len(self._files)}"
+        self._files[file_id] = ("\n".join(out) + "\n").encode("utf-8")
+        state["status"] = "completed"
+        state["output_file_id"] = file_id
+
+    def _batch(self, batch_id):
+        state = self._batches[batch_id]
+        total = len(state["requests"])
+        done = total if state["status"] == "completed" else 0
+        return {
+            "id": batch_id, "object": "batch", "endpoint": "/v1/chat/completions",
+            "input_file_id": "file-0", "completion_window": "24h",
+            "status": state["status"], "output_file_id": state["output_file_id"],
+            "created_at": int(time.time()),
+            "request_counts": {"total": total, "completed": done, "failed": 0},
+        }
+
+
+def _file(file_id, size):
+    return {"id": file_id, "object": "file", "bytes": size, "created_at": int(time.time()),
+            "filename": "requests.jsonl", "purpose": "batch", "status": "processed"}
+
+
+def _completion(content):
+    return {
+        "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+        "model": "stub",
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+    }
+
+
+def _chunk(delta=None, usage=None):
+    return {
+        "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+        "model": "stub",
+        "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": None}],
+        "usage": usage,
+    }
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def _send(self, status, payload):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/octet-stream" if isinstance(payload, bytes)
+                             else "application/json")
+            # Keep the client from retrying stubbed failures.
+            self.send_header("x-should-retry", "false")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, content):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            events = [_chunk({"role": "assistant", "content": ""})]
+            events += [_chunk({"content": content[i:i + 40]}) for i in range(0, len(content), 40)]
+            events.append(_chunk(usage={"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}))
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+
+        def _upload(self):
+            raw = (f"Content-Type: {self.headers['Content-Type']}\r\n\r\n").encode() + self._body()
+            message = email.parser.BytesParser().parsebytes(raw)
+            for part in message.get_payload():
+                if part.get_param("name", header="content-disposition") == "file":
+                    return stub.upload(part.get_payload(decode=True))
+            return 400, {"error": {"message": "stub: no file part"}}
+
+        def do_POST(self):
+            path = self.path.split("?")[0]
+            if path == "/v1/chat/completions":
+                body = json.loads(self._body())
+                content = stub.chat(body)
+                if body.get("stream"):
+                    return self._stream(content)
+                return self._send(200, _completion(content))
+            if path == "/v1/files":
+                return self._send(*self._upload())
+            if path == "/v1/batches":
+                return self._send(*stub.create_batch(json.loads(self._body())))
+            if path.startswith("/v1/batches/") and path.endswith("/cancel"):
+                self._body()
+                return self._send(*stub.cancel_batch(path.split("/")[3]))
+            self._send(404, {"error": {"message": f"stub: no route {path}"}})
+
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path.startswith("/v1/batches/"):
+                return self._send(*stub.retrieve_batch(path.split("/")[3]))
+            if path.startswith("/v1/files/") and path.endswith("/content"):
+                return self._send(*stub.file_content(path.split("/")[3]))
+            self._send(404, {"error": {"message": f"stub: no route {path}"}})
+
+    return Handler
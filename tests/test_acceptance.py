@@ -0,0 +1,51 @@
+import json
+import re
+
+from acceptance import AcceptanceRates, AcceptanceStore
+from caterpillar_generator import build_tf
+from generation_context import GenerationContext
+from llm_cache import JobCache, ResponseCache
+
+TOPIC, NOTE = "States of matter", "Solids, liquids and gases."
+
+
+def half_valid(prompt):
+    """n statements, every other one with an answer the builder rejects."""
+    n = int(re.search(r"EXACTLY (\d+)", prompt).group(1))
+    items = [{"statement": f"Statement {i}.", "answer": "maybe" if i % 2 else True,
+              "explanation": ""} for i in range(n)]
+    return json.dumps(items)
+
+
+def run_job(make_client, tmp_path):
+    client = make_client(cache_mode="use")
+    client.cache = JobCache("use", ResponseCache(str(tmp_path / "llm.sqlite3")))
+    rates = AcceptanceRates(AcceptanceStore(str(tmp_path / "acceptance.sqlite3")),
+                            enabled=True, version="1")
+    ctx = GenerationContext(None, None, client, rates, prompt_context="Grade 5 science")
+    return build_tf(TOPIC, NOTE, ctx, target=20)
+
+
+def test_rerun_sends_the_same_prompts(openai_stub, make_client, tmp_path):
+    stub = openai_stub(reply=half_valid)
+
+    first = run_job(make_client, tmp_path)
+    calls = stub.chat_calls
+    assert len(first) == 20 and calls > 1
+
+    # The first run recorded a 50% acceptance rate; the rerun must still
+    # ask for what the first run asked for, so every reply is a cache hit.
+    second = run_job(make_client, tmp_path)
+    assert second == first
+    assert stub.chat_calls == calls
+
+
+def test_new_version_sizes_from_recorded_rates(tmp_path):
+    store = AcceptanceStore(str(tmp_path / "acceptance.sqlite3"))
+    first = AcceptanceRates(store, enabled=True, version="1")
+    assert first.request_size(TOPIC, "tf", 20) == 20
+    first.record(TOPIC, "tf", 40, 20)
+    assert first.request_size(TOPIC, "tf", 20) == 20
+
+    assert AcceptanceRates(store, enabled=True, version="1").request_size(TOPIC, "tf", 20) == 20
+    assert AcceptanceRates(store, enabled=True, version="2").request_size(TOPIC, "tf", 20) == 35
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+import checkpoints
+from checkpoints import JobCheckpoints, render_version
+
+
+def test_render_version_follows_sources_templates_and_settings(tmp_path, monkeypatch):
+    source = tmp_path / "gen.py"
+    template = tmp_path / "page.jpg"
+    source.write_text("A = 1\n")
+    template.write_bytes(b"one")
+    before = render_version(str(source), files=[template])
+    assert render_version(str(source), files=[template]) == before
+
+    template.write_bytes(b"two!")
+    after_template = render_version(str(source), files=[template])
+    assert after_template != before
+
+    source.write_text("A = 22\n")
+    after_source = render_version(str(source), files=[template])
+    assert after_source != after_template
+
+    monkeypatch.setattr(checkpoints, "PREVIEW_DPI", checkpoints.PREVIEW_DPI + 1)
+    assert render_version(str(source), files=[template]) != after_source
+
+
+def test_render_version_is_part_of_the_key():
+    curriculum = SimpleNamespace(subject_name="Science", grade_level="Grade 5",
+                                 curriculum_name="Biology")
+    old = JobCheckpoints('test', '1', enabled=False, render_version='a')
+    new = JobCheckpoints('test', '1', enabled=False, render_version='b')
+    assert old.key(curriculum, "Unit", "Cells", "") != new.key(curriculum, "Unit", "Cells", "")
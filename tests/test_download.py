@@ -0,0 +1,48 @@
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("CELERY_WORKER", "true")
+
+import pytest  # noqa: E402
+
+from app import app  # noqa: E402
+from archive import TopicArchive  # noqa: E402
+
+KEY = "001_Cells.zip"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "UPLOAD_FOLDER", str(tmp_path))
+    archive = TopicArchive(tmp_path / "run.zip")
+    archive.add_topic(KEY, [("Unit/01. Cells/worksheet.pdf", b"%PDF-" + b"x" * 500)], "Unit/01. Cells")
+    archive.close()
+    return app.test_client()
+
+
+def full_body(client):
+    resp = client.get(f"/download/run.zip/{KEY}")
+    assert resp.status_code == 200
+    return resp.data
+
+
+def test_single_range(client):
+    body = full_body(client)
+    resp = client.get(f"/download/run.zip/{KEY}", headers={"Range": "bytes=10-19"})
+    assert resp.status_code == 206
+    assert resp.data == body[10:20]
+    assert resp.headers["Content-Range"] == f"bytes 10-19/{len(body)}"
+
+
+def test_multiple_ranges_get_the_whole_body(client):
+    body = full_body(client)
+    resp = client.get(f"/download/run.zip/{KEY}", headers={"Range": "bytes=0-9,20-29"})
+    assert resp.status_code == 200
+    assert resp.data == body
+
+
+def test_unsatisfiable_range(client):
+    body = full_body(client)
+    resp = client.get(f"/download/run.zip/{KEY}", headers={"Range": f"bytes={len(body) + 10}-"})
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == f"bytes */{len(body)}"
@@ -0,0 +1,48 @@
+from llm_batch import run_batch
+
+PROMPTS = [("List three facts about frogs.", None), ("List three facts about owls.", None)]
+
+
+def reply(prompt):
+    return f"reply to {prompt}"
+
+
+def drain(events):
+    return [e["message"] for e in events]
+
+
+def test_completed_batch_primes_client(openai_stub, make_client):
+    stub = openai_stub(reply=reply, batch_polls=2)
+    client = make_client()
+
+    messages = drain(run_batch(client, PROMPTS, poll_interval=0))
+
+    assert messages[-1] == "Batch completed: 2/2 replies."
+    assert len(stub.batch_requests) == 2
+    for prompt, _ in PROMPTS:
+        assert client.ask(prompt) == reply(prompt)
+    assert stub.chat_calls == 0
+
+
+def test_stuck_batch_is_cancelled_after_max_wait(openai_stub, make_client):
+    stub = openai_stub(reply=reply, batch_polls=None)
+    client = make_client()
+
+    messages = drain(run_batch(client, PROMPTS, poll_interval=0.01, max_wait=0.2))
+
+    assert stub.cancelled == ["batch-0"]
+    assert "generating online instead" in messages[-1]
+    assert client.ask(PROMPTS[0][0]) == reply(PROMPTS[0][0])
+    assert stub.chat_calls == 1
+
+
+def test_failing_polls_cancel_the_batch(openai_stub, make_client):
+    stub = openai_stub(reply=reply, fail_polls=True)
+    client = make_client()
+
+    messages = drain(run_batch(client, PROMPTS, poll_interval=0, max_poll_failures=3))
+
+    assert stub.cancelled == ["batch-0"]
+    assert messages[-1] == "Batch 3 polls failed in a row; generating online instead."
+    assert client.ask(PROMPTS[1][0]) == reply(PROMPTS[1][0])
+    assert stub.chat_calls == 1
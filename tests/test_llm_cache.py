@@ -0,0 +1,32 @@
+import threading
+
+from llm_cache import JobCache, ResponseCache
+
+
+def client_with_cache(make_client, path):
+    client = make_client(cache_mode="use")
+    client.cache = JobCache("use", ResponseCache(str(path)))
+    return client
+
+
+def test_cancelled_request_does_not_shift_occurrences(openai_stub, make_client, tmp_path):
+    replies = iter(["first", "second", "third"])
+    stub = openai_stub(reply=lambda prompt: next(replies))
+    path = tmp_path / "llm.sqlite3"
+    prompt = "List three facts about frogs."
+
+    client = client_with_cache(make_client, path)
+    stop = threading.Event()
+    stop.set()
+    # A speculative request that lost before it was sent.
+    assert client.run(client.ask_async(prompt, on_text=lambda text: None, stop=stop)) is None
+    assert client.ask(prompt) == "first"
+    assert client.ask(prompt) == "second"
+    assert stub.chat_calls == 2
+
+    rerun = client_with_cache(make_client, path)
+    assert rerun.ask(prompt) == "first"
+    assert rerun.ask(prompt) == "second"
+    assert stub.chat_calls == 2
+    assert rerun.ask(prompt) == "third"
+    assert stub.chat_calls == 3
@@ -0,0 +1,42 @@
+from checkpoints import CheckpointStore, JobCheckpoints
+from pipeline import Stage, run_subtopic_jobs
+
+
+def make_jobs():
+    return [{'topic': t, 'note': '', 'ctx': None, 'sub_path': f"Unit/{i:02d}. {t}",
+             'checkpoint': f"key-{t}"} for i, t in enumerate(("Cells", "Tissues", "Organs"), 1)]
+
+
+def render(job):
+    job['files'] = [(f"{job['sub_path']}/{job['topic']}.pdf", job['topic'].encode())]
+    return job
+
+
+def run(checkpoints, tmp_path, stage=render):
+    stages = [Stage('render', stage, workers=2)]
+    return list(run_subtopic_jobs(make_jobs(), stages, checkpoints, tmp_path / "out",
+                                  materialize_output=True))
+
+
+def test_results_progress_and_materialize(tmp_path):
+    checkpoints = JobCheckpoints('test', '1', enabled=False)
+    events = run(checkpoints, tmp_path)
+
+    results = [e for e in events if e['type'] == 'result']
+    assert sorted(e['topic'] for e in results) == ["Cells", "Organs", "Tissues"]
+    assert [e['progress'] for e in results] == ["1/3", "2/3", "3/3"]
+    assert events[-1] == {'type': 'complete', 'path': str(tmp_path / "out")}
+    assert (tmp_path / "out" / "Unit" / "02. Tissues" / "Tissues.pdf").read_bytes() == b"Tissues"
+
+
+def test_checkpointed_subtopics_are_replayed(tmp_path):
+    store = CheckpointStore(str(tmp_path / "ck.sqlite3"))
+    run(JobCheckpoints('test', '1', store=store, enabled=True), tmp_path)
+
+    def fail(job):
+        raise AssertionError("stage ran for a checkpointed subtopic")
+
+    events = run(JobCheckpoints('test', '1', store=store, enabled=True), tmp_path, stage=fail)
+    results = [e for e in events if e['type'] == 'result']
+    assert [e['topic'] for e in results] == ["Cells", "Tissues", "Organs"]
+    assert results[0]['files'] == [("Unit/01. Cells/Cells.pdf", b"Cells")]
@@ -0,0 +1,52 @@
+"""
+Line breaking for text drawn straight onto the canvas: task cards, the
+preview cover notice and title pages.
+
+The loops this replaces called pdfmetrics.stringWidth on every growing
+prefix of a line, which is quadratic in the words per line. ReportLab
+applies no kerning, so a string's width is the sum of its glyph advances
+and scales linearly with the font size. Each word is therefore measured
+once per font at 1pt, and lines are filled greedily by adding up word
+widths. Wrapping the same text at another size costs one more linear
+pass, which is what lets the task cards try body_font's 12/11/10pt sizes
+in turn. Wrapped lines are memoized as well, because the same cards and
+notices are set again for every copy of a document.
+"""
+
+import functools
+
+from reportlab.pdfbase import pdfmetrics
+
+
+@functools.lru_cache(maxsize=65536)
+def _unit_width(text: str, font_name: str) -> float:
+    return pdfmetrics.stringWidth(text, font_name, 1)
+
+
+def text_width(text: str, font_name: str, size: float) -> float:
+    """Width of `text` in points, like pdfmetrics.stringWidth."""
+    return _unit_width(text, font_name) * size
+
+
+@functools.lru_cache(maxsize=4096)
+def wrap_text(text: str, font_name: str, size: float, max_width: float) -> tuple:
+    """
+    Greedy wrap of `text` into lines at most max_width wide; newlines in
+    `text` always break. A word wider than max_width gets a line of its own.
+    """
+    limit = max_width / size
+    space = _unit_width(' ', font_name)
+    lines = []
+    for part in text.split('\n'):
+        words, width = [], 0.0
+        for word in part.split():
+            w = _unit_width(word, font_name)
+            if words and width + space + w > limit:
+                lines.append(' '.join(words))
+                words, width = [word], w
+            else:
+                width = width + space + w if words else w
+                words.append(word)
+        if words:
+            lines.append(' '.join(words))
+    return tuple(lines)
@@ -22,7 +22,6 @@ import os, re, json, random, pathlib, sys, time, argparse, string
 from typing import List, Tuple
 from datetime import datetime
 
-import pandas as pd
 
 from reportlab.lib.pagesizes import letter
 from reportlab.platypus      import (SimpleDocTemplate, Paragraph, Spacer,
@@ -31,9 +30,13 @@ from reportlab.platypus      import (SimpleDocTemplate, Paragraph, Spacer,
 from reportlab.lib.styles    import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib           import colors
 from reportlab.pdfbase       import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen        import canvas
 import openai, backoff, tempfile
+from llm_cache import JobCache
+from llm_json import parse_items
+from font_registry import register_ttf
+from curriculum_sheet import CurriculumSheet
+from rate_limiter import estimate_tokens, shared_limiter
 try:
     # Prefer pypdf if available
     from pypdf import PdfMerger, PdfReader, PdfWriter
@@ -108,33 +111,24 @@ def register_fonts():
 
    # Try title candidates then fallbacks
    for p in title_candidates + FONT_PATHS:
-       try:
-           fam = pathlib.Path(p).stem
-           pdfmetrics.registerFont(TTFont(fam, p))
+       fam = pathlib.Path(p).stem
+       if register_ttf(fam, p):
            title = fam
            break
-       except Exception:
-           pass
 
    # Try body candidates then fallbacks
    for p in body_candidates + FONT_PATHS:
-       try:
-           fam = pathlib.Path(p).stem
-           pdfmetrics.registerFont(TTFont(fam, p))
+       fam = pathlib.Path(p).stem
+       if register_ttf(fam, p):
            body = fam
            break
-       except Exception:
-           pass
    
    # Try explanation candidates then fall back to body italic
    for p in explanation_candidates:
-       try:
-           fam = pathlib.Path(p).stem
-           pdfmetrics.registerFont(TTFont(fam, p))
+       fam = pathlib.Path(p).stem
+       if register_ttf(fam, p):
            explanation = fam
            break
-       except Exception:
-           pass
 
    if not body:
        # Try some common system locations for DejaVu or Noto before falling back
@@ -146,14 +140,11 @@ def register_fonts():
            "/Library/Fonts/NotoSans-VariableFont_wdth,wght.ttf",
        ]
        for p in extra_paths:
-           try:
-               if pathlib.Path(p).exists():
-                   fam = pathlib.Path(p).stem
-                   pdfmetrics.registerFont(TTFont(fam, p))
+           if pathlib.Path(p).exists():
+               fam = pathlib.Path(p).stem
+               if register_ttf(fam, p):
                    body = fam
                    break
-           except Exception:
-               pass
        if not body:
            body = "Helvetica"
    if not title:
@@ -459,28 +450,47 @@ class UnderlinedAnswer(Flowable):
 
 
 # ───────────────────  OPENAI HELPERS  ────────────────────────────
+# Replies are replayed from the shared response cache on re-runs; set
+# LLM_CACHE_MODE=refresh or =bypass to re-ask or skip it.
+_LLM_CACHE = None
+
+def llm_cache() -> JobCache:
+   global _LLM_CACHE
+   if _LLM_CACHE is None:
+       _LLM_CACHE = JobCache()
+   return _LLM_CACHE
+
 @backoff.on_exception(backoff.expo, openai.RateLimitError, max_time=180)
-def _ask(prompt: str) -> str:
-   return openai.chat.completions.create(
+def _complete(prompt: str) -> str:
+   # Share the RPM/TPM budget with any Celery workers on the same key.
+   limiter = shared_limiter(openai.api_key)
+   estimated = estimate_tokens(prompt)
+   limiter.acquire(estimated)
+   resp = openai.chat.completions.create(
        model=MODEL,
        messages=[{"role": "user", "content": prompt}],
        temperature=0.7
-   ).choices[0].message.content
+   )
+   limiter.settle(estimated, getattr(resp.usage, "total_tokens", None))
+   return resp.choices[0].message.content
 
-def extract_json(md: str) -> list:
-   match = re.search(r"\[.*\]", md, re.S)
-   return json.loads(match.group()) if match else []
+def _ask(prompt: str) -> str:
+   cache = llm_cache()
+   key = cache.slot(MODEL, 0.7, prompt)
+   cached = cache.lookup(key)
+   if cached is not None:
+       return cached
+   response = _complete(prompt)
+   cache.store(key, response)
+   return response
 
 def get_json(prompt: str) -> list:
    try:
        response = _ask(prompt)
-       result = extract_json(response)
+       result = parse_items(response)
        if not result:
            print(f"⚠️  Warning: No JSON found in API response")
        return result
-   except json.JSONDecodeError as e:
-       print(f"⚠️  JSON decode error: {e}")
-       return []
    except Exception as e:
        print(f"⚠️  API error: {e}")
        return []
@@ -1663,18 +1673,14 @@ def load_curriculum_from_excel(excel_path: str = "details.xlsx") -> List[Curricu
     Returns a list of CurriculumData objects (one per curriculum in the file).
     """
     try:
-        # Read entire Excel file without headers to parse structure
-        df_raw = pd.read_excel(excel_path, header=None)
-        print(f"📊 Excel file loaded: {len(df_raw)} rows, {len(df_raw.columns)} columns\n")
+        # Read the first sheet once; markers, headers and blank rows are found column-wise
+        sheet = CurriculumSheet(excel_path)
+        print(f"📊 Excel file loaded: {sheet.n_rows} rows, {sheet.n_cols} columns\n")
         
         all_curricula = []
         
-        # Find all curriculum section markers (rows starting with "Subject Name -")
-        curriculum_start_rows = []
-        for idx in range(len(df_raw)):
-            first_col = str(df_raw.iloc[idx, 0]).strip() if pd.notna(df_raw.iloc[idx, 0]) else ''
-            if first_col.lower().startswith('subject name'):
-                curriculum_start_rows.append(idx)
+        # Curriculum section markers (rows starting with "Subject Name -")
+        curriculum_start_rows = sheet.markers
         
         if not curriculum_start_rows:
             print("❌ No 'Subject Name -' markers found. Using legacy single-curriculum format.")
@@ -1685,7 +1691,7 @@ def load_curriculum_from_excel(excel_path: str = "details.xlsx") -> List[Curricu
         # Process each curriculum section
         for curr_idx, start_row in enumerate(curriculum_start_rows):
             # Determine end row (either next curriculum start or end of file)
-            end_row = curriculum_start_rows[curr_idx + 1] if curr_idx + 1 < len(curriculum_start_rows) else len(df_raw)
+            end_row = curriculum_start_rows[curr_idx + 1] if curr_idx + 1 < len(curriculum_start_rows) else sheet.n_rows
             
             print(f"{'='*60}")
             print(f"Processing Curriculum #{curr_idx + 1} (rows {start_row + 1} to {end_row})")
@@ -1693,22 +1699,22 @@ def load_curriculum_from_excel(excel_path: str = "details.xlsx") -> List[Curricu
             
             # Extract metadata from first 3 rows of this section
             # Check if data is in column 0 (legacy format) or column 1 (new format with labels)
-            first_cell = str(df_raw.iloc[start_row, 0]).strip() if pd.notna(df_raw.iloc[start_row, 0]) else ""
+            first_cell = sheet.text[0][start_row]
             
             if first_cell.lower().startswith('subject name'):
                 # New format: Labels in column 0, data in column 1
-                subject_name = str(df_raw.iloc[start_row, 1]).strip() if pd.notna(df_raw.iloc[start_row, 1]) else "Unknown Subject"
-                grade_level = str(df_raw.iloc[start_row + 1, 1]).strip() if pd.notna(df_raw.iloc[start_row + 1, 1]) else "Unknown Grade"
-                curriculum_name = str(df_raw.iloc[start_row + 2, 1]).strip() if pd.notna(df_raw.iloc[start_row + 2, 1]) else "Unknown Curriculum"
+                subject_name = sheet.value(start_row, 1, "Unknown Subject")
+                grade_level = sheet.value(start_row + 1, 1, "Unknown Grade")
+                curriculum_name = sheet.value(start_row + 2, 1, "Unknown Curriculum")
             else:
                 # Legacy format: Data in column 0 with prefix
                 subject_name = first_cell
                 subject_name = re.sub(r'^Subject Name\s*-\s*', '', subject_name, flags=re.IGNORECASE).strip()
                 
-                grade_level = str(df_raw.iloc[start_row + 1, 0]).strip() if pd.notna(df_raw.iloc[start_row + 1, 0]) else "Unknown Grade"
+                grade_level = sheet.value(start_row + 1, 0, "Unknown Grade")
                 grade_level = re.sub(r'^Grade level\s*-\s*', '', grade_level, flags=re.IGNORECASE).strip()
                 
-                curriculum_name = str(df_raw.iloc[start_row + 2, 0]).strip() if pd.notna(df_raw.iloc[start_row + 2, 0]) else "Unknown Curriculum"
+                curriculum_name = sheet.value(start_row + 2, 0, "Unknown Curriculum")
                 curriculum_name = re.sub(r'^Curriculum\s*-\s*', '', curriculum_name, flags=re.IGNORECASE).strip()
             
             print(f"📚 Subject: {subject_name}")
@@ -1725,29 +1731,15 @@ def load_curriculum_from_excel(excel_path: str = "details.xlsx") -> List[Curricu
             in_data_section = False
             
             for idx in range(start_row + 3, end_row):
-                row = df_raw.iloc[idx]
-                
-                # Get first column value
-                first_col = str(row[0]).strip() if pd.notna(row[0]) else ''
-                
-                # Stop if we encounter another "Subject Name -" marker (shouldn't happen but safety check)
-                if first_col.lower().startswith('subject name'):
-                    break
-                
-                # Check if this is a header row (contains NO, STANDARD, TITLE, NOTE)
-                row_values = [str(val).strip().upper() for val in row.values if pd.notna(val)]
-                is_header = any(h in row_values for h in ['NO', 'TITLE', 'STANDARD', 'NOTE'])
-                
-                if is_header:
+                # Header row (contains NO, STANDARD, TITLE, NOTE)
+                if sheet.header[idx]:
                     # Found header row - next rows will be data
                     in_data_section = True
                     print(f"📋 Found header at row {idx + 1}")
                     continue
                 
-                # Check if row is empty (signals end of current unit)
-                row_empty = all(pd.isna(val) or str(val).strip() == '' for val in row.values)
-                
-                if row_empty and in_data_section:
+                # An empty row signals the end of the current unit
+                if sheet.empty[idx] and in_data_section:
                     # End of current unit - save it
                     if current_unit_title and current_subtopics:
                         unit_index += 1
@@ -1759,39 +1751,20 @@ def load_curriculum_from_excel(excel_path: str = "details.xlsx") -> List[Curricu
                 
                 if not in_data_section:
                     # We're in the title section (merged rows) - this is a unit title
+                    first_col = sheet.text[0][idx]
                     if first_col and len(first_col) > 3:
                         current_unit_title = first_col
                         print(f"📖 Unit Title: {current_unit_title}")
-                else:
+                elif sheet.n_cols >= 3:
                     # We're in data section - parse topic data
                     # Expected columns: NO, STANDARD, TITLE, NOTE
-                    if len(row) >= 3:
-                        no_val = row[0]
-                        standard_val = row[1]
-                        title_val = row[2]
-                        note_val = row[3] if len(row) > 3 else ''
-                        
-                        # Convert NO to integer
-                        try:
-                            sub_idx = int(float(no_val)) if pd.notna(no_val) else len(current_subtopics) + 1
-                        except (ValueError, TypeError):
-                            sub_idx = len(current_subtopics) + 1
-                        
-                        # Get title
-                        title = str(title_val).strip() if pd.notna(title_val) else ''
-                        
-                        # Get standard and prepend if available
-                        if pd.notna(standard_val):
-                            standard = str(standard_val).strip()
-                            if standard and standard != '':
-                                title = f"{standard} — {title}"
-                        
-                        # Get note
-                        note = str(note_val).strip() if pd.notna(note_val) else ''
-                        
-                        # Add if valid
-                        if title and title != 'nan' and len(title) > 2:
-                            current_subtopics.append((sub_idx, title, note))
+                    sub_idx, title, note = sheet.subtopic(idx, " — ")
+                    if sub_idx is None:
+                        sub_idx = len(current_subtopics) + 1
+                    
+                    # Add if valid
+                    if title and title != 'nan' and len(title) > 2:
+                        current_subtopics.append((sub_idx, title, note))
             
             # Don't forget the last unit if section doesn't end with empty row
             if current_unit_title and current_subtopics:
@@ -5,41 +5,76 @@ Worksheet PDF Builder – MCQ • True/False • Short-Answer  (v9.1)
 Refactored for Web Application
 """
 
-import os, re, json, random, pathlib, sys, time, string, shutil
-from typing import List, Tuple
+import os, re, random, pathlib, sys, time, string, shutil
+from typing import List, NamedTuple, Tuple
 from datetime import datetime
 
-import pandas as pd
 
 from reportlab.lib.pagesizes import letter
-from reportlab.platypus      import (SimpleDocTemplate, Paragraph, Spacer,
+from reportlab.platypus      import (SimpleDocTemplate, Spacer,
                                     KeepTogether, PageBreak, Flowable,
                                     BaseDocTemplate, Frame, PageTemplate, NextPageTemplate)
 from reportlab.lib.styles    import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib           import colors
 from reportlab.pdfbase       import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen        import canvas
-import openai, backoff, tempfile
-
-try:
-    from pypdf import PdfMerger, PdfReader, PdfWriter
-except Exception:
-    try:
-        from PyPDF2 import PdfMerger, PdfReader, PdfWriter
-    except Exception:
-        PdfMerger = PdfReader = PdfWriter = None
+import io
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_cache import CACHE_MODE
+from llm_batch import GENERATION_MODES
+from llm_client import LLMClient, MAX_IN_FLIGHT
+from llm_json import response_format
+from acceptance import AcceptanceRates
+from pipeline import Stage, run_subtopic_jobs
+from pdf_compose import compose, render_page
+from render_model import QuestionModel
+from render_pool import pool_workers, render_pool, render_stage
+from artifacts import MATERIALIZE_OUTPUT, pdf_target
+from checkpoints import RESUME, JobCheckpoints, render_version
+from font_registry import register_ttf
+from generation_context import GenerationContext, on_page
+from style_registry import style_sheet
+from curriculum_sheet import CurriculumSheet
+from text_wrap import text_width, wrap_text
 
 # ───────────────────────  CONFIG  ────────────────────────────────
 MODEL = "gpt-4o-mini"
 
+# Max deck builders (MCQ, TF, SA, task cards) running at once for a subtopic.
+# 1 restores the old one-after-another behaviour.
+DECK_CONCURRENCY = int(os.environ.get("DECK_CONCURRENCY", "4"))
+
+# Items each deck builder asks for; decks are trimmed/padded afterwards.
+DECK_REQUEST_SIZES = {'mcq': 30, 'tf': 30, 'sa': 30, 'task_cards': 35}
+
+# Subtopics in the LLM stage at once, and how many finished items may queue
+# between the fetch and render stages.
+SUBTOPIC_CONCURRENCY = int(os.environ.get("SUBTOPIC_CONCURRENCY", "3"))
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "2"))
+
+# Requests raced per builder retry (full + simple prompt, ...); 1 = off.
+# Trades extra tokens for fewer sequential round-trips.
+SPECULATIVE_REQUESTS = int(os.environ.get("SPECULATIVE_REQUESTS", "1"))
+MAX_SPECULATIVE_REQUESTS = 4
+
+# Part of every subtopic's checkpoint fingerprint (see checkpoints.py for
+# when to bump it) and the key request sizes are frozen under (acceptance.py).
+PROMPT_VERSION = "1"
+
 FONT_PATHS = [
     "DejaVuSans.ttf",
     "NotoSans-VariableFont_wdth,wght.ttf",
     "Fredoka-VariableFont_wdth.ttf",
 ]
 
-def register_fonts(font_dir="."):
+class Fonts(NamedTuple):
+   title: str
+   body: str
+   expl: str
+
+def register_fonts(font_dir=os.path.dirname(os.path.abspath(__file__))) -> Fonts:
    # Title Font: Comic Neue Bold for main titles and section headers
    title_candidates = [
        "ComicNeue-Bold.ttf",
@@ -75,12 +110,9 @@ def register_fonts(font_dir="."):
            paths_to_check = [p, os.path.join(font_dir, p)]
            for path in paths_to_check:
                if os.path.exists(path):
-                   try:
-                       fam = pathlib.Path(path).stem
-                       pdfmetrics.registerFont(TTFont(fam, path))
+                   fam = pathlib.Path(path).stem
+                   if register_ttf(fam, path):
                        return fam
-                   except Exception:
-                       pass
        return None
 
    title = try_register(title_candidates)
@@ -94,12 +126,9 @@ def register_fonts(font_dir="."):
    if not explanation:
        explanation = body
    
-   return title, body, explanation
-
-# Initialize fonts globally (will be re-initialized in generate_worksheets if needed)
-TITLE_FONT, BODY_FONT, EXPL_FONT = "Helvetica", "Helvetica", "Helvetica"
+   return Fonts(title, body, explanation)
 
-# Curriculum constants
+# Curriculum the prompts name when no workbook curriculum is given
 CURRICULUM_NAME = "NGSS - Middle School Physical Sciences"
 GRADE_LEVELS = "6,7,8"
 
@@ -143,29 +172,47 @@ def body_font(chars: int) -> int:
    return 0
 
 MAX_CARD_CHARS = 325
+CARD_FONT_SIZES = (12, 11, 10)
 
+def fit_card_body(q_text, opts, font, first_size, max_width, max_height):
+    """
+    (font size, question lines, option lines) for a task card body. Starts
+    at first_size (the card's body_font) and steps down through the smaller
+    CARD_FONT_SIZES while the wrapped text is taller than max_height.
+    """
+    for fsize in [s for s in CARD_FONT_SIZES if s <= first_size]:
+        lines = wrap_text(q_text, font, fsize, max_width)
+        opt_lines = [ln for label, opt in zip('ABCD', opts)
+                     for ln in wrap_text(f"{label}. {opt}", font, fsize, max_width)]
+        # Question lines, a blank gap, then the options; the last baseline must clear max_height.
+        if (len(lines) + len(opt_lines) - 1) * (fsize + 2) + fsize <= max_height:
+            break
+    return fsize, lines, opt_lines
 
-# ───────────────────  REPORTLAB STYLES  ──────────────────────────
-ST = None # Initialized later
 
-def get_styles():
+# ───────────────────  REPORTLAB STYLES  ──────────────────────────
+def _build_styles(title, body, expl):
     st = getSampleStyleSheet()
     def add(n, **kw):
-        font = kw.pop('fontName', BODY_FONT)
+        font = kw.pop('fontName', body)
         st.add(ParagraphStyle(n, fontName=font, **kw))
-    add('Doc',   fontName=TITLE_FONT, fontSize=16, leading=20, alignment=1, spaceAfter=12, bold=True)
+    add('Doc',   fontName=title, fontSize=16, leading=20, alignment=1, spaceAfter=12, bold=True)
     add('Q',     fontSize=12, leading=15, leftIndent=10, spaceAfter=6)
     add('Opt',   fontSize=12, leading=15, leftIndent=25, spaceAfter=2)
     add('Blue',  parent=st['Opt'], textColor=colors.blue)
-    add('Expl',  fontName=EXPL_FONT, fontSize=10, leading=13, leftIndent=25, spaceAfter=10, textColor=colors.grey)
-    add('AnsH',  fontName=TITLE_FONT, fontSize=15, leading=20, alignment=1, spaceAfter=20, bold=True)
+    add('Expl',  fontName=expl, fontSize=10, leading=13, leftIndent=25, spaceAfter=10, textColor=colors.grey)
+    add('AnsH',  fontName=title, fontSize=15, leading=20, alignment=1, spaceAfter=20, bold=True)
     add('TF',    fontSize=12, leading=15, leftIndent=10, spaceAfter=4)
     add('Line',  fontSize=12, leading=14, leftIndent=20, textColor=colors.grey)
     add('Note',  fontSize=11, leading=14, textColor=colors.red, alignment=0, spaceAfter=10)
-    add('PreviewTitleMain', fontName=TITLE_FONT, fontSize=24, leading=28, alignment=1, textColor=colors.blue)
-    add('PreviewTitleSub',  fontName=TITLE_FONT, fontSize=16, leading=20, alignment=1, textColor=colors.blue)
+    add('PreviewTitleMain', fontName=title, fontSize=24, leading=28, alignment=1, textColor=colors.blue)
+    add('PreviewTitleSub',  fontName=title, fontSize=16, leading=20, alignment=1, textColor=colors.blue)
     return st
 
+def get_styles(fonts: Fonts):
+    """The shared, read-only style sheet for `fonts` (built once per process)."""
+    return style_sheet('academy', fonts, lambda: _build_styles(*fonts))
+
 
 # ───────────────────  PAGE DECORATION  ───────────────────────────
 PAGE_W, PAGE_H = letter
@@ -185,20 +232,20 @@ def draw_frame(c):
     c.setLineWidth(2)
     c.rect(x, y, width, height)
 
-def first(c, d):
+def first(c, d, fonts):
     draw_frame(c)
-    c.setFont(BODY_FONT, 12)
+    c.setFont(fonts.body, 12)
     name_x = BORDER_INSET + 10
     name_y = PAGE_H - BORDER_INSET - 26 
     c.drawString(name_x, name_y, "Name: ...........................................................          Date : ........................")
-    c.setFont(BODY_FONT, 10)
+    c.setFont(fonts.body, 10)
     c.drawCentredString(PAGE_W/2, 25, str(d.page))
 
-def first_page_no_watermark(c, d):
+def first_page_no_watermark(c, d, fonts):
     draw_frame(c)
     c.saveState()
     c.setFillColor(colors.red)
-    c.setFont(TITLE_FONT, 18)
+    c.setFont(fonts.title, 18)
 
     notice_text = (
         "This is a combined preview only. After purchase, you will receive separate question PDFs and "
@@ -206,19 +253,7 @@ def first_page_no_watermark(c, d):
     )
 
     max_width = PAGE_W - 2 * BORDER_INSET - 40
-    words = notice_text.split()
-    lines = []
-    current_line = []
-    for word in words:
-        test_line = ' '.join(current_line + [word])
-        if pdfmetrics.stringWidth(test_line, TITLE_FONT, 18) <= max_width:
-            current_line.append(word)
-        else:
-            if current_line:
-                lines.append(' '.join(current_line))
-            current_line = [word]
-    if current_line:
-        lines.append(' '.join(current_line))
+    lines = wrap_text(notice_text, fonts.title, 18, max_width)
 
     line_height = 22
     start_y = 25 + 15 + (len(lines) * line_height)
@@ -228,35 +263,47 @@ def first_page_no_watermark(c, d):
         y -= line_height
     c.restoreState()
 
-    c.setFont(BODY_FONT, 10)
+    c.setFont(fonts.body, 10)
     c.drawCentredString(PAGE_W/2, 25, str(d.page))
 
-def later(c, d):
+def later(c, d, fonts):
     draw_frame(c)
-    c.setFont(BODY_FONT, 12)
+    c.setFont(fonts.body, 12)
     name_x = BORDER_INSET + 10
     name_y = PAGE_H - BORDER_INSET - 26
     c.drawString(name_x, name_y, "Name: ...........................................................          Date : ........................")
-    c.setFont(BODY_FONT, 10)
+    c.setFont(fonts.body, 10)
     c.drawCentredString(PAGE_W/2, 25, str(d.page))
 
-def preview_page(c, d):
-    later(c, d)
+def draw_watermark(c, fonts):
     c.saveState()
-    c.setFont(BODY_FONT, 130)
+    c.setFont(fonts.body, 130)
     c.setFillColor(colors.lightgrey)
     c.translate(PAGE_W/2, PAGE_H/2)
     c.rotate(45)
     c.drawCentredString(0, 0, "PREVIEW")
     c.restoreState()
 
-def preview_page_no_watermark(c, d):
+def preview_page(c, d, fonts):
+    later(c, d, fonts)
+    draw_watermark(c, fonts)
+
+_preview_stamps = {}
+
+def preview_stamp(fonts: Fonts) -> bytes:
+    """The PREVIEW watermark as a one-page PDF, built once per process and font set."""
+    stamp = _preview_stamps.get(fonts)
+    if stamp is None:
+        stamp = _preview_stamps[fonts] = render_page(lambda c: draw_watermark(c, fonts))
+    return stamp
+
+def preview_page_no_watermark(c, d, fonts):
     draw_frame(c)
-    c.setFont(BODY_FONT, 12)
+    c.setFont(fonts.body, 12)
     name_x = BORDER_INSET + 10
     name_y = PAGE_H - BORDER_INSET - 26
     c.drawString(name_x, name_y, "Name: ...........................................................          Date : ........................")
-    c.setFont(BODY_FONT, 10)
+    c.setFont(fonts.body, 10)
     c.drawCentredString(PAGE_W/2, 25, str(d.page))
 
 class TitlePage(Flowable):
@@ -299,7 +346,7 @@ class TitlePage(Flowable):
             c.setFont(font_name, font_size)
             line_h, descent = line_heights[i]
             try:
-                w = pdfmetrics.stringWidth(text, font_name, font_size)
+                w = text_width(text, font_name, font_size)
             except Exception:
                 w = font_size * len(text) * 0.5
             x = PAGE_W/2 - (w / 2)
@@ -310,11 +357,11 @@ class TitlePage(Flowable):
         c.restoreState()
 
 class UnderlinedAnswer(Flowable):
-    def __init__(self, text, width=400, fontName=None, fontSize=12, lineColor=colors.blue, leftIndent=0):
+    def __init__(self, text, width=400, fontName="Helvetica", fontSize=12, lineColor=colors.blue, leftIndent=0):
         super().__init__()
         self.text = text
         self.width = width
-        self.fontName = fontName or BODY_FONT
+        self.fontName = fontName
         self.fontSize = fontSize
         self.lineColor = lineColor
         self.leftIndent = leftIndent
@@ -337,45 +384,79 @@ class UnderlinedAnswer(Flowable):
 
 
 # ───────────────────  OPENAI HELPERS  ────────────────────────────
-@backoff.on_exception(backoff.expo, openai.RateLimitError, max_time=180)
-def _ask(prompt: str) -> str:
-   return openai.chat.completions.create(
-       model=MODEL,
-       messages=[{"role": "user", "content": prompt}],
-       temperature=0.7
-   ).choices[0].message.content
-
-def extract_json(md: str) -> list:
-   match = re.search(r"\[.*\]", md, re.S)
-   return json.loads(match.group()) if match else []
-
-def get_json(prompt: str) -> list:
+def round_plan(topic, note, ctx, remaining, attempts, switches, prompts):
+   """[(kind, prompt)] for one builder attempt.
+
+   `prompts` is ((kind, p_full), (simple_kind, p_simple)); `switches` is
+   (simple_switch, single_item_switch). With the job's speculation > 1,
+   every retry also sends speculation-1 alternates, alternating between the
+   other prompt and the chosen one, all for the same remaining count.
+   """
+   simple_switch, single_item_switch = switches
+   full, simple = prompts
+   speculation = ctx.config.get('speculation', 1)
+   size = lambda kind: ctx.rates.request_size(topic, kind, remaining)
+   if attempts > single_item_switch:
+       plan = [(simple[0], simple[1](topic, note, 1, ctx))]
+   else:
+       kind, fn = simple if attempts > simple_switch else full
+       plan = [(kind, fn(topic, note, size(kind), ctx))]
+   if attempts > 1 and speculation > 1:
+       others = [full, simple] if plan[0][0] == simple[0] else [simple, full]
+       for j in range(speculation - 1):
+           kind, fn = others[j % 2]
+           plan.append((kind, fn(topic, note, size(kind), ctx)))
+   return plan
+
+def stream_round(topic, plan, ctx, fmt: str, deck: list):
+   """Yield one attempt's items as they stream in; `fmt` selects the JSON schema (see llm_json).
+
+   Items from every request in `plan` are interleaved in the order they
+   complete, and breaking out of the loop stops all of them. Each item the
+   caller adds to `deck` is credited to the prompt type it came from in the
+   acceptance stats. When several requests race, an item repeating a
+   question already seen this round is skipped.
+   """
+   offered, kept = Counter(), Counter()
+   seen = set()
+   last, size = None, len(deck)
+   requests = [(prompt, response_format(fmt)) for _, prompt in plan]
    try:
-       response = _ask(prompt)
-       result = extract_json(response)
-       if not result:
-           print(f"⚠️  Warning: No JSON found in API response")
-       return result
-   except json.JSONDecodeError as e:
-       print(f"⚠️  JSON decode error: {e}")
-       return []
+       for i, item in ctx.client.iter_merged(requests):
+           if last is not None:
+               kept[last] += len(deck) - size
+               last = None
+           if len(plan) > 1 and isinstance(item, dict):
+               key = str(item.get("q") or item.get("statement") or "").strip().lower()
+               if key in seen: continue
+               seen.add(key)
+           last, size = plan[i][0], len(deck)
+           offered[last] += 1
+           yield item
    except Exception as e:
        print(f"⚠️  API error: {e}")
-       return []
+       return
+   finally:
+       if last is not None:
+           kept[last] += len(deck) - size
+       for kind in offered:
+           ctx.rates.record(topic, kind, offered[kind], kept[kind])
+   if not offered:
+       print(f"⚠️  Warning: No JSON found in API response")
 
 
 # ───────────────────  PROMPTS  ───────────────────────────────────
-def p_mcq(topic, note, n):
+def p_mcq(topic, note, n, ctx):
    return (
        f"Write EXACTLY {n} MCQs for Day 2 - Knowledge Builder: Multiple Choice Review on: {topic}. "
        f"Focus on concept recognition and key details. Target Bloom's levels: Understand/Apply. "
-       f"Ensure each question aligns with the {CURRICULUM_NAME} ({GRADE_LEVELS}) and the provided teacher note.\n"
+       f"Ensure each question aligns with the {ctx.curriculum_name} ({ctx.grade_levels}) and the provided teacher note.\n"
        f"Teacher note: {note}\n"
        'Return JSON list: {"q":"","correct":"","distractors":["","",""],"explanation":""}\n'
        "≤325 chars total per item. Randomise answer order."
    )
 
-def build_task_cards(topic, note, n=30):
+def build_task_cards(topic, note, ctx, n=30):
     deck = []
     attempts = 0
     max_attempts = 60
@@ -383,19 +464,12 @@ def build_task_cards(topic, note, n=30):
     single_item_switch = 18
     while len(deck) < n and attempts < max_attempts:
         attempts += 1
-        if attempts > single_item_switch:
-            prompt = p_mcq_simple(topic, note, 1)
-        elif attempts > simple_switch:
-            rem = n - len(deck)
-            prompt = p_mcq_simple(topic, note, rem)
-        else:
-            prompt = p_mcq(topic, note, n-len(deck))
-
-        items = get_json(prompt)
-        if not items: continue
+        plan = round_plan(topic, note, ctx, n - len(deck), attempts,
+                          (simple_switch, single_item_switch),
+                          (('task_card', p_mcq), ('task_card_simple', p_mcq_simple)))
 
         short_title = strip_curriculum_code(topic).upper()
-        for itm in items:
+        for itm in stream_round(topic, plan, ctx, 'task_card', deck):
             if not isinstance(itm, dict): continue
             q   = clean(itm.get("q", ""))
             ok  = clean(itm.get("correct", ""))
@@ -414,46 +488,46 @@ def build_task_cards(topic, note, n=30):
             if len(deck) == n: break
     return deck
 
-def p_tf(topic, note, n):
+def p_tf(topic, note, n, ctx):
    return (
        f"Write EXACTLY {n} True/False statements for Day 1 - Concept Check on: {topic}. "
        f"Focus on basic recall and misconception checks. Target Bloom's levels: Remember/Understand. "
-       f"Ensure alignment with the {CURRICULUM_NAME} ({GRADE_LEVELS}) and the teacher note.\n"
+       f"Ensure alignment with the {ctx.curriculum_name} ({ctx.grade_levels}) and the teacher note.\n"
        f"Teacher note: {note}\n"
        'Return JSON list: {"statement":"","answer":true/false,"explanation":""}\n'
        "If answer is false, give ≤15-word explanation, else \"\". ≤325 chars item."
    )
 
-def p_sa(topic, note, n):
+def p_sa(topic, note, n, ctx):
    return (
        f"Write EXACTLY {n} short-answer questions for Day 4 - Critical Thinking: Short Response on: {topic}. "
        f"Focus on explaining, connecting concepts, and applying reasoning. Target Bloom's levels: Apply/Analyze. "
-       f"Ensure each question aligns with the {CURRICULUM_NAME} ({GRADE_LEVELS}) and the teacher note.\n"
+       f"Ensure each question aligns with the {ctx.curriculum_name} ({ctx.grade_levels}) and the teacher note.\n"
        f"Teacher note: {note}\n"
        'Return JSON list: {"q":"","answer":""}\n'
        "Question ≤250 chars, answer ≤25 words."
    )
 
-def p_mcq_simple(topic, note, n):
+def p_mcq_simple(topic, note, n, ctx):
     return (
         f"Write EXACTLY {n} SHORT and SIMPLE MCQs on: {topic}. "
         f"Use concise stems (≤100 chars) and short options (≤40 chars). Keep language direct and avoid multi-part scenarios. "
         f"Return JSON list: {{\"q\":\"\",\"correct\":\"\",\"distractors\":[\"\",\"\",\"\"],\"explanation\":\"\"}}. Randomise order."
     )
 
-def p_tf_simple(topic, note, n):
+def p_tf_simple(topic, note, n, ctx):
     return (
         f"Write EXACTLY {n} SHORT True/False statements on: {topic}. "
         f"Make each statement direct and concise (≤120 chars). Return JSON list: {{\"statement\":\"\",\"answer\":true/false,\"explanation\":\"\"}}."
     )
 
-def p_sa_simple(topic, note, n):
+def p_sa_simple(topic, note, n, ctx):
     return (
         f"Write EXACTLY {n} SHORT-answer questions on: {topic}. "
         f"Keep questions concise (≤120 chars) and targeted. Return JSON list: {{\"q\":\"\",\"answer\":\"\"}}."
     )
 
-def build_mcq(topic, note, n=25):
+def build_mcq(topic, note, ctx, n=25):
     deck = []
     max_attempts = 20
     attempts = 0
@@ -461,17 +535,11 @@ def build_mcq(topic, note, n=25):
     single_item_switch = 12
     while len(deck) < n and attempts < max_attempts:
         attempts += 1
-        remaining = n - len(deck)
-        if attempts > single_item_switch:
-            prompt = p_mcq_simple(topic, note, 1)
-        elif attempts > simple_switch:
-            prompt = p_mcq_simple(topic, note, remaining)
-        else:
-            prompt = p_mcq(topic, note, remaining)
+        plan = round_plan(topic, note, ctx, n - len(deck), attempts,
+                          (simple_switch, single_item_switch),
+                          (('mcq', p_mcq), ('mcq_simple', p_mcq_simple)))
 
-        items = get_json(prompt)
-        if not items: continue
-        for itm in items:
+        for itm in stream_round(topic, plan, ctx, 'mcq', deck):
             if not isinstance(itm, dict): continue
             q   = clean(itm.get("q", ""))
             ok  = clean(itm.get("correct", ""))
@@ -490,7 +558,7 @@ def bool_to_str(val):
    if isinstance(val, str):  return val.strip().capitalize()
    return ""
 
-def build_tf(topic, note, n=25):
+def build_tf(topic, note, ctx, n=25):
     deck = []
     max_attempts = 20
     attempts = 0
@@ -498,16 +566,10 @@ def build_tf(topic, note, n=25):
     single_item_switch = 12
     while len(deck) < n and attempts < max_attempts:
         attempts += 1
-        remaining = n - len(deck)
-        if attempts > single_item_switch:
-            prompt = p_tf_simple(topic, note, 1)
-        elif attempts > simple_switch:
-            prompt = p_tf_simple(topic, note, remaining)
-        else:
-            prompt = p_tf(topic, note, remaining)
-        items = get_json(prompt)
-        if not items: continue
-        for itm in items:
+        plan = round_plan(topic, note, ctx, n - len(deck), attempts,
+                          (simple_switch, single_item_switch),
+                          (('tf', p_tf), ('tf_simple', p_tf_simple)))
+        for itm in stream_round(topic, plan, ctx, 'tf', deck):
             if not isinstance(itm, dict): continue
             stmt = clean(itm.get("statement", ""))
             ans  = bool_to_str(itm.get("answer", ""))
@@ -518,7 +580,7 @@ def build_tf(topic, note, n=25):
             if len(deck) == n: break
     return deck
 
-def build_sa(topic, note, n=25):
+def build_sa(topic, note, ctx, n=25):
     deck = []
     max_attempts = 20
     attempts = 0
@@ -526,16 +588,10 @@ def build_sa(topic, note, n=25):
     single_item_switch = 12
     while len(deck) < n and attempts < max_attempts:
         attempts += 1
-        remaining = n - len(deck)
-        if attempts > single_item_switch:
-            prompt = p_sa_simple(topic, note, 1)
-        elif attempts > simple_switch:
-            prompt = p_sa_simple(topic, note, remaining)
-        else:
-            prompt = p_sa(topic, note, remaining)
-        items = get_json(prompt)
-        if not items: continue
-        for itm in items:
+        plan = round_plan(topic, note, ctx, n - len(deck), attempts,
+                          (simple_switch, single_item_switch),
+                          (('sa', p_sa), ('sa_simple', p_sa_simple)))
+        for itm in stream_round(topic, plan, ctx, 'sa', deck):
             if not isinstance(itm, dict): continue
             q   = clean(itm.get("q", ""))
             ans = clean(itm.get("answer", ""))
@@ -544,15 +600,46 @@ def build_sa(topic, note, n=25):
             if len(deck) == n: break
     return deck
 
+def build_decks(topic, note, ctx):
+    """Build the MCQ, TF, SA and task-card decks for one subtopic.
+
+    Each builder is its own chain of OpenAI round-trips, so they are run on a
+    thread pool of up to the job's deck_concurrency workers instead of back
+    to back. Returns (mcq, tf, sa, task_cards) exactly as the builders
+    produce them.
+    """
+    concurrency = ctx.config.get('deck_concurrency', DECK_CONCURRENCY)
+    jobs = [
+        (build_mcq, DECK_REQUEST_SIZES['mcq']),
+        (build_tf, DECK_REQUEST_SIZES['tf']),
+        (build_sa, DECK_REQUEST_SIZES['sa']),
+        (build_task_cards, DECK_REQUEST_SIZES['task_cards']),
+    ]
+    if concurrency <= 1:
+        return tuple(fn(topic, note, ctx, n=n) for fn, n in jobs)
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(jobs))) as pool:
+        futures = [pool.submit(fn, topic, note, ctx, n=n) for fn, n in jobs]
+        return tuple(f.result() for f in futures)
+
+def first_attempt_prompts(topic, note, ctx):
+    """(prompt, response_format) each builder in build_decks sends on its first attempt."""
+    size = lambda kind, deck: ctx.rates.request_size(topic, kind, DECK_REQUEST_SIZES[deck])
+    return [
+        (p_mcq(topic, note, size('mcq', 'mcq'), ctx), response_format('mcq')),
+        (p_tf(topic, note, size('tf', 'tf'), ctx), response_format('tf')),
+        (p_sa(topic, note, size('sa', 'sa'), ctx), response_format('sa')),
+        (p_mcq(topic, note, size('task_card', 'task_cards'), ctx), response_format('task_card')),
+    ]
+
 # ───────────────────  PDF HELPERS  ───────────────────────────────
 def doc(path):
-   return SimpleDocTemplate(str(path), pagesize=letter,
+   return SimpleDocTemplate(pdf_target(path), pagesize=letter,
                             leftMargin=35, rightMargin=35,
                             topMargin=50,  bottomMargin=40)
 
-def sa_lines():
+def sa_lines(m):
     line = "_" * 85
-    return [Paragraph(line, ST["Line"]) for _ in range(2)]
+    return [m.para(line, "Line") for _ in range(2)]
 
 def normalize_deck(deck, expected=10):
     if not isinstance(deck, list): return deck
@@ -583,75 +670,82 @@ def pad_task_cards(deck, expected=30):
     return out
 
 # ───────────────────  WORKSHEET MAKERS  ──────────────────────────
-def make_mcq(ws_pdf, ans_pdf, main, sub, deck):
-    story=[Spacer(1,6), Paragraph(f"<b>{sub}</b>", ST["Doc"]), Spacer(1,8)]
+def make_mcq(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    first_page, later_pages = on_page(first, ctx), on_page(later, ctx)
+    story=[Spacer(1,6), m.para(f"<b>{sub}</b>", "Doc"), Spacer(1,8)]
     for i,(q,opts,_,_) in enumerate(deck,1):
-        blk=[Paragraph(f"{i}. {q}", ST["Q"])] + \
-             [Paragraph(f"{l}. {t}", ST["Opt"]) for l,t in zip("ABCD",opts)] + \
+        blk=[m.para(f"{i}. {q}", "Q")] + \
+             [m.para(f"{l}. {t}", "Opt") for l,t in zip("ABCD",opts)] + \
              [Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=first, onLaterPages=later)
+    doc(ws_pdf).build(story, onFirstPage=first_page, onLaterPages=later_pages)
 
     hdr=f"{sub} - Answer Sheet"
-    story=[Paragraph(hdr, ST["AnsH"]), Spacer(1,10)]
-    opt_indent = getattr(ST["Opt"], 'leftIndent', 0)
+    story=[m.para(hdr, "AnsH"), Spacer(1,10)]
+    opt_indent = getattr(m.styles["Opt"], 'leftIndent', 0)
     for i,(q,opts,ans,exp) in enumerate(deck,1):
-        story.append(Paragraph(f"{i}. {q}", ST["Q"]))
+        story.append(m.para(f"{i}. {q}", "Q"))
         for l,t in zip("ABCD",opts):
             text = f"{l}. {t}"
             if l == ans:
-                story.append(UnderlinedAnswer(text, fontName=BODY_FONT, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
+                story.append(UnderlinedAnswer(text, fontName=ctx.fonts.body, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
             else:
-                story.append(Paragraph(text, ST["Opt"]))
+                story.append(m.para(text, "Opt"))
         if exp:
-            story.append(Paragraph(f"Explanation: {exp}", ST["Expl"]))
+            story.append(m.para(f"Explanation: {exp}", "Expl"))
         story.append(Spacer(1,8))
-    doc(ans_pdf).build(story, onFirstPage=first, onLaterPages=later)
+    doc(ans_pdf).build(story, onFirstPage=first_page, onLaterPages=later_pages)
 
-def make_tf(ws_pdf, ans_pdf, main, sub, deck):
-    story = [Spacer(1,6), Paragraph(f"<b>{sub} – True/False</b>", ST["Doc"]), Spacer(1,8)]
+def make_tf(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    first_page, later_pages = on_page(first, ctx), on_page(later, ctx)
+    story = [Spacer(1,6), m.para(f"<b>{sub} – True/False</b>", "Doc"), Spacer(1,8)]
     for i, (stmt, _, _) in enumerate(deck, 1):
-        blk = [Paragraph(f"{i}. {stmt}", ST["Q"]),
-               Paragraph("A. True", ST["Opt"]),
-               Paragraph("B. False", ST["Opt"]),
+        blk = [m.para(f"{i}. {stmt}", "Q"),
+               m.para("A. True", "Opt"),
+               m.para("B. False", "Opt"),
                Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=first, onLaterPages=later)
+    doc(ws_pdf).build(story, onFirstPage=first_page, onLaterPages=later_pages)
 
     hdr = f"{sub} - Answer Sheet"
-    story = [Paragraph(hdr, ST["AnsH"]), Spacer(1,10)]
-    opt_indent = getattr(ST["Opt"], 'leftIndent', 0)
+    story = [m.para(hdr, "AnsH"), Spacer(1,10)]
+    opt_indent = getattr(m.styles["Opt"], 'leftIndent', 0)
     for i, (stmt, ans, exp) in enumerate(deck, 1):
-        story.append(Paragraph(f"{i}. {stmt}", ST["Q"]))
+        story.append(m.para(f"{i}. {stmt}", "Q"))
         a_text = "A. True"
         b_text = "B. False"
         if ans == "True":
-            story.append(UnderlinedAnswer(a_text, fontName=BODY_FONT, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
-            story.append(Paragraph(b_text, ST["Opt"]))
+            story.append(UnderlinedAnswer(a_text, fontName=ctx.fonts.body, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
+            story.append(m.para(b_text, "Opt"))
         else:
-            story.append(Paragraph(a_text, ST["Opt"]))
-            story.append(UnderlinedAnswer(b_text, fontName=BODY_FONT, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
+            story.append(m.para(a_text, "Opt"))
+            story.append(UnderlinedAnswer(b_text, fontName=ctx.fonts.body, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
         if ans == "False" and exp:
-            story.append(Paragraph(f"Explanation: {exp}", ST["Expl"]))
+            story.append(m.para(f"Explanation: {exp}", "Expl"))
         story.append(Spacer(1,8))
-    doc(ans_pdf).build(story, onFirstPage=first, onLaterPages=later)
+    doc(ans_pdf).build(story, onFirstPage=first_page, onLaterPages=later_pages)
 
-def make_sa(ws_pdf, ans_pdf, main, sub, deck):
-    story = [Spacer(1,6), Paragraph(f"<b>{sub} – Short Answer</b>", ST["Doc"]), Spacer(1,8)]
+def make_sa(ws_pdf, ans_pdf, main, sub, deck, ctx, model=None):
+    m = model or QuestionModel(ctx.styles)
+    first_page, later_pages = on_page(first, ctx), on_page(later, ctx)
+    story = [Spacer(1,6), m.para(f"<b>{sub} – Short Answer</b>", "Doc"), Spacer(1,8)]
     for i, (q, _) in enumerate(deck, 1):
-        blk = [Paragraph(f"{i}. {q}", ST["Q"])] + sa_lines() + [Spacer(1,12)]
+        blk = [m.para(f"{i}. {q}", "Q")] + sa_lines(m) + [Spacer(1,12)]
         story.append(KeepTogether(blk))
-    doc(ws_pdf).build(story, onFirstPage=first, onLaterPages=later)
+    doc(ws_pdf).build(story, onFirstPage=first_page, onLaterPages=later_pages)
 
     hdr = f"{sub} - Answer Sheet"
-    story = [Paragraph(hdr, ST["AnsH"]), Spacer(1,10)]
+    story = [m.para(hdr, "AnsH"), Spacer(1,10)]
     for i, (q, ans) in enumerate(deck, 1):
-        story.append(Paragraph(f"{i}. {q}", ST["Q"]))
-        story.append(Paragraph(ans, ST["Blue"]))
+        story.append(m.para(f"{i}. {q}", "Q"))
+        story.append(m.para(ans, "Blue"))
         story.append(Spacer(1,8))
-    doc(ans_pdf).build(story, onFirstPage=first, onLaterPages=later)
+    doc(ans_pdf).build(story, onFirstPage=first_page, onLaterPages=later_pages)
 
-def make_task_cards_pdf(cards, out_pdf, answer_pdf, main, sub, preview=False):
+def make_task_cards_pdf(cards, out_pdf, answer_pdf, main, sub, ctx, preview=False, model=None):
+    fonts = ctx.fonts
     margin = 36
     gutter = 12
     usable_w = PAGE_W - 2 * margin
@@ -661,7 +755,7 @@ def make_task_cards_pdf(cards, out_pdf, answer_pdf, main, sub, preview=False):
     card_w = (usable_w - gutter * (cols - 1)) / cols
     card_h = (usable_h - gutter * (rows - 1)) / rows
 
-    c = canvas.Canvas(str(out_pdf), pagesize=letter)
+    c = canvas.Canvas(pdf_target(out_pdf), pagesize=letter)
     c.setTitle(f"{sub} - Task Cards")
 
     per_page = cols * rows
@@ -672,13 +766,7 @@ def make_task_cards_pdf(cards, out_pdf, answer_pdf, main, sub, preview=False):
             if idx != 0:
                 c.showPage()
             if preview:
-                c.saveState()
-                c.setFont(BODY_FONT, 130)
-                c.setFillColor(colors.lightgrey)
-                c.translate(PAGE_W/2, PAGE_H/2)
-                c.rotate(45)
-                c.drawCentredString(0, 0, "PREVIEW")
-                c.restoreState()
+                draw_watermark(c, fonts)
         if pos_in_page == 0:
             c.setStrokeColor(colors.black)
             c.setDash(3,2)
@@ -702,7 +790,7 @@ def make_task_cards_pdf(cards, out_pdf, answer_pdf, main, sub, preview=False):
         hdr_h = 0.8 * 72
         hdr_y = y + card_h - hdr_h
         c.setFillColor(colors.black)
-        bold_font_candidates = [f"{TITLE_FONT}-Bold", f"{TITLE_FONT} Bold", "Helvetica-Bold", TITLE_FONT, BODY_FONT]
+        bold_font_candidates = [f"{fonts.title}-Bold", f"{fonts.title} Bold", "Helvetica-Bold", fonts.title, fonts.body]
         for bf in bold_font_candidates:
             try:
                 pdfmetrics.getFont(bf)
@@ -715,20 +803,7 @@ def make_task_cards_pdf(cards, out_pdf, answer_pdf, main, sub, preview=False):
                 except Exception:
                     continue
 
-        title_text = title.upper()
-        hdr_lines = []
-        words = title_text.split()
-        cur = ''
-        for w in words:
-            test = (cur + ' ' + w).strip()
-            if pdfmetrics.stringWidth(test, TITLE_FONT, 11) <= (card_w - 16):
-                cur = test
-            else:
-                hdr_lines.append(cur)
-                cur = w
-        if cur:
-            hdr_lines.append(cur)
-        hdr_lines = hdr_lines[:3]
+        hdr_lines = wrap_text(title.upper(), fonts.title, 11, card_w - 16)[:3]
         start_y = hdr_y + hdr_h - (hdr_h / 2) + (6 * (len(hdr_lines)-1))
         ty = start_y
         for ln in hdr_lines:
@@ -745,163 +820,155 @@ def make_task_cards_pdf(cards, out_pdf, answer_pdf, main, sub, preview=False):
         body_x = x + 8
         body_y = y + card_h - hdr_h - 18
         c.setFillColor(colors.black)
-        total_chars = len(q) + sum(len(o) for o in opts)
-        fsize = body_font(total_chars)
+        fsize = body_font(len(q) + sum(len(o) for o in opts))
         if fsize == 0: continue
-        c.setFont(BODY_FONT, fsize)
         if num is not None:
             q_text = f"{num:02d}. {q}"
         else:
             q_text = q
-        max_width = card_w - 16
-        lines = []
-        for part in q_text.split('\n'):
-            words = part.split()
-            cur = ''
-            for w in words:
-                test = (cur + ' ' + w).strip()
-                if pdfmetrics.stringWidth(test, BODY_FONT, fsize) <= max_width:
-                    cur = test
-                else:
-                    lines.append(cur)
-                    cur = w
-            if cur:
-                lines.append(cur)
+        max_height = body_y - (y + 8)
+        fsize, lines, opt_lines = fit_card_body(q_text, opts, fonts.body, fsize, card_w - 16, max_height)
+        c.setFont(fonts.body, fsize)
         ty = body_y
         for ln in lines:
             c.drawString(body_x, ty, ln)
             ty -= fsize + 2
         ty -= fsize
-        for label, opt in zip('ABCD', opts):
-            text = f"{label}. {opt}"
-            cur = ''
-            words = text.split()
-            for w in words:
-                test = (cur + ' ' + w).strip()
-                if pdfmetrics.stringWidth(test, BODY_FONT, fsize) <= max_width:
-                    cur = test
-                else:
-                    c.drawString(body_x, ty, cur)
-                    ty -= fsize + 2
-                    cur = w
-            if cur:
-                c.drawString(body_x, ty, cur)
-                ty -= fsize + 2
+        for ln in opt_lines:
+            c.drawString(body_x, ty, ln)
+            ty -= fsize + 2
 
     c.showPage()
     c.save()
 
-    story = [Paragraph(f"{sub} - Task Cards Answer Sheet", ST['AnsH']), Spacer(1,12)]
+    m = model or QuestionModel(ctx.styles)
+    story = [m.para(f"{sub} - Task Cards Answer Sheet", "AnsH"), Spacer(1,12)]
     for i, card in enumerate(cards, 1):
         if len(card) == 6:
             title, q, opts, ans, exp, num = card
         else:
             title, q, opts, ans, exp = card
             num = i
-        story.append(Paragraph(f"{num:02d}. {q}", ST['Q']))
+        story.append(m.para(f"{num:02d}. {q}", "Q"))
         letter_index = ord(ans) - ord('A') if isinstance(ans, str) and ans in 'ABCD' else 0
         correct_text = opts[letter_index]
-        story.append(Paragraph(f"{ans}. {correct_text}", ST['Blue']))
+        story.append(m.para(f"{ans}. {correct_text}", "Blue"))
         story.append(Spacer(1,6))
     if preview:
-        doc(answer_pdf).build(story, onFirstPage=preview_page, onLaterPages=preview_page)
+        doc(answer_pdf).build(story, onFirstPage=on_page(preview_page, ctx), onLaterPages=on_page(preview_page, ctx))
     else:
-        doc(answer_pdf).build(story, onFirstPage=first, onLaterPages=later)
+        doc(answer_pdf).build(story, onFirstPage=on_page(first, ctx), onLaterPages=on_page(later, ctx))
 
-def make_task_cards_intro_page(path, main, sub, count=30):
-    line_specs = [ (f"{count} Task Cards", TITLE_FONT, 36), ("Includes Answer Key with Explanations", BODY_FONT, 16) ]
+def make_task_cards_intro_page(path, main, sub, ctx, count=30):
+    line_specs = [ (f"{count} Task Cards", ctx.fonts.title, 36), ("Includes Answer Key with Explanations", ctx.fonts.body, 16) ]
     tp = TitlePage(line_specs)
-    docp = SimpleDocTemplate(str(path), pagesize=letter, leftMargin=35, rightMargin=35, topMargin=50, bottomMargin=40)
-    docp.build([tp], onFirstPage=preview_page_no_watermark, onLaterPages=preview_page_no_watermark)
-
-def make_full_preview(preview_path, main, tf_d, mcq_d, fill_d, sa_d, mr_tf=None, mr_mcq=None, mr_fill=None, mr_sa=None, scenario_d=None):
+    docp = SimpleDocTemplate(pdf_target(path), pagesize=letter, leftMargin=35, rightMargin=35, topMargin=50, bottomMargin=40)
+    on_plain = on_page(preview_page_no_watermark, ctx)
+    docp.build([tp], onFirstPage=on_plain, onLaterPages=on_plain)
+
+def make_preview_title(path, day_title, label, ctx, question_count=25, main=None, model=None):
+    """A combined-preview section title page; with `main` it is also the cover."""
+    m = model or QuestionModel(ctx.styles)
+    story = []
+    if main:
+        story += [m.para(f"<b>{main.upper()} – COMBINED PREVIEW</b>", "Doc"), Spacer(1,12)]
+    story += [Spacer(1, 294),
+              m.para(f"<b>{day_title}</b>", "PreviewTitleMain"),
+              m.para(f"<b>{question_count} {label}</b>", "PreviewTitleSub"),
+              m.para("<b>Includes Answer Key with Explanations</b>", "PreviewTitleSub")]
+    decorate = on_page(first_page_no_watermark if main else preview_page, ctx)
+    docp = SimpleDocTemplate(pdf_target(path), pagesize=letter, leftMargin=35, rightMargin=35, topMargin=50, bottomMargin=40)
+    docp.build(story, onFirstPage=decorate, onLaterPages=decorate)
+
+def make_full_preview(preview_path, main, tf_d, mcq_d, fill_d, sa_d, ctx, mr_tf=None, mr_mcq=None, mr_fill=None, mr_sa=None, scenario_d=None, model=None):
+    m = model or QuestionModel(ctx.styles)
     doc = BaseDocTemplate(
-        str(preview_path),
+        pdf_target(preview_path),
         pagesize=letter,
         leftMargin=35, rightMargin=35, topMargin=50, bottomMargin=40
     )
     frame = Frame(doc.leftMargin, doc.bottomMargin,
                   doc.width, doc.height, id='normal')
 
-    first_framed = PageTemplate(id='FirstFramed', frames=[frame], onPage=first_page_no_watermark)
-    framed = PageTemplate(id='Framed', frames=[frame], onPage=preview_page)
-    no_watermark = PageTemplate(id='NoWatermark', frames=[frame], onPage=preview_page_no_watermark)
+    first_framed = PageTemplate(id='FirstFramed', frames=[frame], onPage=on_page(first_page_no_watermark, ctx))
+    framed = PageTemplate(id='Framed', frames=[frame], onPage=on_page(preview_page, ctx))
+    no_watermark = PageTemplate(id='NoWatermark', frames=[frame], onPage=on_page(preview_page_no_watermark, ctx))
 
     doc.addPageTemplates([first_framed, framed, no_watermark])
 
     story = [NextPageTemplate('FirstFramed')]
-    story.append(Paragraph(f"<b>{main.upper()} – COMBINED PREVIEW</b>", ST["Doc"]))
+    story.append(m.para(f"<b>{main.upper()} – COMBINED PREVIEW</b>", "Doc"))
     story.append(Spacer(1,12))
     story.append(NextPageTemplate('Framed'))
 
     def push_title(day_title: str, label: str, question_count: int = 10):
         story.append(Spacer(1, 294))
-        story.append(Paragraph(f"<b>{day_title}</b>", ST["PreviewTitleMain"]))
-        story.append(Paragraph(f"<b>{question_count} {label}</b>", ST["PreviewTitleSub"]))
-        story.append(Paragraph("<b>Includes Answer Key with Explanations</b>", ST["PreviewTitleSub"]))
+        story.append(m.para(f"<b>{day_title}</b>", "PreviewTitleMain"))
+        story.append(m.para(f"<b>{question_count} {label}</b>", "PreviewTitleSub"))
+        story.append(m.para("<b>Includes Answer Key with Explanations</b>", "PreviewTitleSub"))
         story.append(PageBreak())
 
     push_title("True or False WorkSheet", "True or False Questions", 25)
-    story.append(Paragraph("True or False WorkSheet    ", ST["AnsH"]))
+    story.append(m.para("True or False WorkSheet    ", "AnsH"))
     for i,(stmt,_,_) in enumerate(tf_d,1):
-        blk=[Paragraph(f"{i}. {stmt}", ST["Q"]),
-             Paragraph("A. True", ST["Opt"]),
-             Paragraph("B. False", ST["Opt"]),
+        blk=[m.para(f"{i}. {stmt}", "Q"),
+             m.para("A. True", "Opt"),
+             m.para("B. False", "Opt"),
              Spacer(1,12)]
         story.append(KeepTogether(blk))
     story.append(PageBreak())
 
-    story.append(Paragraph("True or False - Answer Sheet    ", ST["AnsH"]))
-    opt_indent = getattr(ST["Opt"], 'leftIndent', 0)
+    story.append(m.para("True or False - Answer Sheet    ", "AnsH"))
+    opt_indent = getattr(m.styles["Opt"], 'leftIndent', 0)
     for i,(stmt,ans,exp) in enumerate(tf_d,1):
-        blk=[Paragraph(f"{i}. {stmt}", ST["Q"])]
+        blk=[m.para(f"{i}. {stmt}", "Q")]
         if ans == "True":
-            blk.append(UnderlinedAnswer("A. True", fontName=BODY_FONT, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
-            blk.append(Paragraph("B. False", ST["Opt"]))
+            blk.append(UnderlinedAnswer("A. True", fontName=ctx.fonts.body, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
+            blk.append(m.para("B. False", "Opt"))
         else:
-            blk.append(Paragraph("A. True", ST["Opt"]))
-            blk.append(UnderlinedAnswer("B. False", fontName=BODY_FONT, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
+            blk.append(m.para("A. True", "Opt"))
+            blk.append(UnderlinedAnswer("B. False", fontName=ctx.fonts.body, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
         if ans=="False" and exp:
-            blk.append(Paragraph(f"Explanation: {exp}", ST["Expl"]))
+            blk.append(m.para(f"Explanation: {exp}", "Expl"))
         blk.append(Spacer(1,8))
         story.append(KeepTogether(blk))
     story.append(PageBreak())
 
     push_title("Multiple Choice Questions WorkSheet", "Multiple Choice Type Questions", 25)
-    story.append(Paragraph("Multiple Choice Questions WorkSheet    ", ST["AnsH"]))
+    story.append(m.para("Multiple Choice Questions WorkSheet    ", "AnsH"))
     for i,(q,opts,_,_) in enumerate(mcq_d,1):
-        blk=[Paragraph(f"{i}. {q}", ST["Q"])]
-        blk += [Paragraph(f"{l}. {t}", ST["Opt"]) for l,t in zip("ABCD",opts)]
+        blk=[m.para(f"{i}. {q}", "Q")]
+        blk += [m.para(f"{l}. {t}", "Opt") for l,t in zip("ABCD",opts)]
         blk.append(Spacer(1,12))
         story.append(KeepTogether(blk))
     story.append(PageBreak())
 
-    story.append(Paragraph("Multiple Choice - Answer Sheet    ", ST["AnsH"]))
-    opt_indent = getattr(ST["Opt"], 'leftIndent', 0)
+    story.append(m.para("Multiple Choice - Answer Sheet    ", "AnsH"))
+    opt_indent = getattr(m.styles["Opt"], 'leftIndent', 0)
     for i,(q,opts,ans,exp) in enumerate(mcq_d,1):
-        blk=[Paragraph(f"{i}. {q}", ST["Q"])]
+        blk=[m.para(f"{i}. {q}", "Q")]
         for l,t in zip("ABCD",opts):
             text = f"{l}. {t}"
             if l == ans:
-                blk.append(UnderlinedAnswer(text, fontName=BODY_FONT, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
+                blk.append(UnderlinedAnswer(text, fontName=ctx.fonts.body, fontSize=12, lineColor=colors.blue, leftIndent=opt_indent))
             else:
-                blk.append(Paragraph(text, ST["Opt"]))
-        blk.append(Paragraph(f"Explanation: {exp}", ST["Expl"]))
+                blk.append(m.para(text, "Opt"))
+        blk.append(m.para(f"Explanation: {exp}", "Expl"))
         blk.append(Spacer(1,8))
         story.append(KeepTogether(blk))
     story.append(PageBreak())
 
     push_title("Short Answer WorkSheet", "Short Answer Type Questions", 25)
-    story.append(Paragraph("Short Answer WorkSheet    ", ST["AnsH"]))
+    story.append(m.para("Short Answer WorkSheet    ", "AnsH"))
     for i,(q,_) in enumerate(sa_d,1):
-        blk=[Paragraph(f"{i}. {q}", ST["Q"]) ] + sa_lines() + [Spacer(1,12)]
+        blk=[m.para(f"{i}. {q}", "Q") ] + sa_lines(m) + [Spacer(1,12)]
         story.append(KeepTogether(blk))
     story.append(PageBreak())
 
-    story.append(Paragraph("Short Answer - Answer Sheet    ", ST["AnsH"]))
+    story.append(m.para("Short Answer - Answer Sheet    ", "AnsH"))
     for i,(q,ans) in enumerate(sa_d,1):
-        story.append(Paragraph(f"{i}. {q}", ST["Q"]))
-        story.append(Paragraph(ans, ST["Blue"]))
+        story.append(m.para(f"{i}. {q}", "Q"))
+        story.append(m.para(ans, "Blue"))
         story.append(Spacer(1,8))
     story.append(PageBreak())
 
@@ -926,29 +993,22 @@ class CurriculumData:
 
 def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
     try:
-        df_raw = pd.read_excel(excel_path, header=None)
+        sheet = CurriculumSheet(excel_path)
         all_curricula = []
-        curriculum_start_rows = []
-        for idx in range(len(df_raw)):
-            first_col = str(df_raw.iloc[idx, 0]).strip() if pd.notna(df_raw.iloc[idx, 0]) else ''
-            if first_col.lower().startswith('subject name'):
-                curriculum_start_rows.append(idx)
-        
-        if not curriculum_start_rows:
-            curriculum_start_rows = [0]
+        curriculum_start_rows = sheet.markers or [0]
         
         for curr_idx, start_row in enumerate(curriculum_start_rows):
-            end_row = curriculum_start_rows[curr_idx + 1] if curr_idx + 1 < len(curriculum_start_rows) else len(df_raw)
-            first_cell = str(df_raw.iloc[start_row, 0]).strip() if pd.notna(df_raw.iloc[start_row, 0]) else ""
+            end_row = curriculum_start_rows[curr_idx + 1] if curr_idx + 1 < len(curriculum_start_rows) else sheet.n_rows
+            first_cell = sheet.text[0][start_row]
             
             if first_cell.lower().startswith('subject name'):
-                subject_name = str(df_raw.iloc[start_row, 1]).strip() if pd.notna(df_raw.iloc[start_row, 1]) else "Unknown Subject"
-                grade_level = str(df_raw.iloc[start_row + 1, 1]).strip() if pd.notna(df_raw.iloc[start_row + 1, 1]) else "Unknown Grade"
-                curriculum_name = str(df_raw.iloc[start_row + 2, 1]).strip() if pd.notna(df_raw.iloc[start_row + 2, 1]) else "Unknown Curriculum"
+                subject_name = sheet.value(start_row, 1, "Unknown Subject")
+                grade_level = sheet.value(start_row + 1, 1, "Unknown Grade")
+                curriculum_name = sheet.value(start_row + 2, 1, "Unknown Curriculum")
             else:
                 subject_name = re.sub(r'^Subject Name\s*-\s*', '', first_cell, flags=re.IGNORECASE).strip()
-                grade_level = re.sub(r'^Grade level\s*-\s*', '', str(df_raw.iloc[start_row + 1, 0]).strip(), flags=re.IGNORECASE).strip()
-                curriculum_name = re.sub(r'^Curriculum\s*-\s*', '', str(df_raw.iloc[start_row + 2, 0]).strip(), flags=re.IGNORECASE).strip()
+                grade_level = re.sub(r'^Grade level\s*-\s*', '', sheet.value(start_row + 1, 0, 'nan'), flags=re.IGNORECASE).strip()
+                curriculum_name = re.sub(r'^Curriculum\s*-\s*', '', sheet.value(start_row + 2, 0, 'nan'), flags=re.IGNORECASE).strip()
             
             curriculum_data = CurriculumData(subject_name, grade_level, curriculum_name)
             unit_index = 0
@@ -957,18 +1017,11 @@ def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
             in_data_section = False
             
             for idx in range(start_row + 3, end_row):
-                row = df_raw.iloc[idx]
-                first_col = str(row[0]).strip() if pd.notna(row[0]) else ''
-                if first_col.lower().startswith('subject name'): break
-                row_values = [str(val).strip().upper() for val in row.values if pd.notna(val)]
-                is_header = any(h in row_values for h in ['NO', 'TITLE', 'STANDARD', 'NOTE'])
-                
-                if is_header:
+                if sheet.header[idx]:
                     in_data_section = True
                     continue
                 
-                row_empty = all(pd.isna(val) or str(val).strip() == '' for val in row.values)
-                if row_empty and in_data_section:
+                if sheet.empty[idx] and in_data_section:
                     if current_unit_title and current_subtopics:
                         unit_index += 1
                         curriculum_data.units.append((unit_index, current_unit_title, current_subtopics))
@@ -977,26 +1030,15 @@ def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
                     continue
                 
                 if not in_data_section:
+                    first_col = sheet.text[0][idx]
                     if first_col and len(first_col) > 3:
                         current_unit_title = first_col
-                else:
-                    if len(row) >= 3:
-                        no_val = row[0]
-                        standard_val = row[1]
-                        title_val = row[2]
-                        note_val = row[3] if len(row) > 3 else ''
-                        try:
-                            sub_idx = int(float(no_val)) if pd.notna(no_val) else len(current_subtopics) + 1
-                        except (ValueError, TypeError):
-                            sub_idx = len(current_subtopics) + 1
-                        title = str(title_val).strip() if pd.notna(title_val) else ''
-                        if pd.notna(standard_val):
-                            standard = str(standard_val).strip()
-                            if standard and standard != '':
-                                title = f"{standard} — {title}"
-                        note = str(note_val).strip() if pd.notna(note_val) else ''
-                        if title and title != 'nan' and len(title) > 2:
-                            current_subtopics.append((sub_idx, title, note))
+                elif sheet.n_cols >= 3:
+                    sub_idx, title, note = sheet.subtopic(idx, " — ")
+                    if sub_idx is None:
+                        sub_idx = len(current_subtopics) + 1
+                    if title and title != 'nan' and len(title) > 2:
+                        current_subtopics.append((sub_idx, title, note))
             
             if current_unit_title and current_subtopics:
                 unit_index += 1
@@ -1011,43 +1053,208 @@ def load_curriculum_from_excel(excel_path: str) -> List[CurriculumData]:
     except Exception as e:
         raise RuntimeError(f"Error loading curriculum: {e}")
 
+# ───────────────────  SUBTOPIC PIPELINE STAGES  ──────────────────────────────
+def redistribute_correct_positions(mcq_deck, tc_deck):
+    total = len(mcq_deck) + len(tc_deck)
+    if total == 0: return mcq_deck, tc_deck
+    base = total // 4
+    rem = total % 4
+    letters = []
+    for i, ch in enumerate('ABCD'):
+        cnt = base + (1 if i < rem else 0)
+        letters.extend([ch] * cnt)
+    random.shuffle(letters)
+
+    def rotate_to(opts, correct_text, desired_index):
+        try:
+            cur = opts.index(correct_text)
+        except ValueError:
+            return opts
+        shift = (desired_index - cur) % len(opts)
+        if shift == 0: return opts
+        return opts[shift:] + opts[:shift]
+
+    idx = 0
+    new_mcq = []
+    for q, opts, letter, exp in mcq_deck:
+        correct_text = opts[ord(letter) - ord('A')] if isinstance(letter, str) and letter in 'ABCD' else opts[0]
+        desired_letter = letters[idx]
+        desired_index = ord(desired_letter) - ord('A')
+        new_opts = rotate_to(list(opts), correct_text, desired_index)
+        new_letter = "ABCD"[new_opts.index(correct_text)]
+        new_mcq.append((q, new_opts, new_letter, exp))
+        idx += 1
+
+    new_tc = []
+    for title, q, opts, letter, exp, num in tc_deck:
+        correct_text = opts[ord(letter) - ord('A')] if isinstance(letter, str) and letter in 'ABCD' else opts[0]
+        desired_letter = letters[idx]
+        desired_index = ord(desired_letter) - ord('A')
+        new_opts = rotate_to(list(opts), correct_text, desired_index)
+        new_letter = "ABCD"[new_opts.index(correct_text)]
+        new_tc.append((title, q, new_opts, new_letter, exp, num))
+        idx += 1
+    return new_mcq, new_tc
+
+def fetch_subtopic(job):
+    """Pipeline stage 1: LLM round-trips for every deck of a subtopic."""
+    mcq, tf, sa, task_cards = build_decks(job['topic'], job['note'], job['ctx'])
+
+    mcq = normalize_deck(mcq, expected=25)
+    tf  = normalize_deck(tf, expected=25)
+    sa  = normalize_deck(sa, expected=25)
+    task_cards = pad_task_cards(task_cards, expected=30)
+
+    mcq, task_cards = redistribute_correct_positions(mcq, task_cards)
+    job['decks'] = (mcq, tf, sa, task_cards)
+    return job
+
+def render_subtopic(job):
+    """Worksheet, answer sheet and task-card PDFs, rendered into job['pdfs']."""
+    mcq, tf, sa, task_cards = job['decks']
+    ctx = job['ctx']
+    m_t = job['unit_title']
+    sub_path = job['sub_path']
+
+    tf_dir    = f"{sub_path}/01. True or False Questions Worksheet"
+    mcq_dir   = f"{sub_path}/02. Multiple Choice Questions Worksheet"
+    sa_dir    = f"{sub_path}/03. Short Answer Type Questions Worksheet"
+    tc_dir    = f"{sub_path}/04. Task Cards"
+    prev_dir  = f"{sub_path}/PREVIEW PDFs (Do not Upload This)"
+
+    display_sub = strip_curriculum_code(job['topic'])
+    base = safe_name(display_sub)
+    # Shared with merge_subtopic_preview for the preview's title pages.
+    model = QuestionModel(ctx.styles)
+    pdfs = {key: (io.BytesIO(), io.BytesIO()) for key in ('tf', 'mcq', 'sa', 'task_cards')}
+
+    make_mcq(*pdfs['mcq'], m_t, display_sub, mcq, ctx, model=model)
+    make_tf(*pdfs['tf'], m_t, display_sub, tf, ctx, model=model)
+    make_sa(*pdfs['sa'], m_t, display_sub, sa, ctx, model=model)
+    make_task_cards_pdf(task_cards, *pdfs['task_cards'], m_t, display_sub, ctx, preview=False, model=model)
+
+    job['model'] = model
+    job['display_sub'] = display_sub
+    job['pdfs'] = {key: (ws.getvalue(), ans.getvalue()) for key, (ws, ans) in pdfs.items()}
+    job['files'] = [
+        (f"{tf_dir}/{base} – True or False Worksheet.pdf", job['pdfs']['tf'][0]),
+        (f"{tf_dir}/{base} – True or False Answer Sheet.pdf", job['pdfs']['tf'][1]),
+        (f"{mcq_dir}/{base} – Multiple Choice Worksheet.pdf", job['pdfs']['mcq'][0]),
+        (f"{mcq_dir}/{base} – Multiple Choice Answer Sheet.pdf", job['pdfs']['mcq'][1]),
+        (f"{sa_dir}/{base} – Short Answer Worksheet.pdf", job['pdfs']['sa'][0]),
+        (f"{sa_dir}/{base} – Short Answer Answer Sheet.pdf", job['pdfs']['sa'][1]),
+        (f"{tc_dir}/{base} – Task Cards.pdf", job['pdfs']['task_cards'][0]),
+        (f"{tc_dir}/{base} – Task Cards Answer Sheet.pdf", job['pdfs']['task_cards'][1]),
+    ]
+    job['final_preview'] = f"{prev_dir}/{base} – Preview with Task Cards.pdf"
+    return job
+
+def merge_subtopic_preview(job):
+    """
+    Combined preview with task cards, composed from the pages render_subtopic
+    just rendered: each deck's worksheet and answer sheet behind a section
+    title page, with the PREVIEW watermark stamped under every page.
+    """
+    mcq, tf, sa, _ = job['decks']
+    ctx = job['ctx']
+    m_t = job['unit_title']
+    display_sub = job['display_sub']
+    model = job.get('model')
+    pdfs = job['pdfs']
+
+    def title(day_title, label, main=None):
+        buf = io.BytesIO()
+        make_preview_title(buf, day_title, label, ctx, 25, main=main, model=model)
+        return buf.getvalue()
+
+    try:
+        stamp = preview_stamp(ctx.fonts)
+        intro = io.BytesIO()
+        make_task_cards_intro_page(intro, m_t, display_sub, ctx, count=30)
+        parts = []
+        for key, day_title, label, main in (
+                ('tf', "True or False WorkSheet", "True or False Questions", m_t),
+                ('mcq', "Multiple Choice Questions WorkSheet", "Multiple Choice Type Questions", None),
+                ('sa', "Short Answer WorkSheet", "Short Answer Type Questions", None)):
+            ws, ans = pdfs[key]
+            parts += [(title(day_title, label, main), None), (ws, stamp), (ans, stamp)]
+        tc_ws, tc_ans = pdfs['task_cards']
+        parts += [(intro.getvalue(), None), (tc_ws, stamp), (tc_ans, stamp)]
+        preview = compose(parts)
+
+    except Exception as e:
+        print(f"⚠️  Could not produce merged preview: {e}")
+        buf = io.BytesIO()
+        try:
+            make_full_preview(buf, m_t, tf, mcq, None, sa, ctx, model=model)
+            preview = buf.getvalue()
+        except Exception:
+            preview = None
+
+    if preview:
+        job['files'].append((job['final_preview'], preview))
+    return job
+
+def render_files(job):
+    """Every PDF for one subtopic as (arcname, bytes); runs in a render worker process."""
+    job['ctx'] = GenerationContext(job['fonts'], get_styles(job['fonts']))
+    return merge_subtopic_preview(render_subtopic(job))['files']
+
+
 # ───────────────────  MAIN GENERATION FUNCTION  ──────────────────────────────────────
-def generate_worksheets(excel_path: str, output_dir: str, api_key: str):
+def generate_worksheets(excel_path: str, output_dir: str, api_key: str,
+                        deck_concurrency: int = DECK_CONCURRENCY,
+                        subtopic_concurrency: int = SUBTOPIC_CONCURRENCY,
+                        max_in_flight: int = MAX_IN_FLIGHT,
+                        cache_mode: str = CACHE_MODE,
+                        mode: str = 'online',
+                        speculation: int = SPECULATIVE_REQUESTS,
+                        materialize_output: bool = MATERIALIZE_OUTPUT,
+                        resume: bool = RESUME):
     """
     Main entry point for generating worksheets.
     Yields progress updates and results.
-    """
-    global openai, CURRICULUM_NAME, GRADE_LEVELS, TITLE_FONT, BODY_FONT, EXPL_FONT, ST
-    
-    openai.api_key = api_key
-    if not openai.api_key:
-        raise ValueError("OpenAI API Key is required")
 
-    # Initialize fonts and styles
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    TITLE_FONT, BODY_FONT, EXPL_FONT = register_fonts(font_dir=script_dir)
-    ST = get_styles()
+    deck_concurrency caps how many deck builders run at once per subtopic;
+    subtopic_concurrency caps how many subtopics are in the LLM stage at once;
+    max_in_flight caps this job's outstanding OpenAI completions;
+    cache_mode ('use', 'refresh' or 'bypass') controls the LLM response cache;
+    mode='batch' sends every first-attempt prompt through the Batch API first;
+    speculation > 1 races that many requests on each deck retry.
+    'result' events arrive in completion order, with a monotonic 'progress',
+    and carry the subtopic's PDFs as 'files' ((arcname, bytes) pairs relative
+    to output_dir; the subtopic folder is 'arcdir'). materialize_output also
+    writes them under output_dir. With resume, subtopics finished by an
+    earlier run (see checkpoints.py) are replayed first without LLM calls.
+    """
+    if mode not in GENERATION_MODES:
+        raise ValueError(f"mode must be one of {GENERATION_MODES}")
+    client = LLMClient(api_key, model=MODEL, max_in_flight=max_in_flight,
+                       cache_mode=cache_mode)
+    rates = AcceptanceRates(version=PROMPT_VERSION)
+    speculation = max(1, min(int(speculation), MAX_SPECULATIVE_REQUESTS))
+    pool = render_pool(register_fonts)
+
+    fonts = register_fonts()
+    checkpoints = JobCheckpoints('academy', PROMPT_VERSION, cache_mode, resume,
+                                 render_version=render_version(__file__, fonts))
+    ctx = GenerationContext(fonts, get_styles(fonts), client, rates,
+                            CURRICULUM_NAME, GRADE_LEVELS,
+                            speculation=speculation, deck_concurrency=deck_concurrency)
 
     yield {'type': 'progress', 'message': 'Loading curriculum...'}
     all_curricula = load_curriculum_from_excel(excel_path)
     
-    root_folder = pathlib.Path(output_dir)
-    root_folder.mkdir(parents=True, exist_ok=True)
-    
     total_units = sum(len(c.units) for c in all_curricula)
     total_subtopics = sum(len(subs) for c in all_curricula for _, _, subs in c.units)
     
     yield {'type': 'progress', 'message': f'Found {total_units} units with {total_subtopics} subtopics.'}
 
-    processed_count = 0
-
-    for curriculum_idx, CURRICULUM_DATA in enumerate(all_curricula, 1):
-        CURRICULUM_NAME = CURRICULUM_DATA.curriculum_name
-        GRADE_LEVELS = CURRICULUM_DATA.grade_level
-        
+    jobs = []
+    for CURRICULUM_DATA in all_curricula:
+        curriculum_ctx = ctx.for_curriculum(CURRICULUM_DATA)
         main_folder_name = f"{safe_name(CURRICULUM_DATA.grade_level)} - {safe_name(CURRICULUM_DATA.curriculum_name)} - {safe_name(CURRICULUM_DATA.subject_name)}"
-        main_dir = root_folder / main_folder_name
-        main_dir.mkdir(exist_ok=True)
+        main_dir = pathlib.PurePosixPath(main_folder_name)
         
         for m_i, m_t, subs in CURRICULUM_DATA.units:
             if " - " in m_t or " – " in m_t:
@@ -1062,144 +1269,23 @@ def generate_worksheets(excel_path: str, output_dir: str, api_key: str):
                 unit_folder_name = f"{m_i:02d}. {m_t}"
             
             unit_dir = main_dir / safe_name(unit_folder_name)
-            unit_dir.mkdir(exist_ok=True)
 
             for sub in subs:
                 s_i, s_t = sub[:2]
                 note = sub[2] if len(sub) > 2 else ""
-
-                yield {'type': 'progress', 'message': f'Generating: {s_t}'}
-
-                sub_dir = unit_dir / safe_name(f"{s_i:02d}. {s_t}")
-                sub_dir.mkdir(exist_ok=True)
-                
-                tf_dir    = sub_dir / "01. True or False Questions Worksheet"
-                tf_dir.mkdir(exist_ok=True)
-                mcq_dir   = sub_dir / "02. Multiple Choice Questions Worksheet"
-                mcq_dir.mkdir(exist_ok=True)
-                sa_dir    = sub_dir / "03. Short Answer Type Questions Worksheet"
-                sa_dir.mkdir(exist_ok=True)
-                tc_dir    = sub_dir / "04. Task Cards"
-                tc_dir.mkdir(exist_ok=True)
-                prev_dir  = sub_dir / "PREVIEW PDFs (Do not Upload This)"
-                prev_dir.mkdir(exist_ok=True)
-
-                mcq = build_mcq(s_t, note, n=30)
-                tf  = build_tf (s_t, note, n=30)
-                sa  = build_sa (s_t, note, n=30)
-                
-                mcq = normalize_deck(mcq, expected=25)
-                tf  = normalize_deck(tf, expected=25)
-                sa  = normalize_deck(sa, expected=25)
-                
-                task_cards = build_task_cards(s_t, note, n=35)
-                task_cards = pad_task_cards(task_cards, expected=30)
-                
-                def redistribute_correct_positions(mcq_deck, tc_deck):
-                    total = len(mcq_deck) + len(tc_deck)
-                    if total == 0: return mcq_deck, tc_deck
-                    base = total // 4
-                    rem = total % 4
-                    letters = []
-                    for i, ch in enumerate('ABCD'):
-                        cnt = base + (1 if i < rem else 0)
-                        letters.extend([ch] * cnt)
-                    random.shuffle(letters)
-
-                    def rotate_to(opts, correct_text, desired_index):
-                        try:
-                            cur = opts.index(correct_text)
-                        except ValueError:
-                            return opts
-                        shift = (desired_index - cur) % len(opts)
-                        if shift == 0: return opts
-                        return opts[shift:] + opts[:shift]
-
-                    idx = 0
-                    new_mcq = []
-                    for q, opts, letter, exp in mcq_deck:
-                        correct_text = opts[ord(letter) - ord('A')] if isinstance(letter, str) and letter in 'ABCD' else opts[0]
-                        desired_letter = letters[idx]
-                        desired_index = ord(desired_letter) - ord('A')
-                        new_opts = rotate_to(list(opts), correct_text, desired_index)
-                        new_letter = "ABCD"[new_opts.index(correct_text)]
-                        new_mcq.append((q, new_opts, new_letter, exp))
-                        idx += 1
-
-                    new_tc = []
-                    for title, q, opts, letter, exp, num in tc_deck:
-                        correct_text = opts[ord(letter) - ord('A')] if isinstance(letter, str) and letter in 'ABCD' else opts[0]
-                        desired_letter = letters[idx]
-                        desired_index = ord(desired_letter) - ord('A')
-                        new_opts = rotate_to(list(opts), correct_text, desired_index)
-                        new_letter = "ABCD"[new_opts.index(correct_text)]
-                        new_tc.append((title, q, new_opts, new_letter, exp, num))
-                        idx += 1
-                    return new_mcq, new_tc
-
-                mcq, task_cards = redistribute_correct_positions(mcq, task_cards)
-
-                display_sub = strip_curriculum_code(s_t)
-                base = safe_name(display_sub)
-                
-                make_mcq(mcq_dir / f"{base} – Multiple Choice Worksheet.pdf",
-                        mcq_dir / f"{base} – Multiple Choice Answer Sheet.pdf",
-                        m_t, display_sub, mcq)
-                make_tf(tf_dir / f"{base} – True or False Worksheet.pdf",
-                        tf_dir / f"{base} – True or False Answer Sheet.pdf",
-                        m_t, display_sub, tf)
-                make_sa(sa_dir / f"{base} – Short Answer Worksheet.pdf",
-                        sa_dir / f"{base} – Short Answer Answer Sheet.pdf",
-                        m_t, display_sub, sa)
-
-                tc_out = tc_dir / f"{base} – Task Cards.pdf"
-                tc_ans = tc_dir / f"{base} – Task Cards Answer Sheet.pdf"
-                make_task_cards_pdf(task_cards, tc_out, tc_ans, m_t, display_sub, preview=False)
-
-                final_preview = prev_dir / f"{base} – Preview with Task Cards.pdf"
-
-                try:
-                    if PdfMerger is None:
-                        raise RuntimeError("PDF merger not available")
-
-                    tmp_preview = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-                    tmp_intro = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-                    tmp_tc_preview = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-                    tmp_tc_ans_preview = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-                    tmp_preview.close(); tmp_intro.close(); tmp_tc_preview.close(); tmp_tc_ans_preview.close()
-
-                    make_full_preview(tmp_preview.name, m_t, tf, mcq, None, sa)
-                    make_task_cards_intro_page(tmp_intro.name, m_t, display_sub, count=30)
-                    make_task_cards_pdf(task_cards, tmp_tc_preview.name, tmp_tc_ans_preview.name, m_t, display_sub, preview=True)
-
-                    merger = PdfMerger()
-                    merger.append(tmp_preview.name)
-                    merger.append(tmp_intro.name)
-                    merger.append(tmp_tc_preview.name)
-                    merger.append(tmp_tc_ans_preview.name)
-                    merger.write(str(final_preview))
-                    merger.close()
-
-                except Exception as e:
-                    print(f"⚠️  Could not produce merged preview: {e}")
-                    try:
-                        make_full_preview(final_preview, m_t, tf, mcq, None, sa)
-                    except Exception:
-                        pass
-                finally:
-                    for p in (locals().get('tmp_preview'), locals().get('tmp_intro'), 
-                             locals().get('tmp_tc_preview'), locals().get('tmp_tc_ans_preview')):
-                        try:
-                            if p: os.unlink(p.name)
-                        except Exception:
-                            pass
-                
-                processed_count += 1
-                yield {
-                    'type': 'result',
+                jobs.append({
                     'topic': s_t,
-                    'path': str(sub_dir),
-                    'progress': f"{processed_count}/{total_subtopics}"
-                }
-
-    yield {'type': 'complete', 'path': str(root_folder)}
+                    'note': note,
+                    'unit_title': m_t,
+                    'sub_path': str(unit_dir / safe_name(f"{s_i:02d}. {s_t}")),
+                    'checkpoint': checkpoints.key(CURRICULUM_DATA, m_t, s_t, note),
+                    'ctx': curriculum_ctx,
+                })
+
+    stages = [
+        Stage('fetch', fetch_subtopic, workers=subtopic_concurrency),
+        Stage('render', render_stage(pool, render_files), workers=pool_workers(pool)),
+    ]
+    batch = (client, first_attempt_prompts) if mode == 'batch' else None
+    yield from run_subtopic_jobs(jobs, stages, checkpoints, output_dir, materialize_output,
+                                 batch=batch, queue_size=PIPELINE_QUEUE_SIZE)